@@ -0,0 +1,163 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+import sqlite3
+
+from aiogram.types import InlineKeyboardMarkup
+
+from db import Database
+from inline_keyboards import poll_options_keyboard
+
+
+@dataclass
+class ActivePoll:
+    id: int
+    group_id: int
+    question: str
+    expires_at: datetime
+    options: list[tuple[int, str]]
+    keyboard: InlineKeyboardMarkup
+    # users.id студентов, которые уже ответили
+    answered: set[int] = field(default_factory=set)
+
+    @property
+    def is_expired(self) -> bool:
+        return self.expires_at <= datetime.now()
+
+
+def last_answer_id(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM user_options").fetchone()[0]
+
+
+def read_active_polls(conn: sqlite3.Connection) -> tuple[list[tuple], dict[int, list[tuple[int, str]]], dict[int, set[int]], int]:
+    """
+    Активные опросы, их варианты и ответившие студенты
+
+    Returns:
+        tuple: опросы (id, group_id, question, expires_at), варианты и users.id
+            ответивших по id опроса, id последнего ответа
+    """
+    # Запросы начинаются с частичного индекса активных опросов (CROSS JOIN
+    # фиксирует порядок таблиц), поэтому не растут с числом закрытых опросов
+    polls = conn.execute("""
+        SELECT id, group_id, question, expires_at FROM polls INDEXED BY idx_polls_active
+        WHERE is_active
+        ORDER BY id
+    """).fetchall()
+
+    options: dict[int, list[tuple[int, str]]] = {}
+    for poll_id, option_id, value in conn.execute("""
+        SELECT p.id, o.id, o.value FROM polls p
+        CROSS JOIN options o ON o.poll_id = p.id
+        WHERE p.is_active
+        ORDER BY o.id
+    """):
+        options.setdefault(poll_id, []).append((option_id, value))
+
+    answered: dict[int, set[int]] = {}
+    for poll_id, user_id in conn.execute("""
+        SELECT p.id, uo.user_id FROM polls p
+        CROSS JOIN options o ON o.poll_id = p.id
+        CROSS JOIN user_options uo ON uo.option_id = o.id
+        WHERE p.is_active
+    """):
+        answered.setdefault(poll_id, set()).add(user_id)
+    return polls, options, answered, last_answer_id(conn)
+
+
+def read_answers(conn: sqlite3.Connection, after_answer_id: int) -> tuple[list[tuple[int, int]], int]:
+    """
+    Ответы после ответа after_answer_id
+
+    Returns:
+        tuple[list[tuple[int, int]], int]: (option_id, user_id) и id последнего ответа
+    """
+    # id ответов растут в порядке фиксации, см. leaderboard.read_students
+    last_id = last_answer_id(conn)
+    rows = conn.execute(
+        "SELECT option_id, user_id FROM user_options WHERE id > ? AND id <= ?",
+        (after_answer_id, last_id)
+    ).fetchall()
+    return rows, max(last_id, after_answer_id)
+
+
+class ActivePollIndex():
+    """
+    Активные опросы в памяти: по группе и по варианту ответа.
+
+    Заполняется при старте и при создании опроса, опросы удаляются
+    при закрытии планировщиком. Показ опроса студенту не требует запросов к БД.
+    Ответы, записанные другими процессами, догружаются через refresh.
+    """
+
+    def __init__(self):
+        self._by_group: dict[int, dict[int, ActivePoll]] = {}
+        self._by_option: dict[int, ActivePoll] = {}
+        # Последний ответ, учтённый load или refresh
+        self._last_answer_id = 0
+
+    def add(self, poll: ActivePoll):
+        self._by_group.setdefault(poll.group_id, {})[poll.id] = poll
+        for option_id, _ in poll.options:
+            self._by_option[option_id] = poll
+
+    def remove(self, poll_id: int):
+        for group_id, polls in list(self._by_group.items()):
+            poll = polls.pop(poll_id, None)
+            if poll is None:
+                continue
+            for option_id, _ in poll.options:
+                self._by_option.pop(option_id, None)
+            if not polls:
+                del self._by_group[group_id]
+            return
+
+    def poll_for_user(self, group_id: int, user_id: int) -> ActivePoll | None:
+        """
+        Самый ранний активный опрос группы, на который пользователь ещё не ответил
+        """
+        for poll in self._by_group.get(group_id, {}).values():
+            if user_id not in poll.answered and not poll.is_expired:
+                return poll
+        return None
+
+    def poll_by_option(self, option_id: int) -> ActivePoll | None:
+        """
+        Опрос варианта ответа, в том числе уже истёкший, но ещё не закрытый планировщиком
+        """
+        return self._by_option.get(option_id)
+
+    async def load(self, db: Database):
+        """
+        Загрузка активных опросов из БД.
+
+        Новый индекс собирается отдельно и подменяет текущий целиком,
+        поэтому повторная загрузка не оставляет обработчики без опросов.
+        """
+        polls, options, answered, last_answer_id = await db.snapshot(read_active_polls)
+        index = ActivePollIndex()
+        for poll_id, group_id, question, expires_at in polls:
+            poll_options = options.get(poll_id, [])
+            index.add(ActivePoll(
+                id=poll_id,
+                group_id=group_id,
+                question=question,
+                expires_at=datetime.fromisoformat(expires_at),
+                options=poll_options,
+                keyboard=poll_options_keyboard(poll_options),
+                answered=answered.get(poll_id, set()),
+            ))
+        self._by_group, self._by_option = index._by_group, index._by_option
+        self._last_answer_id = last_answer_id
+
+    async def refresh(self, db: Database):
+        """
+        Ответы, записанные другими процессами после последней загрузки
+        """
+        rows, self._last_answer_id = await db.snapshot(read_answers, self._last_answer_id)
+        for option_id, user_id in rows:
+            poll = self._by_option.get(option_id)
+            if poll is not None:
+                poll.answered.add(user_id)
+
+
+active_polls = ActivePollIndex()
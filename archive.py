@@ -0,0 +1,195 @@
+"""
+Перенос старых опросов в архив.
+
+Закрытые опросы старше заданного срока вместе с вариантами и ответами
+переносятся пачками в отдельный файл архива (подключается к соединению
+под именем archive, см. db.connect), после чего освобождённые страницы
+основной БД возвращаются через incremental vacuum. Основные таблицы
+остаются размером с текущую активность.
+
+Статистика при этом не меняется: user_stats не трогается, а для её
+пересчёта и для новых студентов архив хранит сводки group_polls и
+user_summary. Архивируются только опросы старше всех активных, поэтому
+writer.save_answer учитывает архивные опросы группы целиком.
+
+Перенос пачки идемпотентен (INSERT OR IGNORE, сводки пересчитываются по
+архиву), так что прерванный перенос можно просто повторить: копия в архиве
+фиксируется раньше, чем опросы удаляются из основной БД.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import asyncio
+import json
+import sqlite3
+
+from db import Database
+
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 20  # опросов в одной транзакции
+ARCHIVE_INTERVAL = 24 * 60 * 60  # секунд
+# Запросы по всей истории читают архив раньше основной БД: архивные опросы старше
+HISTORY_SCHEMAS = ("archive", "main")
+
+
+@dataclass
+class ArchiveResult:
+    polls: int = 0
+    answers: int = 0
+    freed_pages: int = 0
+
+
+def archive_batch(conn: sqlite3.Connection, cutoff: datetime, limit: int) -> tuple[int, int]:
+    """
+    Перенос в архив очередной пачки опросов, закрытых раньше cutoff
+
+    Returns:
+        tuple[int, int]: Количество перенесённых опросов и ответов
+    """
+    poll_ids = [row[0] for row in conn.execute("""
+        SELECT id FROM polls
+        WHERE NOT is_active AND expires_at < ?
+          AND id < COALESCE((SELECT MIN(id) FROM polls WHERE is_active), 9223372036854775807)
+        ORDER BY id
+        LIMIT ?
+    """, (cutoff, limit))]
+    if not poll_ids:
+        return 0, 0
+    batch = json.dumps(poll_ids)
+
+    conn.execute("""
+        INSERT OR IGNORE INTO archive.polls (id, question, group_id, expires_at, is_active)
+        SELECT id, question, group_id, expires_at, is_active FROM polls
+        WHERE id IN (SELECT value FROM json_each(?1))
+    """, (batch,))
+    conn.execute("""
+        INSERT OR IGNORE INTO archive.options (id, poll_id, value, is_answer)
+        SELECT id, poll_id, value, is_answer FROM options
+        WHERE poll_id IN (SELECT value FROM json_each(?1))
+    """, (batch,))
+    answers = conn.execute("""
+        INSERT OR IGNORE INTO archive.user_options (id, user_id, option_id)
+        SELECT uo.id, uo.user_id, uo.option_id FROM user_options uo
+        JOIN options o ON o.id = uo.option_id
+        WHERE o.poll_id IN (SELECT value FROM json_each(?1))
+    """, (batch,)).rowcount
+
+    # Сводки пересчитываются по архиву для затронутых групп и студентов
+    conn.execute("""
+        INSERT OR REPLACE INTO archive.group_polls (group_id, polls)
+        SELECT p.group_id, COUNT(*) FROM archive.polls p
+        WHERE p.group_id IN (SELECT group_id FROM archive.polls WHERE id IN (SELECT value FROM json_each(?1)))
+          AND EXISTS (SELECT 1 FROM archive.options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+        GROUP BY p.group_id
+    """, (batch,))
+    conn.execute("""
+        INSERT OR REPLACE INTO archive.user_summary (user_id, group_id, completed_polls, correct_polls)
+        SELECT uo.user_id, p.group_id,
+            COUNT(DISTINCT o.poll_id),
+            COUNT(DISTINCT CASE WHEN o.is_answer = 1 THEN o.poll_id END)
+        FROM archive.user_options uo
+        JOIN archive.options o ON o.id = uo.option_id
+        JOIN archive.polls p ON p.id = o.poll_id
+        WHERE uo.user_id IN (
+            SELECT uo.user_id FROM archive.user_options uo
+            JOIN archive.options o ON o.id = uo.option_id
+            WHERE o.poll_id IN (SELECT value FROM json_each(?1))
+        )
+        GROUP BY uo.user_id, p.group_id
+    """, (batch,))
+    # В режиме WAL фиксация изменений в двух файлах не атомарна, и основная БД
+    # фиксируется первой. Архив фиксируется отдельно до удаления: при сбое
+    # между ними останется копия, которую уберёт повторный перенос, а не потеря
+    conn.commit()
+
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("""
+        DELETE FROM user_options
+        WHERE option_id IN (SELECT id FROM options WHERE poll_id IN (SELECT value FROM json_each(?1)))
+    """, (batch,))
+    conn.execute("DELETE FROM options WHERE poll_id IN (SELECT value FROM json_each(?1))", (batch,))
+    conn.execute("DELETE FROM polls WHERE id IN (SELECT value FROM json_each(?1))", (batch,))
+    return len(poll_ids), answers
+
+
+def incremental_vacuum(conn: sqlite3.Connection) -> int:
+    """
+    Возврат свободных страниц основной БД файловой системе.
+
+    Выполняется вне транзакции. БД, созданная до появления архива, один раз
+    переводится в режим auto_vacuum = INCREMENTAL полным VACUUM.
+
+    Returns:
+        int: Количество освобождённых страниц
+    """
+    if conn.in_transaction:
+        conn.commit()
+
+    pages = conn.execute("PRAGMA main.page_count").fetchone()[0]
+    if conn.execute("PRAGMA main.auto_vacuum").fetchone()[0] != 2:  # 2 - INCREMENTAL
+        print("Перевод БД в режим incremental vacuum, выполняется полный VACUUM")
+        conn.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM main")
+    else:
+        # execute выполняет прагму на один шаг (одна страница), executescript - до конца
+        conn.executescript("PRAGMA main.incremental_vacuum;")
+    return pages - conn.execute("PRAGMA main.page_count").fetchone()[0]
+
+
+class Archiver():
+    """
+    Периодический перенос опросов старше after_days дней в архив.
+
+    Каждая пачка переносится отдельной транзакцией, между ними поток БД
+    обслуживает остальные запросы.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        after_days: float = ARCHIVE_AFTER_DAYS,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        interval: float = ARCHIVE_INTERVAL
+    ):
+        self.db = db
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def run(self, after_days: float | None = None) -> ArchiveResult:
+        result = ArchiveResult()
+        async with self._lock:
+            cutoff = datetime.now() - timedelta(days=self.after_days if after_days is None else after_days)
+            while True:
+                polls, answers = await self.db.transaction(archive_batch, cutoff, self.batch_size)
+                if not polls:
+                    break
+                result.polls += polls
+                result.answers += answers
+            if result.polls:
+                result.freed_pages = await self.db.transaction(incremental_vacuum)
+        return result
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                result = await self.run()
+                if result.polls:
+                    print(f"В архив перенесено опросов: {result.polls}, ответов: {result.answers}")
+            except Exception as e:
+                print(f"Ошибка при переносе опросов в архив: {e}")
+            await asyncio.sleep(self.interval)
+
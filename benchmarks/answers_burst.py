@@ -0,0 +1,82 @@
+"""
+Скорость записи ответов при одновременном ответе всей группы.
+
+Сравнивает запись каждого ответа отдельной транзакцией (как было раньше)
+с групповой записью через AnswerWriter.
+
+Запуск: python -m benchmarks.answers_burst [количество студентов]
+"""
+from datetime import datetime, timedelta
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from db import Database, setup_database
+from stats import add_user_stats, on_poll_created
+from writer import AnswerWriter, save_answer
+
+
+def seed(conn: sqlite3.Connection, students: int) -> tuple[list[int], list[int]]:
+    teacher_id = conn.execute(
+        "INSERT INTO users (telegram_id, full_name, role) VALUES (0, 'Преподаватель', 'admin')"
+    ).lastrowid
+    group_id = conn.execute(
+        "INSERT INTO groups (name, teacher_id) VALUES ('43-ИС', ?)", (teacher_id,)
+    ).lastrowid
+
+    user_ids = []
+    for i in range(1, students + 1):
+        user_id = conn.execute(
+            "INSERT INTO users (telegram_id, full_name, role, group_id) VALUES (?, ?, 'user', ?)",
+            (i, f"Студент {i}", group_id)
+        ).lastrowid
+        add_user_stats(conn, user_id, group_id)
+        user_ids.append(user_id)
+
+    poll_id = conn.execute(
+        "INSERT INTO polls (question, group_id, expires_at) VALUES ('2 + 2?', ?, ?)",
+        (group_id, datetime.now() + timedelta(minutes=10))
+    ).lastrowid
+    option_ids = [
+        conn.execute(
+            "INSERT INTO options (poll_id, value, is_answer) VALUES (?, ?, ?)",
+            (poll_id, value, is_answer)
+        ).lastrowid
+        for value, is_answer in (("4", 1), ("5", 0))
+    ]
+    on_poll_created(conn, group_id)
+    return user_ids, option_ids
+
+
+async def run(students: int, batched: bool) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.transaction(setup_database)
+        user_ids, option_ids = await database.transaction(seed, students)
+        writer = AnswerWriter(database)
+
+        answers = [(user_id, option_ids[user_id % 2]) for user_id in user_ids]
+        started = time.perf_counter()
+        if batched:
+            await asyncio.gather(*(writer.submit(*answer) for answer in answers))
+        else:
+            await asyncio.gather(*(database.transaction(save_answer, *answer) for answer in answers))
+        elapsed = time.perf_counter() - started
+
+        await writer.close()
+        await database.close()
+        return students / elapsed
+
+
+async def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    for name, batched in (("транзакция на ответ", False), ("групповая запись", True)):
+        rate = await run(students, batched)
+        print(f"{name:>22}: {rate:,.0f} ответов/с ({students} студентов)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""
+Рассылка опроса большой группе через FakeTelegramSession.
+
+Показывает время рассылки и проверяет, что соблюдены ограничения частоты.
+Запуск: python -m benchmarks.broadcast [получателей] [задержка ответа, с] [глобальный лимит, сообщ./с]
+"""
+from collections import Counter
+import asyncio
+import sys
+import time
+
+from aiogram import Bot
+from aiogram.methods import SendMessage
+
+from benchmarks.fake_session import FakeTelegramSession
+from broadcast import Broadcaster
+from inline_keyboards import poll_options_keyboard
+
+
+async def main():
+    recipients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    session = FakeTelegramSession(latency=latency, flood_every=200, retry_after=1)
+    bot = Bot("123456:FAKE", session=session)
+    broadcaster = Broadcaster(rate=rate)
+
+    started = time.perf_counter()
+    result = await broadcaster.broadcast(
+        bot,
+        list(range(1, recipients + 1)),
+        "2 + 2?",
+        reply_markup=poll_options_keyboard([(1, "4"), (2, "5")]),
+    )
+    elapsed = time.perf_counter() - started
+
+    sent_at = [at for at, method in session.calls if isinstance(method, SendMessage)]
+    per_second = Counter(int(at - sent_at[0]) for at in sent_at)
+    print(f"доставлено {result.sent} из {result.total}, ошибок {result.failed}")
+    print(f"время: {elapsed:.2f} с, {result.sent / elapsed:.1f} сообщ./с")
+    print(f"максимум сообщений за секунду: {max(per_second.values())} (лимит {rate:g})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Стоимость маршрутизации callback-запроса.
+
+Сравнивает прежнюю цепочку фильтров-лямбд (aiogram проверяет их по очереди,
+пока какой-то не совпадёт) с таблицей префиксов CallbackRouter. Обработчики
+пустые, поэтому измеряется только выбор обработчика внутри Dispatcher.
+
+Запуск: python -m benchmarks.callback_dispatch [количество запросов]
+"""
+import asyncio
+import sys
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Update, User
+
+from callbacks import AddUser, CallbackRouter, CorrectOption, GroupUsers, PollGroup, PollOption, StatsPage
+
+ACTIONS = ["start", "groups", "create_group", "users", "create_poll", "start_poll_compliting", "my_statistic", "statistic"]
+
+# Фильтры в порядке регистрации до перехода на таблицу префиксов
+LEGACY_FILTERS = [
+    lambda c: c.data == "start",
+    lambda c: c.data == "groups",
+    lambda c: c.data == "create_group",
+    lambda c: c.data == "users",
+    lambda c: c.data.startswith("view_users_list_"),
+    lambda c: c.data.startswith("set_user_group_"),
+    lambda c: c.data == "create_poll",
+    lambda c: c.data.startswith("select_group_for_poll_creation_"),
+    lambda c: c.data.startswith("set_correct_answer"),
+    lambda c: c.data == "start_poll_compliting",
+    lambda c: c.data.startswith("select_poll_option_"),
+    lambda c: c.data.startswith("my_statistic"),
+    lambda c: c.data == "statistic",
+    lambda c: c.data.startswith("stats_page_"),
+]
+
+# Типичная нагрузка: почти все запросы - ответы на опрос во время пары
+LEGACY_MIX = ["select_poll_option_17"] * 8 + ["start_poll_compliting", "stats_page_0_next_11"]
+ROUTED_MIX = [PollOption(option_id=17).pack()] * 8 + ["start_poll_compliting", StatsPage(cursor=11).pack()]
+
+
+async def noop(callback: CallbackQuery, **kwargs):
+    pass
+
+
+def legacy_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    for callback_filter in LEGACY_FILTERS:
+        dp.callback_query.register(noop, callback_filter)
+    return dp
+
+
+def routed_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    callbacks = CallbackRouter()
+    for name in ACTIONS:
+        callbacks.action(name)(noop)
+    for payload in (GroupUsers, AddUser, PollGroup, CorrectOption, PollOption, StatsPage):
+        callbacks.payload(payload)(noop)
+    callbacks.setup(dp)
+    return dp
+
+
+def make_update(update_id: int, data: str) -> Update:
+    return Update(
+        update_id=update_id,
+        callback_query=CallbackQuery(
+            id=str(update_id),
+            from_user=User(id=update_id, is_bot=False, first_name="Студент"),
+            chat_instance="bench",
+            data=data,
+        ),
+    )
+
+
+async def run(dp: Dispatcher, mix: list[str], count: int) -> float:
+    bot = Bot("42:BENCHMARK")
+    updates = [make_update(i, mix[i % len(mix)]) for i in range(count)]
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    return elapsed
+
+
+async def main(count: int):
+    print(f"Запросов: {count}")
+    for name, dp, mix in (
+        ("цепочка фильтров", legacy_dispatcher(), LEGACY_MIX),
+        ("таблица префиксов", routed_dispatcher(), ROUTED_MIX),
+    ):
+        elapsed = await run(dp, mix, count)
+        print(f"{name:>18}: {elapsed / count * 1e6:7.1f} мкс/запрос, {count / elapsed:8.0f} запросов/с")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
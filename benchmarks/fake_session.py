@@ -0,0 +1,70 @@
+"""
+Сессия Bot API без сети для нагрузочных замеров.
+
+Запросы не уходят в Telegram: сессия запоминает их и формирует ответ в формате
+Bot API, который проходит через обычную проверку ответа aiogram, поэтому
+ошибки вроде RetryAfter приходят в код бота теми же исключениями.
+"""
+from typing import Any, AsyncGenerator
+import asyncio
+import itertools
+import time
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+
+class FakeTelegramSession(BaseSession):
+
+    def __init__(self, latency: float = 0.0, flood_every: int = 0, retry_after: int = 1):
+        """
+        Args:
+            latency (float): Задержка ответа на каждый запрос, секунд
+            flood_every (int): Каждый N-й запрос отвечает ошибкой 429
+            retry_after (int): Значение retry_after в ошибке 429
+        """
+        super().__init__()
+        self.latency = latency
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.calls: list[tuple[float, TelegramMethod]] = []
+        self._counter = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _result(self, method: TelegramMethod) -> Any:
+        if method.__returning__ is bool:
+            return True
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": getattr(method, "chat_id", None) or 0, "type": "private"},
+            "text": getattr(method, "text", None),
+        }
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType], timeout: int | None = None) -> TelegramType:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.flood_every and next(self._counter) % self.flood_every == 0:
+            status_code, payload = 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        else:
+            self.calls.append((time.monotonic(), method))
+            status_code, payload = 200, {"ok": True, "result": self._result(method)}
+
+        response = self.check_response(
+            bot=bot, method=method, status_code=status_code, content=self.json_dumps(payload)
+        )
+        return response.result
+
+    async def stream_content(self, url: str, headers: dict[str, Any] | None = None, timeout: int = 30, chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self):
+        pass
@@ -0,0 +1,208 @@
+"""
+Нагрузочный прогон бота без сети.
+
+Во временной bot.db создаются группы со студентами, преподаватель создаёт
+в каждой группе опрос через обычный диалог, после чего все студенты за
+окно --window секунд открывают опрос, отвечают и смотрят свою статистику,
+а администратор в это время листает общую статистику. Обновления проходят
+через dp.feed_update, запросы к Bot API принимает FakeTelegramSession.
+
+Выводит пропускную способность и p50/p95/p99 задержки по обработчикам
+и самые долгие SQL-запросы по данным metrics.py.
+
+Запуск: python -m benchmarks.loadtest [--groups 30] [--students 25] [--window 10] [--double-tap 0.3]
+"""
+from collections import defaultdict
+from datetime import datetime
+import argparse
+import asyncio
+import itertools
+import math
+import os
+import random
+import tempfile
+import time
+
+ADMIN_TELEGRAM_ID = 1
+STUDENT_TELEGRAM_ID_BASE = 1_000_000
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    # Метод ближайшего ранга
+    index = max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+class LoadTest():
+
+    def __init__(self, main, bot, args: argparse.Namespace):
+        from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+        self.main = main
+        self.bot = bot
+        self.args = args
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        self.errors: defaultdict[str, int] = defaultdict(int)
+        self._ids = itertools.count(1)
+        self._types = (CallbackQuery, Chat, Message, Update, User)
+
+    def message(self, telegram_id: int, text: str):
+        CallbackQuery, Chat, Message, Update, User = self._types
+        return Update(update_id=next(self._ids), message=Message(
+            message_id=next(self._ids),
+            date=datetime.now(),
+            chat=Chat(id=telegram_id, type="private"),
+            from_user=User(id=telegram_id, is_bot=False, first_name="Нагрузка"),
+            text=text,
+        ))
+
+    def callback(self, telegram_id: int, data: str):
+        CallbackQuery, Chat, Message, Update, User = self._types
+        return Update(update_id=next(self._ids), callback_query=CallbackQuery(
+            id=str(next(self._ids)),
+            from_user=User(id=telegram_id, is_bot=False, first_name="Нагрузка"),
+            chat_instance="loadtest",
+            data=data,
+            message=Message(
+                message_id=next(self._ids),
+                date=datetime.now(),
+                chat=Chat(id=telegram_id, type="private"),
+                text="...",
+            ),
+        ))
+
+    async def send(self, handler: str, update):
+        started = time.perf_counter()
+        try:
+            await self.main.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors[handler] += 1
+            print(f"{handler}: {e!r}")
+        self.latencies[handler].append(time.perf_counter() - started)
+
+    def handler_name(self, data: str) -> str:
+        handler, _ = self.main.callbacks.resolve(data)
+        return handler.callback.__name__
+
+    async def press(self, telegram_id: int, data: str):
+        await self.send(self.handler_name(data), self.callback(telegram_id, data))
+
+    async def create_poll(self, group_id: int):
+        from callbacks import CorrectOption, PollGroup
+
+        await self.press(ADMIN_TELEGRAM_ID, "create_poll")
+        await self.press(ADMIN_TELEGRAM_ID, PollGroup(group_id=group_id).pack())
+        await self.send("set_poll_question", self.message(ADMIN_TELEGRAM_ID, f"Вопрос для группы {group_id}"))
+        for text in ("Вариант 1", "Вариант 2", "Вариант 3", "Готово"):
+            await self.send("add_poll_option", self.message(ADMIN_TELEGRAM_ID, text))
+        await self.press(ADMIN_TELEGRAM_ID, CorrectOption(index=0).pack())
+        await self.send("set_poll_duration", self.message(ADMIN_TELEGRAM_ID, "30"))
+
+    async def student(self, telegram_id: int, option_ids: list[int], started: float):
+        from callbacks import PollOption, Ranking
+
+        await asyncio.sleep(max(started + random.uniform(0, self.args.window) - time.perf_counter(), 0))
+        await self.press(telegram_id, "start_poll_compliting")
+        await asyncio.sleep(random.uniform(0.2, 1.0))
+        data = PollOption(option_id=random.choice(option_ids)).pack()
+        if random.random() < self.args.double_tap:
+            await asyncio.gather(self.press(telegram_id, data), self.press(telegram_id, data))
+        else:
+            await self.press(telegram_id, data)
+        await asyncio.sleep(random.uniform(0.2, 1.0))
+        await self.press(telegram_id, "my_statistic")
+        user = await self.main.get_user(telegram_id)
+        await self.press(telegram_id, Ranking(group_id=user.group_id).pack())
+
+    async def admin(self, started: float):
+        from callbacks import StatsPage
+
+        while time.perf_counter() - started < self.args.window:
+            await self.press(ADMIN_TELEGRAM_ID, "statistic")
+            await self.press(ADMIN_TELEGRAM_ID, StatsPage(group_id=random.randint(1, self.args.groups)).pack())
+            await asyncio.sleep(self.args.admin_interval)
+
+    async def run(self) -> float:
+        run_started = time.perf_counter()
+        for group_id in range(1, self.args.groups + 1):
+            await self.create_poll(group_id)
+
+        options = defaultdict(list)
+        for group_id, option_id in await self.main.db.fetchall(
+            "SELECT p.group_id, o.id FROM options o JOIN polls p ON p.id = o.poll_id"
+        ):
+            options[group_id].append(option_id)
+
+        started = time.perf_counter()
+        tasks = [
+            self.student(STUDENT_TELEGRAM_ID_BASE + i, options[i % self.args.groups + 1], started)
+            for i in range(self.args.groups * self.args.students)
+        ]
+        await asyncio.gather(self.admin(started), *tasks)
+        return time.perf_counter() - run_started
+
+    def report(self, elapsed: float):
+        from metrics import format_summary
+
+        total = sum(len(values) for values in self.latencies.values())
+        print(f"Обновлений: {total} за {elapsed:.1f} с, запросов к Bot API: {len(self.bot.session.calls)}")
+        print(f"{'обработчик':<28}{'кол-во':>8}{'в сек':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'ошибки':>8}")
+        for handler, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            print(
+                f"{handler:<28}{len(values):>8}{len(values) / elapsed:>8.1f}"
+                f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}{self.errors[handler]:>8}"
+            )
+        print(format_summary(self.main.metrics.totals(), {}, elapsed))
+
+
+def seed(conn, groups: int, students: int):
+    from roster import RosterSummary, import_students
+
+    admin_id = conn.execute("SELECT id FROM users WHERE telegram_id = ?", (ADMIN_TELEGRAM_ID,)).fetchone()[0]
+    for group_id in range(1, groups + 1):
+        conn.execute("INSERT INTO groups (id, name, teacher_id) VALUES (?, ?, ?)", (group_id, f"Группа {group_id}", admin_id))
+        import_students(conn, group_id, [
+            (STUDENT_TELEGRAM_ID_BASE + i, f"Студент {i}")
+            for i in range(group_id - 1, groups * students, groups)
+        ], RosterSummary())
+
+
+async def main(args: argparse.Namespace):
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Настройки бота читаются при импорте, поэтому задаются до него
+        os.environ.update({
+            "DB_NAME": os.path.join(tmp, "bot.db"),
+            "TG_BOT_TOKEN": "42:LOADTEST",
+            "ADMIN_ID": str(ADMIN_TELEGRAM_ID),
+            "BOT_MODE": "polling",
+        })
+        import main as bot_main
+        from aiogram import Bot
+        from benchmarks.fake_session import FakeTelegramSession
+
+        bot = Bot("42:LOADTEST", session=FakeTelegramSession(latency=args.latency))
+        await bot_main.dp.emit_startup(bot=bot)
+        await bot_main.db.transaction(seed, args.groups, args.students)
+        # Студенты добавлены в обход обработчиков
+        await bot_main.leaderboard.load(bot_main.db)
+
+        test = LoadTest(bot_main, bot, args)
+        elapsed = await test.run()
+        test.report(elapsed)
+
+        await bot_main.dp.emit_shutdown(bot=bot)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота без сети")
+    parser.add_argument("--groups", type=int, default=30, help="количество групп")
+    parser.add_argument("--students", type=int, default=25, help="студентов в группе")
+    parser.add_argument("--window", type=float, default=10.0, help="за сколько секунд отвечают все студенты")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа Bot API, секунд")
+    parser.add_argument("--admin-interval", type=float, default=0.5, help="пауза между просмотрами статистики, секунд")
+    parser.add_argument("--double-tap", type=float, default=0.0, help="доля студентов, нажимающих вариант дважды")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""
+Время пересчёта коэффициентов внимательности по истории ответов.
+
+Студенты и опросы поровну распределены по группам, каждый студент
+отвечает примерно на 80% опросов своей группы.
+
+Запуск: python -m benchmarks.rescore [студентов] [опросов] [групп]
+"""
+from datetime import datetime
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from db import connect
+from migrations import migrate
+from rescore import rescore
+from stats import rebuild_user_stats
+
+
+def seed(conn: sqlite3.Connection, students: int, polls: int, groups: int):
+    random.seed(0)
+    conn.execute("INSERT INTO users (telegram_id, full_name, role) VALUES (0, 'Преподаватель', 'admin')")
+    conn.executemany(
+        "INSERT INTO groups (id, name, teacher_id) VALUES (?, ?, 1)",
+        [(group_id, f"Группа {group_id}") for group_id in range(1, groups + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO users (id, telegram_id, full_name, role, group_id) VALUES (?, ?, ?, 'user', ?)",
+        [(i + 2, i + 1, f"Студент {i + 1}", i % groups + 1) for i in range(students)]
+    )
+    conn.executemany(
+        "INSERT INTO polls (id, question, group_id, expires_at, is_active) VALUES (?, '?', ?, ?, 0)",
+        [(poll_id, poll_id % groups + 1, datetime.now()) for poll_id in range(1, polls + 1)]
+    )
+    # Три варианта на опрос, первый правильный: id варианта = 3 * poll_id + k
+    conn.executemany(
+        "INSERT INTO options (id, poll_id, value, is_answer) VALUES (?, ?, ?, ?)",
+        [(3 * poll_id + k, poll_id, str(k), int(k == 0)) for poll_id in range(1, polls + 1) for k in range(3)]
+    )
+
+    def answers():
+        for poll_id in range(1, polls + 1):
+            group_id = poll_id % groups + 1
+            for i in range(group_id - 1, students, groups):
+                if random.random() < 0.8:
+                    yield i + 2, 3 * poll_id + random.choice((0, 0, 1, 2))
+
+    conn.executemany("INSERT INTO user_options (user_id, option_id) VALUES (?, ?)", answers())
+    rebuild_user_stats(conn)
+
+
+def main():
+    students, polls, groups = (int(arg) for arg in (sys.argv[1:] + ["10000", "1000", "10"][len(sys.argv) - 1:])[:3])
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect(os.path.join(tmp, "bench.db"))
+        migrate(conn)
+        with conn:
+            seed(conn, students, polls, groups)
+        answers = conn.execute("SELECT COUNT(*) FROM user_options").fetchone()[0]
+
+        started = time.perf_counter()
+        with conn:
+            updated = rescore(conn)
+        elapsed = time.perf_counter() - started
+        conn.close()
+
+    print(f"{updated} студентов, {polls} опросов, {answers} ответов: {elapsed:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Скорость добавления студентов.
+
+Сравнивает добавление по одному студенту (как в set_user_data: INSERT и
+фиксация на каждого) с импортом CSV-файла через roster.py.
+
+Запуск: python -m benchmarks.roster_import [количество студентов]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from db import Database, setup_database
+from roster import import_students, parse_roster
+from stats import add_user_stats
+
+
+def create_group(conn: sqlite3.Connection) -> int:
+    teacher_id = conn.execute(
+        "INSERT INTO users (telegram_id, full_name, role) VALUES (0, 'Преподаватель', 'admin')"
+    ).lastrowid
+    return conn.execute(
+        "INSERT INTO groups (name, teacher_id) VALUES ('43-ИС', ?)", (teacher_id,)
+    ).lastrowid
+
+
+def create_user(conn: sqlite3.Connection, telegram_id: int, full_name: str, group_id: int):
+    user_id = conn.execute(
+        "INSERT INTO users (telegram_id, full_name, role, group_id) VALUES (?, ?, 'user', ?)",
+        (telegram_id, full_name, group_id)
+    ).lastrowid
+    add_user_stats(conn, user_id, group_id)
+
+
+async def run(students: int, bulk: bool) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "roster.csv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("ФИО;Telegram ID\n")
+            for i in range(1, students + 1):
+                f.write(f"Студент {i};{i}\n")
+
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.transaction(setup_database)
+        group_id = await database.transaction(create_group)
+
+        started = time.perf_counter()
+        if bulk:
+            rows, summary = await asyncio.to_thread(parse_roster, path, "roster.csv")
+            await database.transaction(import_students, group_id, rows, summary)
+            assert len(summary.inserted) == students
+        else:
+            for i in range(1, students + 1):
+                await database.transaction(create_user, i, f"Студент {i}", group_id)
+        elapsed = time.perf_counter() - started
+
+        await database.close()
+        return students / elapsed
+
+
+async def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 750
+    for name, bulk in (("по одному", False), ("импорт файла", True)):
+        rate = await run(students, bulk)
+        print(f"{name:>13}: {rate:,.0f} студентов/с ({students} студентов)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,145 @@
+"""
+Задержка записи ответов, пока преподаватели смотрят статистику.
+
+Студенты отвечают по одному через Database.transaction, а несколько задач
+в это время без пауз читают тяжёлую сводку по всей истории ответов.
+Сравнивает одно соединение на всё (readers=0, запросы чтения стоят в очереди
+перед записью) с пулом соединений для чтения в режиме WAL. Для сравнения
+выводится и задержка записи без чтения.
+
+Те же прогоны проверяет tests/test_wal_reads.py.
+
+Запуск: python -m benchmarks.wal_reads [студентов] [опросов] [читающих задач]
+или python benchmarks/wal_reads.py с теми же аргументами
+"""
+from datetime import datetime, timedelta
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+if not __package__:
+    # Запуск файлом: модули бота лежат на уровень выше
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.rescore import seed
+from db import Database, archive_path, connect
+from migrations import migrate
+from writer import save_answer
+
+GROUPS = 10
+ANSWERS = 200
+ANSWER_INTERVAL = 0.005  # секунд между ответами
+
+STATS_QUERY = """
+    SELECT p.group_id, COUNT(*), SUM(o.is_answer), COUNT(DISTINCT uo.user_id)
+    FROM user_options uo
+    JOIN options o ON o.id = uo.option_id
+    JOIN polls p ON p.id = o.poll_id
+    GROUP BY p.group_id
+"""
+
+
+def add_active_polls(conn: sqlite3.Connection) -> dict[int, int]:
+    """
+    Активный опрос в каждой группе
+
+    Returns:
+        dict[int, int]: Правильный вариант активного опроса по группе
+    """
+    options = {}
+    for group_id in range(1, GROUPS + 1):
+        poll_id = conn.execute(
+            "INSERT INTO polls (question, group_id, expires_at) VALUES ('2 + 2?', ?, ?)",
+            (group_id, datetime.now() + timedelta(hours=1))
+        ).lastrowid
+        options[group_id] = conn.execute(
+            "INSERT INTO options (poll_id, value, is_answer) VALUES (?, '4', 1)", (poll_id,)
+        ).lastrowid
+    return options
+
+
+def prepare(tmp: str, students: int, polls: int) -> tuple[str, dict[int, int]]:
+    """
+    БД с историей ответов и активным опросом в каждой группе
+
+    Returns:
+        tuple[str, dict[int, int]]: Путь к БД и правильные варианты активных опросов по группе
+    """
+    path = os.path.join(tmp, "template.db")
+    conn = connect(path)
+    migrate(conn)
+    with conn:
+        seed(conn, students, polls, GROUPS)
+        options = add_active_polls(conn)
+    conn.close()
+    return path, options
+
+
+def copy_database(template: str, path: str):
+    # Каждый прогон на свежей копии, чтобы ответы не повторялись
+    shutil.copy(template, path)
+    shutil.copy(archive_path(template), archive_path(path))
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+async def run(path: str, readers: int, reading_tasks: int, options: dict[int, int]) -> tuple[list[float], int]:
+    database = Database(path, readers=readers)
+    stop = asyncio.Event()
+    reads = 0
+
+    async def teacher():
+        nonlocal reads
+        while not stop.is_set():
+            await database.fetchall(STATS_QUERY)
+            reads += 1
+
+    async def students() -> list[float]:
+        latencies = []
+        for user_id in range(2, ANSWERS + 2):
+            started = time.perf_counter()
+            await database.transaction(save_answer, user_id, options[(user_id - 2) % GROUPS + 1])
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(ANSWER_INTERVAL)
+        return latencies
+
+    teachers = [asyncio.create_task(teacher()) for _ in range(reading_tasks)]
+    latencies = await students()
+    stop.set()
+    await asyncio.gather(*teachers)
+    await database.close()
+    return sorted(latencies), reads
+
+
+async def main():
+    students, polls, reading_tasks = (int(arg) for arg in (sys.argv[1:] + ["2000", "300", "4"][len(sys.argv) - 1:])[:3])
+    with tempfile.TemporaryDirectory() as tmp:
+        template, options = prepare(tmp, students, polls)
+        conn = connect(template)
+        answers = conn.execute("SELECT COUNT(*) FROM user_options").fetchone()[0]
+        conn.close()
+        print(f"{students} студентов, {answers} ответов в истории, {ANSWERS} новых ответов, читающих задач: {reading_tasks}")
+
+        for name, readers, tasks in (
+            ("без чтения", 0, 0),
+            ("одно соединение", 0, reading_tasks),
+            ("WAL, пул чтения", reading_tasks, reading_tasks),
+        ):
+            path = os.path.join(tmp, f"run_{readers}_{tasks}.db")
+            copy_database(template, path)
+            latencies, reads = await run(path, readers, tasks, options)
+            print(
+                f"{name:>16}: запись ответа p50 {percentile(latencies, 50) * 1000:.1f} мс, "
+                f"p95 {percentile(latencies, 95) * 1000:.1f} мс, max {latencies[-1] * 1000:.1f} мс; "
+                f"чтений статистики: {reads}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from cache import TTLCache
+
+# Ограничения Telegram: около 30 сообщений в секунду на бота
+# и не чаще одного сообщения в секунду в один чат
+GLOBAL_RATE_LIMIT = 30
+PER_CHAT_INTERVAL = 1.0
+BROADCAST_CONCURRENCY = 10
+MAX_RETRIES = 3
+PROGRESS_INTERVAL = 2.0  # секунд между обновлениями прогресса
+# Чатов, отправка в которые помнится в течение per_chat_interval. За это время
+# отправляется не больше GLOBAL_RATE_LIMIT сообщений, так что вытеснения нет
+RECENT_CHATS_SIZE = 4096
+
+
+@dataclass
+class BroadcastResult:
+    total: int
+    sent: int = 0
+    failed: int = 0
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+
+class RateLimiter():
+    """
+    Ограничитель частоты вида token bucket.
+
+    pause позволяет остановить все отправки, когда Telegram вернул RetryAfter.
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.capacity = burst or 1
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Broadcaster():
+    """
+    Рассылка сообщений списку чатов с учётом ограничений Telegram
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE_LIMIT, per_chat_interval: float = PER_CHAT_INTERVAL, concurrency: int = BROADCAST_CONCURRENCY):
+        self.limiter = RateLimiter(rate)
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        # Записи старше per_chat_interval уже не задерживают отправку и удаляются
+        self._last_sent = TTLCache(maxsize=RECENT_CHATS_SIZE, ttl=per_chat_interval)
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _wait_for_chat(self, chat_id: int):
+        last_sent = self._last_sent.get(chat_id)
+        if last_sent is not None:
+            delay = last_sent + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup | None) -> bool:
+        for _ in range(MAX_RETRIES + 1):
+            await self._wait_for_chat(chat_id)
+            await self.limiter.acquire()
+            self._last_sent.set(chat_id, time.monotonic())
+            try:
+                await bot.send_message(chat_id, text, reply_markup=reply_markup)
+                return True
+            except TelegramRetryAfter as e:
+                self.limiter.pause(e.retry_after)
+            except TelegramAPIError as e:
+                # Пользователь заблокировал бота, не начинал с ним диалог и т.п.
+                print(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+                return False
+        return False
+
+    async def broadcast(
+        self,
+        bot: Bot,
+        chat_ids: list[int],
+        text: str,
+        reply_markup: InlineKeyboardMarkup | None = None,
+        on_progress: Callable[[BroadcastResult], Awaitable[None]] | None = None,
+    ) -> BroadcastResult:
+        """
+        Отправка сообщения всем чатам не более чем в concurrency потоков.
+
+        on_progress вызывается не чаще раза в PROGRESS_INTERVAL секунд и один раз в конце.
+        """
+        result = BroadcastResult(total=len(chat_ids))
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+
+        last_progress = time.monotonic()
+
+        async def worker():
+            nonlocal last_progress
+            while not queue.empty():
+                chat_id = queue.get_nowait()
+                if await self._send(bot, chat_id, text, reply_markup):
+                    result.sent += 1
+                else:
+                    result.failed += 1
+
+                if on_progress and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    await self._report(on_progress, result)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(chat_ids)))))
+        if on_progress:
+            await self._report(on_progress, result)
+        return result
+
+    async def _report(self, on_progress: Callable[[BroadcastResult], Awaitable[None]], result: BroadcastResult):
+        try:
+            await on_progress(result)
+        except TelegramAPIError as e:
+            print(f"Не удалось обновить прогресс рассылки: {e}")
+
+    def start(self, *args, **kwargs) -> asyncio.Task:
+        """
+        Запуск рассылки в фоне, чтобы не задерживать обработчик
+        """
+        task = asyncio.create_task(self.broadcast(*args, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+
+broadcaster = Broadcaster()
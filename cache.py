@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple
+import time
+
+from db import db
+
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 300  # секунд
+
+_MISSING = object()
+
+
+class TTLCache():
+    """
+    Ограниченный по размеру LRU-кэш с временем жизни записей.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class UserInfo(NamedTuple):
+    id: int
+    telegram_id: int
+    full_name: str
+    role: str
+    group_id: int | None
+    attention_score: float
+
+
+users_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+async def get_user(telegram_id: int) -> UserInfo | None:
+    """
+    Получение данных пользователя по telegram_id.
+
+    Отсутствующие пользователи тоже кэшируются, поэтому после добавления
+    пользователя запись нужно сбросить через users_cache.invalidate.
+    """
+    user = users_cache.get(telegram_id, _MISSING)
+    if user is not _MISSING:
+        return user
+
+    row = await db.fetchone("""
+        SELECT id, telegram_id, full_name, role, group_id, attention_score
+        FROM users
+        WHERE telegram_id = ?
+    """, (telegram_id,))
+    user = UserInfo(*row) if row else None
+    users_cache.set(telegram_id, user)
+    return user
+
+
+def update_cached_score(telegram_id: int, attention_score: float):
+    """
+    Обновление коэффициента внимательности в кэше после записи в БД
+    """
+    user = users_cache.get(telegram_id)
+    if user is not None:
+        users_cache.set(telegram_id, user._replace(attention_score=attention_score))
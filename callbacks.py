@@ -0,0 +1,132 @@
+from typing import Any, Callable
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+
+# Разделитель полей CallbackData в aiogram по умолчанию
+SEPARATOR = ':'
+
+
+class GroupUsers(CallbackData, prefix='gu'):
+    group_id: int
+
+
+class AddUser(CallbackData, prefix='au'):
+    group_id: int
+
+
+class PollGroup(CallbackData, prefix='pg'):
+    group_id: int
+
+
+class CorrectOption(CallbackData, prefix='co'):
+    index: int
+
+
+class PollOption(CallbackData, prefix='po'):
+    option_id: int
+
+
+class StatsPage(CallbackData, prefix='sp'):
+    group_id: int = 0
+    direction: str = 'next'
+    cursor: int = 0
+
+
+class StatsGroups(CallbackData, prefix='sg'):
+    direction: str = 'next'
+    cursor: int = 0
+
+
+class Export(CallbackData, prefix='ex'):
+    target: str  # 'group' или 'poll'
+    id: int = 0
+    format: str = 'csv'
+
+
+class Ranking(CallbackData, prefix='rk'):
+    group_id: int
+
+
+# Форматы callback_data до CallbackRouter. Такие кнопки остались в сообщениях,
+# отправленных раньше, их данные переводятся в новые классы
+LEGACY_FORMATS: dict[str, Callable[[str], CallbackData]] = {
+    'view_users_list_': lambda rest: GroupUsers(group_id=int(rest.split(' ', 1)[0])),
+    'set_user_group_': lambda rest: AddUser(group_id=int(rest.split(' ', 1)[0])),
+    'select_group_for_poll_creation_': lambda rest: PollGroup(group_id=int(rest)),
+    'set_correct_answer_': lambda rest: CorrectOption(index=int(rest)),
+    'select_poll_option_': lambda rest: PollOption(option_id=int(rest)),
+}
+
+
+class CallbackRouter():
+    """
+    Маршрутизация callback-запросов по таблице префиксов.
+
+    Вместо перебора фильтров всех обработчиков префикс callback_data ищется
+    в словаре. Простые действия ('start', 'groups') регистрируются по строке
+    целиком, данные с параметрами - через классы CallbackData, распакованный
+    объект передаётся обработчику в аргументе callback_data.
+    """
+
+    def __init__(self):
+        self._routes: dict[str, tuple[type[CallbackData] | None, CallableObject]] = {}
+
+    def _add(self, prefix: str, payload: type[CallbackData] | None, handler: Callable):
+        if prefix in self._routes:
+            raise ValueError(f"Префикс '{prefix}' уже зарегистрирован")
+        self._routes[prefix] = (payload, CallableObject(callback=handler))
+
+    def action(self, name: str):
+        def decorator(handler: Callable) -> Callable:
+            self._add(name, None, handler)
+            return handler
+        return decorator
+
+    def payload(self, payload: type[CallbackData]):
+        def decorator(handler: Callable) -> Callable:
+            self._add(payload.__prefix__, payload, handler)
+            return handler
+        return decorator
+
+    def resolve(self, data: str | None) -> tuple[CallableObject, CallbackData | None] | None:
+        if not data:
+            return None
+        prefix = data.split(SEPARATOR, 1)[0]
+        route = self._routes.get(prefix)
+        if route is None:
+            return self._resolve_legacy(data)
+
+        payload, handler = route
+        if payload is None:
+            return (handler, None) if data == prefix else None
+        try:
+            return handler, payload.unpack(data)
+        except (TypeError, ValueError):
+            return None
+
+    def _resolve_legacy(self, data: str) -> tuple[CallableObject, CallbackData] | None:
+        for legacy_prefix, convert in LEGACY_FORMATS.items():
+            if data.startswith(legacy_prefix):
+                try:
+                    callback_data = convert(data.removeprefix(legacy_prefix))
+                except ValueError:
+                    return None
+                route = self._routes.get(callback_data.__prefix__)
+                return (route[1], callback_data) if route else None
+        return None
+
+    def setup(self, router: Router):
+        router.callback_query.register(self._dispatch, self._match)
+
+    def _match(self, callback: CallbackQuery) -> bool | dict[str, Any]:
+        resolved = self.resolve(callback.data)
+        if resolved is None:
+            return False
+        handler, callback_data = resolved
+        return {"callback_route": handler, "callback_data": callback_data}
+
+    async def _dispatch(self, callback: CallbackQuery, callback_route: CallableObject, **data: Any) -> Any:
+        return await callback_route.call(callback, **data)
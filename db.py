@@ -1,84 +1,196 @@
 from datetime import datetime
+import asyncio
 import sqlite3
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, TypeVar
 from dotenv import load_dotenv
 import os
-    
+import threading
+from metrics import TimedConnection
+from migrations import archive_schema, migrate, verify_schema
+
+T = TypeVar('T')
+
 def adapt_datetime_iso(val: datetime):
     """Adapt datetime.datetime to timezone-naive ISO 8601 date."""
     return val.isoformat()
 
 sqlite3.register_adapter(datetime, adapt_datetime_iso)
 
-DB_NAME = 'bot.db'
+# Настройки читаются при импорте, раньше, чем load_dotenv() в main.py
+load_dotenv()
+
+DB_NAME = os.getenv('DB_NAME', 'bot.db')
+
+
+def archive_path(db_name: str) -> str:
+    root, ext = os.path.splitext(db_name)
+    return f"{root}_archive{ext or '.db'}"
+
+
+# Отдельный файл с архивом завершённых опросов, см. archive.py
+ARCHIVE_DB_NAME = os.getenv('ARCHIVE_DB_NAME') or archive_path(DB_NAME)
 ADMIN_TELEGRAM_IDS = [os.getenv('ADMIN_ID')]
+# Соединений для чтения, 0 - все запросы через соединение записи
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+DB_CACHE_SIZE_KB = 16 * 1024  # кэш страниц на соединение
+DB_BUSY_TIMEOUT_MS = 5000  # ожидание блокировки записи, занятой другим процессом
+
+def connect(db_name: str = DB_NAME, **kwargs) -> sqlite3.Connection:
+    """
+    Соединение с БД бота с подключённым под именем archive архивом
+    """
+    conn = sqlite3.connect(db_name, **kwargs)
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    # Действует только на новую БД, существующая переводится в этот режим при первой архивации.
+    # На существующей прагма ждала бы блокировку записи, поэтому не выполняется
+    if conn.execute("PRAGMA main.page_count").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_NAME if db_name == DB_NAME else archive_path(db_name),))
+    # WAL: чтение не ждёт запись и наоборот. Режим хранится в файле БД,
+    # synchronous и кэш задаются каждому соединению. FULL: фиксация ждёт fsync
+    # журнала, поэтому записанный ответ переживает и сбой питания (при NORMAL
+    # последние транзакции теряются). Соединений чтения synchronous не касается
+    for schema in ("main", "archive"):
+        conn.execute(f"PRAGMA {schema}.journal_mode = WAL")
+        conn.execute(f"PRAGMA {schema}.synchronous = FULL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    archive_schema(conn)
+    return conn
+
 
 class Roles():
     admin = 'admin'
     user = 'user'
 
-def create_connection():
-    try:
-        return sqlite3.connect(DB_NAME, check_same_thread=False)
-    except Exception as e:
-        print(e)
+class Database():
+    """
+    Асинхронный доступ к SQLite.
 
-def setup_database(conn: sqlite3.Connection | None):
-    conn = conn if conn else create_connection()
-    cursor = conn.cursor()
+    Все изменения выполняются одним соединением записи в отдельном потоке,
+    поэтому медленный запрос не останавливает цикл событий бота, а записи
+    не конкурируют за блокировку. fetchone, fetchall и snapshot выполняются
+    пулом из readers соединений только для чтения: в режиме WAL они видят
+    последнее зафиксированное состояние и не задерживают запись.
+    """
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        telegram_id INTEGER UNIQUE NOT NULL,
-        full_name TEXT NOT NULL,
-        attention_score REAL DEFAULT 1.0,
-        group_id INTEGER,
-        role TEXT CHECK(role IN ('admin', 'user')) NOT NULL
-        )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS groups (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL UNIQUE,
-        teacher_id INTEGER NOT NULL,
-        FOREIGN KEY (teacher_id) REFERENCES users(id)
-    )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS polls (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        question TEXT NOT NULL,
-        group_id INTEGER NOT NULL,
-        expires_at DATETIME NOT NULL,
-        is_active BOOLEAN DEFAULT TRUE,
-        FOREIGN KEY (group_id) REFERENCES groups(id)
-    )
-    """)
-    # Таблица ответов студентов
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS options (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        poll_id INTEGER NOT NULL,
-        value TEXT NOT NULL,
-        is_answer BOOLEAN DEFAULT 0,
-        FOREIGN KEY (poll_id) REFERENCES polls(id)
-    )
-    """)
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_options (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        option_id INTEGER NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        FOREIGN KEY (option_id) REFERENCES options(id)
-        UNIQUE (user_id, option_id)
-    )
-    """)
+    def __init__(self, db_name: str = DB_NAME, readers: int = DB_READERS):
+        self.db_name = db_name
+        self._conn: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-read') if readers > 0 else None
+        self._reader_local = threading.local()
+        self._reader_conns: list[sqlite3.Connection] = []
+        self._reader_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect(self.db_name, check_same_thread=False, factory=TimedConnection)
+        return self._conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """
+        Соединение для чтения текущего потока пула
+        """
+        if self._readers is None:
+            return self._connection()
+        conn = getattr(self._reader_local, 'conn', None)
+        if conn is None:
+            conn = connect(self.db_name, check_same_thread=False, factory=TimedConnection)
+            conn.execute("PRAGMA query_only = ON")
+            self._reader_local.conn = conn
+            with self._reader_lock:
+                self._reader_conns.append(conn)
+        return conn
+
+    async def _submit(self, func: Callable[..., T], *args, executor: ThreadPoolExecutor | None = None) -> T:
+        loop = asyncio.get_running_loop()
+        # Контекст передаётся в поток БД, чтобы запросы относились к обработчику, который их выполнил
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(executor or self._executor, context.run, func, *args)
 
+    async def fetchone(self, query: str, params: Iterable[Any] = ()) -> tuple | None:
+        return await self._submit(lambda: self._reader().execute(query, params).fetchone(), executor=self._readers)
+
+    async def fetchall(self, query: str, params: Iterable[Any] = ()) -> list[tuple]:
+        return await self._submit(lambda: self._reader().execute(query, params).fetchall(), executor=self._readers)
+
+    async def snapshot(self, func: Callable[..., T], *args) -> T:
+        """
+        Выполнение func(conn, *args) для чтения: все запросы func видят одно
+        и то же состояние БД, даже если между ними фиксируются записи.
+        """
+        def run():
+            conn = self._reader()
+            if self._readers is None:
+                return func(conn, *args)
+            conn.execute("BEGIN")
+            try:
+                return func(conn, *args)
+            finally:
+                conn.execute("COMMIT")
+        return await self._submit(run, executor=self._readers)
+
+    async def execute(self, query: str, params: Iterable[Any] = ()) -> int | None:
+        """
+        Выполнение одного изменяющего запроса с фиксацией транзакции
+
+        Returns:
+            int | None: lastrowid вставленной строки
+        """
+        def run(conn: sqlite3.Connection):
+            return conn.execute(query, params).lastrowid
+        return await self.transaction(run)
+
+    async def transaction(self, func: Callable[..., T], *args) -> T:
+        """
+        Выполнение func(conn, *args) в одной транзакции.
+
+        При исключении транзакция откатывается, и исключение пробрасывается дальше.
+
+        Транзакция сразу берёт блокировку записи (BEGIN IMMEDIATE). В режиме
+        webhook пишут несколько процессов, и отложенная транзакция, которая
+        сначала читает, получила бы "database is locked" без ожидания, если
+        запись другого процесса зафиксирована после её чтения.
+        """
+        def run():
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn, *args)
+                conn.commit()
+                return result
+            except BaseException:
+                conn.rollback()
+                raise
+        return await self._submit(run)
+
+    async def close(self):
+        def run():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._submit(run)
+        self._executor.shutdown(wait=True)
+        if self._readers is not None:
+            self._readers.shutdown(wait=True)
+            for conn in self._reader_conns:
+                conn.close()
+            self._reader_conns.clear()
+
+
+db = Database()
+
+def setup_database(conn: sqlite3.Connection):
+    migrate(conn)
+
+    cursor = conn.cursor()
     for telegram_id in ADMIN_TELEGRAM_IDS:
         cursor.execute(
             "INSERT OR IGNORE INTO users (telegram_id, full_name, role) VALUES (?, ?, ?)",
             (telegram_id, "Админ", Roles.admin)
         )
     conn.commit()
+
+    verify_schema(conn)
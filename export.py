@@ -0,0 +1,185 @@
+"""
+Выгрузка статистики в CSV и XLSX.
+
+Выгрузка состоит из таблиц: статистика студентов и их ответы. Строки
+читаются из БД порциями по EXPORT_CHUNK_SIZE по возрастанию ключа и сразу
+пишутся в файл, поэтому память не зависит от размера выгрузки. Файл
+пишется в отдельном потоке, а порции читаются через поток БД, так что
+обработка остальных обновлений между порциями не останавливается.
+
+Ответы на опросы из архива (archive.py) выгружаются вместе с текущими:
+таблица читается запросом к архиву, затем к основной БД.
+
+XLSX - одна книга с листом на таблицу, CSV - отдельный файл на таблицу
+(разделитель ";" и BOM, чтобы Excel с русской локалью открыл его сразу).
+"""
+from dataclasses import dataclass
+from typing import Any, Iterator
+import asyncio
+import csv
+import os
+
+from openpyxl import Workbook
+
+from archive import HISTORY_SCHEMAS
+from db import Database, Roles
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = ("csv", "xlsx")
+MAX_EXPORT_FILE_SIZE = 50 * 1024 * 1024  # ограничение Bot API на отправку файлов
+
+
+@dataclass
+class ExportTable:
+    title: str
+    header: list[str]
+    # Запросы читаются по очереди. Первый столбец запроса - ключ порций,
+    # в файл не попадает. Последние два параметра - ключ, после которого
+    # читать, и LIMIT
+    queries: list[str]
+    params: tuple
+
+
+STUDENTS_HEADER = [
+    "ФИО", "Telegram ID", "Группа", "Внимательность", "Всего опросов",
+    "Пройдено опросов", "Процент участия", "Процент правильных ответов"
+]
+ANSWERS_HEADER = ["ФИО", "Telegram ID", "Группа", "Опрос", "Срок опроса", "Ответ", "Правильный"]
+
+
+def group_tables(group_id: int | None) -> list[ExportTable]:
+    """
+    Статистика студентов группы (или всех групп) и все их ответы
+    """
+    condition = "AND u.group_id = ?" if group_id is not None else ""
+    group_params = (group_id,) if group_id is not None else ()
+    return [
+        ExportTable("Студенты", STUDENTS_HEADER, [f"""
+            SELECT
+                u.id,
+                u.full_name,
+                u.telegram_id,
+                g.name,
+                u.attention_score,
+                s.total_polls,
+                s.completed_polls,
+                ROUND(s.completed_polls * 100.0 / s.total_polls, 2),
+                ROUND(s.correct_polls * 100.0 / s.total_polls, 2)
+            FROM users u
+            JOIN user_stats s ON s.user_id = u.id
+            LEFT JOIN groups g ON g.id = u.group_id
+            WHERE s.total_polls > 0 AND u.role != ? {condition} AND u.id > ?
+            ORDER BY u.id
+            LIMIT ?
+        """], (Roles.admin, *group_params)),
+        ExportTable("Ответы", ANSWERS_HEADER, [f"""
+            SELECT uo.id, u.full_name, u.telegram_id, g.name, p.question, p.expires_at, o.value, o.is_answer
+            FROM {schema}.user_options uo
+            JOIN users u ON u.id = uo.user_id
+            JOIN {schema}.options o ON o.id = uo.option_id
+            JOIN {schema}.polls p ON p.id = o.poll_id
+            LEFT JOIN groups g ON g.id = u.group_id
+            WHERE u.role != ? {condition} AND uo.id > ?
+            ORDER BY uo.id
+            LIMIT ?
+        """ for schema in HISTORY_SCHEMAS], (Roles.admin, *group_params)),
+    ]
+
+
+def poll_tables(poll_id: int) -> list[ExportTable]:
+    """
+    Все студенты группы опроса с их ответом, у не ответивших ответ пустой
+    """
+    return [
+        # Опрос есть либо в архиве, либо в основной БД
+        ExportTable("Ответы", ANSWERS_HEADER, [f"""
+            SELECT u.id, u.full_name, u.telegram_id, g.name, p.question, p.expires_at, a.value, a.is_answer
+            FROM {schema}.polls p
+            JOIN users u ON u.group_id = p.group_id AND u.role = ?
+            JOIN groups g ON g.id = p.group_id
+            LEFT JOIN (
+                SELECT uo.user_id, o.value, o.is_answer
+                FROM {schema}.user_options uo
+                JOIN {schema}.options o ON o.id = uo.option_id
+                WHERE o.poll_id = ?
+            ) a ON a.user_id = u.id
+            WHERE p.id = ? AND u.id > ?
+            ORDER BY u.id
+            LIMIT ?
+        """ for schema in HISTORY_SCHEMAS], (Roles.user, poll_id, poll_id)),
+    ]
+
+
+def stream_rows(db: Database, loop: asyncio.AbstractEventLoop, table: ExportTable, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    Строки таблицы порциями через поток БД. Вызывается не из цикла событий.
+    """
+    for query in table.queries:
+        last_key = 0
+        while True:
+            rows = asyncio.run_coroutine_threadsafe(
+                db.fetchall(query, (*table.params, last_key, chunk_size)), loop
+            ).result()
+            for row in rows:
+                yield row[1:]
+            if len(rows) < chunk_size:
+                break
+            last_key = rows[-1][0]
+
+
+def format_cell(header: str, value: Any) -> Any:
+    if header == "Правильный":
+        return "" if value is None else ("да" if value else "нет")
+    return value
+
+
+def write_csv(path: str, table: ExportTable, rows: Iterator[tuple]) -> int:
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(table.header)
+        for row in rows:
+            writer.writerow([format_cell(header, value) for header, value in zip(table.header, row)])
+            count += 1
+    return count
+
+
+def write_xlsx(path: str, tables: list[ExportTable], streams: list[Iterator[tuple]]) -> int:
+    # write_only: строки сразу уходят во временный файл, а не в память
+    workbook = Workbook(write_only=True)
+    count = 0
+    for table, rows in zip(tables, streams):
+        sheet = workbook.create_sheet(table.title)
+        sheet.append(table.header)
+        for row in rows:
+            sheet.append([format_cell(header, value) for header, value in zip(table.header, row)])
+            count += 1
+    workbook.save(path)
+    return count
+
+
+def write_export(db: Database, loop: asyncio.AbstractEventLoop, directory: str, name: str, tables: list[ExportTable], file_format: str) -> tuple[list[str], int]:
+    """
+    Запись выгрузки в файлы каталога directory
+
+    Returns:
+        tuple: Пути к файлам и количество записанных строк
+    """
+    streams = [stream_rows(db, loop, table) for table in tables]
+    if file_format == "xlsx":
+        path = os.path.join(directory, f"{name}.xlsx")
+        return [path], write_xlsx(path, tables, streams)
+
+    paths = []
+    count = 0
+    for table, rows in zip(tables, streams):
+        suffix = f"_{table.title.lower()}" if len(tables) > 1 else ""
+        path = os.path.join(directory, f"{name}{suffix}.csv")
+        count += write_csv(path, table, rows)
+        paths.append(path)
+    return paths, count
+
+
+async def export(db: Database, directory: str, name: str, tables: list[ExportTable], file_format: str) -> tuple[list[str], int]:
+    loop = asyncio.get_running_loop()
+    return await asyncio.to_thread(write_export, db, loop, directory, name, tables, file_format)
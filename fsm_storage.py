@@ -0,0 +1,309 @@
+from abc import abstractmethod
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable
+import asyncio
+import copy
+import json
+import sqlite3
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+from cache import TTLCache
+from db import Database
+
+FSM_CACHE_SIZE = 4096
+FSM_CACHE_TTL = 600  # секунд
+
+_NOT_LOADED = object()
+
+
+@dataclass
+class Record:
+    state: Any = _NOT_LOADED
+    data: Any = _NOT_LOADED
+    # Поля, изменённые во время обработки обновления: 'state', 'data'
+    dirty: set[str] = field(default_factory=set)
+
+
+# Состояния, прочитанные и изменённые во время обработки текущего обновления
+_update_records: ContextVar[dict[StorageKey, Record] | None] = ContextVar("fsm_update_records", default=None)
+
+
+class KeyEventIsolation(BaseEventIsolation):
+    """
+    Последовательная обработка обновлений одного пользователя в процессе.
+
+    То же, что SimpleEventIsolation из aiogram, но блокировка удаляется,
+    когда её больше никто не ждёт, и словарь не растёт с числом пользователей.
+    """
+
+    def __init__(self):
+        # Блокировка и число обновлений, которые её держат или ждут
+        self._locks: dict[StorageKey, tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncIterator[None]:
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+    async def close(self) -> None:
+        self._locks.clear()
+
+
+class CoalescingStorage(BaseStorage):
+    """
+    Хранилище состояний с отложенной записью.
+
+    Во время обработки обновления все set_state/set_data копятся в памяти
+    и записываются одним обращением к хранилищу после обработчика
+    (см. FlushStorageMiddleware). Вне обработки обновления запись сразу.
+
+    Так как запись откладывается до конца обработки, обновления одного
+    пользователя должны обрабатываться по очереди, иначе оба прочитают
+    старое состояние и одно из изменений потеряется. Для этого диспетчер
+    создаётся с events_isolation().
+
+    Кэш прочитанных состояний общий для процесса, поэтому его нужно
+    отключать (cache_size=0), если обновления одного пользователя могут
+    обрабатывать разные процессы.
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL):
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_size else None
+
+    @abstractmethod
+    async def _load(self, key: StorageKey, record: Record, part: str):
+        """
+        Чтение из хранилища незагруженного поля записи (и, если удобно, остальных)
+        """
+
+    @abstractmethod
+    async def _save(self, records: dict[StorageKey, Record]):
+        """
+        Запись изменённых полей нескольких записей
+        """
+
+    def events_isolation(self) -> BaseEventIsolation:
+        """
+        Очередь обновлений одного пользователя для Dispatcher(events_isolation=...).
+        Действует внутри процесса.
+        """
+        return KeyEventIsolation()
+
+    def _cached(self, key: StorageKey) -> Record:
+        if self._cache is not None:
+            item = self._cache.get(key)
+            if item is not None:
+                state, data = item
+                return Record(state=state, data=copy.deepcopy(data))
+        return Record()
+
+    def _remember(self, key: StorageKey, record: Record):
+        if self._cache is None:
+            return
+        if record.state is _NOT_LOADED or record.data is _NOT_LOADED:
+            self._cache.invalidate(key)
+        else:
+            self._cache.set(key, (record.state, copy.deepcopy(record.data)))
+
+    def _record(self, key: StorageKey) -> Record:
+        records = _update_records.get()
+        if records is None:
+            return self._cached(key)
+        record = records.get(key)
+        if record is None:
+            record = records[key] = self._cached(key)
+        return record
+
+    async def _read(self, key: StorageKey, part: str) -> Record:
+        record = self._record(key)
+        if getattr(record, part) is _NOT_LOADED:
+            await self._load(key, record, part)
+            if not record.dirty:
+                self._remember(key, record)
+        return record
+
+    async def _write(self, key: StorageKey, record: Record, part: str):
+        record.dirty.add(part)
+        if _update_records.get() is None:
+            await self.flush({key: record})
+
+    async def flush(self, records: dict[StorageKey, Record]):
+        changed = {key: record for key, record in records.items() if record.dirty}
+        if not changed:
+            return
+        try:
+            await self._save(changed)
+        except Exception:
+            if self._cache is not None:
+                for key in changed:
+                    self._cache.invalidate(key)
+            raise
+        for key, record in changed.items():
+            record.dirty.clear()
+            self._remember(key, record)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._write(key, record, 'state')
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._read(key, 'state')).state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        record = self._record(key)
+        record.data = data.copy()
+        await self._write(key, record, 'data')
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._read(key, 'data')).data.copy()
+
+    async def close(self) -> None:
+        pass
+
+
+def save_fsm_records(conn: sqlite3.Connection, rows: list[tuple[str, bool, str | None, bool, str]]):
+    conn.executemany("""
+        INSERT INTO fsm_states (key, state, data) VALUES (?1, ?3, ?5)
+        ON CONFLICT (key) DO UPDATE SET
+            state = CASE WHEN ?2 THEN excluded.state ELSE state END,
+            data = CASE WHEN ?4 THEN excluded.data ELSE data END
+    """, rows)
+    # Пустые записи (после state.clear()) не храним
+    conn.executemany(
+        "DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data = '{}'",
+        [(row[0],) for row in rows]
+    )
+
+
+class SQLiteStorage(CoalescingStorage):
+    """
+    Состояния диалогов в таблице fsm_states основной БД.
+
+    Состояние и данные хранятся в одной строке и читаются одним запросом.
+    """
+
+    def __init__(self, db: Database, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL):
+        super().__init__(cache_size, cache_ttl)
+        self.db = db
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def _load(self, key: StorageKey, record: Record, part: str):
+        row = await self.db.fetchone(
+            "SELECT state, data FROM fsm_states WHERE key = ?",
+            (self.key_builder.build(key),)
+        )
+        state, data = row if row else (None, '{}')
+        if record.state is _NOT_LOADED:
+            record.state = state
+        if record.data is _NOT_LOADED:
+            record.data = json.loads(data)
+
+    async def _save(self, records: dict[StorageKey, Record]):
+        rows = []
+        for key, record in records.items():
+            set_state = 'state' in record.dirty
+            set_data = 'data' in record.dirty
+            rows.append((
+                self.key_builder.build(key),
+                set_state,
+                record.state if set_state else None,
+                set_data,
+                json.dumps(record.data, ensure_ascii=False) if set_data else '{}',
+            ))
+        await self.db.transaction(save_fsm_records, rows)
+
+
+class RedisCoalescingStorage(CoalescingStorage):
+    """
+    Состояния диалогов на Redis-совместимом сервере.
+
+    Формат ключей тот же, что у RedisStorage из aiogram, отличается только
+    отложенная запись. Требует пакет redis.
+    """
+
+    def __init__(self, redis_storage: Any, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL):
+        super().__init__(cache_size, cache_ttl)
+        self.redis_storage = redis_storage
+
+    @classmethod
+    def from_url(cls, url: str, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL) -> "RedisCoalescingStorage":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("Для хранения состояний в Redis нужен пакет redis: pip install redis") from e
+        return cls(RedisStorage.from_url(url), cache_size, cache_ttl)
+
+    async def _load(self, key: StorageKey, record: Record, part: str):
+        if part == 'state':
+            record.state = await self.redis_storage.get_state(key)
+        else:
+            record.data = await self.redis_storage.get_data(key)
+
+    def events_isolation(self) -> BaseEventIsolation:
+        """
+        Блокировка на сервере Redis, общая для всех процессов бота
+        """
+        from aiogram.fsm.storage.redis import RedisEventIsolation
+
+        return RedisEventIsolation(self.redis_storage.redis, key_builder=self.redis_storage.key_builder)
+
+    async def _save(self, records: dict[StorageKey, Record]):
+        for key, record in records.items():
+            if 'state' in record.dirty:
+                await self.redis_storage.set_state(key, record.state)
+            if 'data' in record.dirty:
+                await self.redis_storage.set_data(key, record.data)
+
+    async def close(self) -> None:
+        await self.redis_storage.close()
+
+
+class FlushStorageMiddleware(BaseMiddleware):
+    """
+    Запись накопленных за обработку обновления изменений состояний.
+
+    Регистрируется как внешний middleware обновлений после FSM middleware
+    aiogram и берёт уже прочитанное им состояние, чтобы не читать его повторно.
+    """
+
+    def __init__(self, storage: CoalescingStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        records: dict[StorageKey, Record] = {}
+        context = data.get("state")
+        if isinstance(context, FSMContext) and context.storage is self.storage:
+            record = self.storage._cached(context.key)
+            record.state = data.get("raw_state")
+            records[context.key] = record
+
+        token = _update_records.set(records)
+        try:
+            return await handler(event, data)
+        finally:
+            _update_records.reset(token)
+            await self.storage.flush(records)
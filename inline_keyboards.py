@@ -1,4 +1,5 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from callbacks import PollOption
 
 user_menu = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Пройти опрос", callback_data="start_poll_compliting")],
@@ -18,3 +19,10 @@ go_to_menu_keyboard = InlineKeyboardMarkup(inline_keyboard=[
     [go_to_menu_button]
 ])
 
+
+
+def poll_options_keyboard(options: list[tuple[int, str]]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=str(value), callback_data=PollOption(option_id=option_id).pack())]
+        for option_id, value in options
+    ])
@@ -0,0 +1,196 @@
+"""
+Рейтинг студентов группы по коэффициенту внимательности.
+
+Коэффициент округляется до сотых и лежит в [MIN_SCORE, MAX_SCORE], поэтому
+студенты группы раскладываются по корзинам с шагом 0.01, а число студентов
+в корзинах хранится в дереве Фенвика. Место студента - один плюс число
+студентов группы с большим коэффициентом (одинаковые коэффициенты делят
+место), оно считается за O(log корзин) без запросов к БД.
+
+Индекс заполняется при старте, обновляется при каждом ответе и
+перезагружается целиком после добавления студентов и /rescore. Ответы,
+записанные другими процессами, догружаются через refresh: перечитываются
+только студенты, ответившие после последней загрузки.
+"""
+from dataclasses import dataclass
+import sqlite3
+
+from db import Database, Roles
+from utils import MAX_SCORE, MIN_SCORE
+
+SCORE_STEP = 0.01
+LEADERBOARD_SIZE = 10
+SCORE_BUCKETS = round((MAX_SCORE - MIN_SCORE) / SCORE_STEP) + 1
+
+
+def score_bucket(score: float) -> int:
+    """
+    Номер корзины коэффициента, 0 - MIN_SCORE
+    """
+    bucket = round((score - MIN_SCORE) / SCORE_STEP)
+    return min(max(bucket, 0), SCORE_BUCKETS - 1)
+
+
+class FenwickTree():
+    """
+    Префиксные суммы с изменением элемента за O(log n)
+    """
+
+    def __init__(self, size: int):
+        self._tree = [0] * (size + 1)
+
+    def add(self, index: int, delta: int):
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index: int) -> int:
+        """
+        Сумма элементов 0..index включительно
+        """
+        total = 0
+        index += 1
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+
+@dataclass
+class Entry:
+    user_id: int
+    group_id: int
+    full_name: str
+    score: float
+
+
+class GroupLeaderboard():
+    def __init__(self):
+        self.counts = FenwickTree(SCORE_BUCKETS)
+        # Студенты по корзинам, для списка лучших
+        self.buckets: dict[int, set[int]] = {}
+        self.size = 0
+
+    def add(self, entry: Entry):
+        bucket = score_bucket(entry.score)
+        self.counts.add(bucket, 1)
+        self.buckets.setdefault(bucket, set()).add(entry.user_id)
+        self.size += 1
+
+    def remove(self, entry: Entry):
+        bucket = score_bucket(entry.score)
+        self.counts.add(bucket, -1)
+        members = self.buckets[bucket]
+        members.discard(entry.user_id)
+        if not members:
+            del self.buckets[bucket]
+        self.size -= 1
+
+    def higher(self, score: float) -> int:
+        """
+        Число студентов группы с коэффициентом больше score
+        """
+        return self.size - self.counts.prefix_sum(score_bucket(score))
+
+
+def read_students(conn: sqlite3.Connection, after_answer_id: int | None = None) -> tuple[list[tuple], int]:
+    """
+    Коэффициенты студентов: всех или ответивших после ответа after_answer_id
+
+    Returns:
+        tuple[list[tuple], int]: (id, group_id, full_name, attention_score) и id последнего ответа
+    """
+    # Ответ и новый коэффициент записываются одной транзакцией, а id ответов
+    # растут в порядке фиксации, поэтому ответы после after_answer_id - все изменения с того момента
+    last_answer_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM user_options").fetchone()[0]
+    if after_answer_id is None:
+        rows = conn.execute(
+            "SELECT id, group_id, full_name, attention_score FROM users WHERE role = ? AND group_id IS NOT NULL",
+            (Roles.user,)
+        ).fetchall()
+    else:
+        rows = conn.execute("""
+            SELECT id, group_id, full_name, attention_score FROM users
+            WHERE role = ? AND id IN (SELECT user_id FROM user_options WHERE id > ? AND id <= ?)
+        """, (Roles.user, after_answer_id, last_answer_id)).fetchall()
+    return rows, max(last_answer_id, after_answer_id or 0)
+
+
+class Leaderboard():
+    """
+    Рейтинги всех групп, ключ - users.id студента
+    """
+
+    def __init__(self):
+        self._entries: dict[int, Entry] = {}
+        self._groups: dict[int, GroupLeaderboard] = {}
+        # Последний ответ, учтённый load или refresh
+        self._last_answer_id = 0
+
+    def update(self, user_id: int, group_id: int | None, full_name: str, score: float):
+        """
+        Новый коэффициент студента. Студент без группы в рейтинг не попадает.
+        """
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._groups[entry.group_id].remove(entry)
+        if group_id is None:
+            return
+        entry = Entry(user_id, group_id, full_name, score)
+        self._entries[user_id] = entry
+        self._groups.setdefault(group_id, GroupLeaderboard()).add(entry)
+
+    def get(self, user_id: int) -> Entry | None:
+        return self._entries.get(user_id)
+
+    def rank(self, user_id: int) -> tuple[int, int] | None:
+        """
+        Returns:
+            tuple[int, int] | None: Место студента и число студентов группы
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        group = self._groups[entry.group_id]
+        return group.higher(entry.score) + 1, group.size
+
+    def top(self, group_id: int, limit: int = LEADERBOARD_SIZE) -> list[tuple[int, Entry]]:
+        """
+        Лучшие студенты группы с местами, при равенстве - по имени
+        """
+        group = self._groups.get(group_id)
+        if group is None:
+            return []
+        result = []
+        place = 1
+        # Корзин немного, поэтому обходятся подряд от лучшей
+        for bucket in sorted(group.buckets, reverse=True):
+            entries = sorted((self._entries[user_id] for user_id in group.buckets[bucket]), key=lambda entry: entry.full_name)
+            result.extend((place, entry) for entry in entries[:limit - len(result)])
+            if len(result) >= limit:
+                break
+            place += len(entries)
+        return result
+
+    async def load(self, db: Database):
+        """
+        Загрузка коэффициентов студентов из БД, новый индекс подменяет текущий целиком
+        """
+        rows, last_answer_id = await db.snapshot(read_students)
+        leaderboard = Leaderboard()
+        for user_id, group_id, full_name, score in rows:
+            leaderboard.update(user_id, group_id, full_name, score)
+        self._entries, self._groups = leaderboard._entries, leaderboard._groups
+        self._last_answer_id = last_answer_id
+
+    async def refresh(self, db: Database):
+        """
+        Новые коэффициенты студентов, ответивших после последней загрузки
+        """
+        rows, self._last_answer_id = await db.snapshot(read_students, self._last_answer_id)
+        for user_id, group_id, full_name, score in rows:
+            self.update(user_id, group_id, full_name, score)
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,250 @@
+"""
+Результаты активных опросов для преподавателя в реальном времени.
+
+После создания опроса преподавателю отправляется сообщение с числом ответов
+по вариантам, его chat_id и message_id сохраняются в polls. Счётчики
+хранятся в памяти и увеличиваются при каждом ответе, а сообщение
+редактируется не чаще раза в RESULTS_EDIT_INTERVAL секунд на опрос: все
+ответы за это время попадают в одну правку.
+
+Процессов webhook может быть несколько, а сообщение опроса правит только
+процесс, который его отправил (polls.results_worker; если процессов стало
+меньше, номер берётся по модулю их числа). Остальные процессы его счётчики
+не хранят, а ответы, записанные ими, владелец догружает при синхронизации.
+
+При старте и при появлении опросов в других процессах счётчики сверяются
+с БД, после ответов в других процессах перечитываются только опросы,
+на которые ответили. При закрытии опроса итог читается из БД и фиксируется
+последней правкой.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+import asyncio
+import html
+import json
+import sqlite3
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from active_polls import last_answer_id
+from db import Database, Roles, db
+
+RESULTS_EDIT_INTERVAL = 1.0  # секунд между правками сообщения одного опроса
+
+
+@dataclass
+class PollTally:
+    poll_id: int
+    question: str
+    expires_at: datetime
+    # (id варианта, текст, правильный ли)
+    options: list[tuple[int, str, bool]]
+    students: int
+    chat_id: int
+    message_id: int
+    votes: dict[int, int] = field(default_factory=dict)
+
+    @property
+    def answered(self) -> int:
+        return sum(self.votes.values())
+
+
+def format_results(tally: PollTally, final: bool = False) -> str:
+    def percent(count: int) -> str:
+        return f" ({count * 100 // tally.students}%)" if tally.students else ""
+
+    lines = [f"📊 {'Итоги' if final else 'Результаты'} опроса: {html.escape(tally.question)}", ""]
+    for option_id, value, is_answer in tally.options:
+        count = tally.votes.get(option_id, 0)
+        lines.append(f"{'✅' if is_answer else '▫️'} {html.escape(value)}: {count}")
+    lines.append("")
+    lines.append(f"Ответили: {tally.answered} из {tally.students}{percent(tally.answered)}")
+    lines.append("Опрос завершён." if final else f"Обновлено {datetime.now():%H:%M:%S}")
+    return "\n".join(lines)
+
+
+def read_tallies(conn: sqlite3.Connection, poll_ids: list[int] | None = None, worker: tuple[int, int] | None = None) -> list[PollTally]:
+    """
+    Счётчики опросов с сообщением результатов по БД: указанных или всех активных
+
+    Args:
+        worker (tuple[int, int] | None): Номер процесса и число процессов,
+            только опросы, сообщения которых правит этот процесс
+    """
+    condition = "p.id IN (SELECT value FROM json_each(?))" if poll_ids is not None else "p.is_active"
+    params = (json.dumps(poll_ids),) if poll_ids is not None else ()
+    if worker is not None:
+        condition += " AND p.results_worker % ? = ?"
+        params += (worker[1], worker[0])
+    tallies = {
+        poll_id: PollTally(poll_id, question, datetime.fromisoformat(expires_at), [], students, chat_id, message_id)
+        for poll_id, question, expires_at, chat_id, message_id, students in conn.execute(f"""
+            SELECT p.id, p.question, p.expires_at, p.results_chat_id, p.results_message_id,
+                (SELECT COUNT(*) FROM users WHERE group_id = p.group_id AND role = ?)
+            FROM polls p
+            WHERE {condition} AND p.results_message_id IS NOT NULL
+        """, (Roles.user, *params))
+    }
+    if not tallies:
+        return []
+
+    for poll_id, option_id, value, is_answer, count in conn.execute("""
+        SELECT o.poll_id, o.id, o.value, o.is_answer, COUNT(uo.id)
+        FROM options o
+        LEFT JOIN user_options uo ON uo.option_id = o.id
+        WHERE o.poll_id IN (SELECT value FROM json_each(?))
+        GROUP BY o.id
+        ORDER BY o.id
+    """, (json.dumps(list(tallies)),)):
+        tally = tallies[poll_id]
+        tally.options.append((option_id, value, bool(is_answer)))
+        if count:
+            tally.votes[option_id] = count
+    return list(tallies.values())
+
+
+def read_changed_tallies(conn: sqlite3.Connection, worker: tuple[int, int], after_answer_id: int | None = None) -> tuple[list[PollTally], int]:
+    """
+    Счётчики активных опросов процесса worker: всех или тех, на которые ответили после ответа after_answer_id
+
+    Returns:
+        tuple[list[PollTally], int]: счётчики и id последнего ответа
+    """
+    last_id = last_answer_id(conn)
+    if after_answer_id is None:
+        return read_tallies(conn, worker=worker), last_id
+    poll_ids = [poll_id for poll_id, in conn.execute("""
+        SELECT DISTINCT o.poll_id FROM user_options uo
+        JOIN options o ON o.id = uo.option_id
+        WHERE uo.id > ? AND uo.id <= ?
+    """, (after_answer_id, last_id))]
+    return read_tallies(conn, poll_ids, worker) if poll_ids else [], max(last_id, after_answer_id)
+
+
+class LiveResults():
+    """
+    Счётчики ответов и отложенные правки сообщений результатов
+    """
+
+    def __init__(self, db: Database, interval: float = RESULTS_EDIT_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self.bot: Bot | None = None
+        # Номер процесса webhook и число процессов
+        self.worker = (0, 1)
+        self._tallies: dict[int, PollTally] = {}
+        self._last_edit: dict[int, float] = {}
+        self._pending: dict[int, asyncio.Task] = {}
+        # Последний ответ, учтённый load или refresh
+        self._last_answer_id = 0
+
+    def add(self, tally: PollTally):
+        self._tallies[tally.poll_id] = tally
+        # Сообщение только что отправлено с текущими счётчиками
+        self._last_edit[tally.poll_id] = time.monotonic()
+
+    def vote(self, poll_id: int, option_id: int):
+        tally = self._tallies.get(poll_id)
+        if tally is None:
+            return
+        tally.votes[option_id] = tally.votes.get(option_id, 0) + 1
+        self._schedule(poll_id)
+
+    def _schedule(self, poll_id: int):
+        # Уже запланированная правка покажет и этот ответ
+        if poll_id not in self._pending:
+            self._pending[poll_id] = asyncio.create_task(self._edit_later(poll_id))
+
+    def _drop(self, poll_id: int):
+        self._tallies.pop(poll_id, None)
+        self._last_edit.pop(poll_id, None)
+        task = self._pending.pop(poll_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _edit_later(self, poll_id: int):
+        try:
+            delay = self._last_edit.get(poll_id, 0) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            if self._pending.get(poll_id) is asyncio.current_task():
+                del self._pending[poll_id]
+
+        tally = self._tallies.get(poll_id)
+        # Закрытый опрос правит только freeze, иначе живая правка могла бы затереть итог
+        if tally is None or tally.expires_at <= datetime.now():
+            return
+        self._last_edit[poll_id] = time.monotonic()
+        try:
+            await self._edit(tally, format_results(tally))
+        except TelegramRetryAfter as e:
+            self._last_edit[poll_id] = time.monotonic() + e.retry_after
+            self._schedule(poll_id)
+        except Exception as e:
+            # Сообщение удалено или недоступно: больше не редактируется
+            print(f"Ошибка при обновлении результатов опроса {poll_id}: {e}")
+            self._drop(poll_id)
+
+    async def _edit(self, tally: PollTally, text: str):
+        try:
+            await self.bot.edit_message_text(text, chat_id=tally.chat_id, message_id=tally.message_id)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message:
+                raise
+
+    async def load(self):
+        """
+        Сверка счётчиков активных опросов с БД. Изменившиеся сообщения
+        будут обновлены, опросы, закрытые в другом процессе, забываются.
+        """
+        tallies, self._last_answer_id = await self.db.snapshot(read_changed_tallies, self.worker)
+        tallies = {tally.poll_id: tally for tally in tallies}
+        for poll_id in list(self._tallies):
+            if poll_id not in tallies:
+                self._drop(poll_id)
+        for tally in tallies.values():
+            self._replace(tally)
+
+    async def refresh(self):
+        """
+        Счётчики опросов, на которые ответили в других процессах после последней сверки
+        """
+        tallies, self._last_answer_id = await self.db.snapshot(read_changed_tallies, self.worker, self._last_answer_id)
+        for tally in tallies:
+            # Опросы, закрытые или появившиеся в других процессах, учитывает load
+            if tally.poll_id in self._tallies:
+                self._replace(tally)
+
+    def _replace(self, tally: PollTally):
+        current = self._tallies.get(tally.poll_id)
+        self._tallies[tally.poll_id] = tally
+        if current is None or current.votes != tally.votes:
+            self._schedule(tally.poll_id)
+
+    async def start(self, bot: Bot, worker: int = 0, workers: int = 1):
+        self.bot = bot
+        self.worker = (worker, workers)
+        await self.load()
+
+    async def freeze(self, poll_ids: list[int]):
+        """
+        Итог закрытых опросов по БД, после него сообщения больше не меняются
+        """
+        for poll_id in poll_ids:
+            self._drop(poll_id)
+        for tally in await self.db.snapshot(read_tallies, poll_ids):
+            try:
+                await self._edit(tally, format_results(tally, final=True))
+            except Exception as e:
+                print(f"Ошибка при фиксации итогов опроса {tally.poll_id}: {e}")
+
+    async def stop(self):
+        for task in self._pending.values():
+            task.cancel()
+        self._pending.clear()
+
+
+live_results = LiveResults(db)
@@ -1,19 +1,48 @@
 import re
+import functools
+import html
 from typing import Callable, Any
 from datetime import datetime, timedelta
 import os
 import sqlite3
 import asyncio
-from aiogram import Bot, Dispatcher
+from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import BufferedInputFile, FSInputFile, Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from db import Roles, create_connection, setup_database
-from inline_keyboards import admin_menu, user_menu, go_to_menu_keyboard, go_to_menu_button
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from contextlib import closing
+import multiprocessing
+import tempfile
+from db import Roles, connect, db, setup_database
+from cache import get_user, users_cache, update_cached_score
+from rendering import Data, bump, edit_text, render
+from callbacks import AddUser, CallbackRouter, CorrectOption, Export, GroupUsers, PollGroup, PollOption, Ranking, StatsGroups, StatsPage
+from archive import Archiver
+from leaderboard import leaderboard
+from export import EXPORT_FORMATS, MAX_EXPORT_FILE_SIZE, export, group_tables, poll_tables
+from rescore import rescore
+from roster import MAX_ROSTER_FILE_SIZE, import_students, parse_roster
+from stats import add_user_stats, on_poll_created, rebuild_user_stats
+from writer import AlreadyAnswered, PollClosed, answer_writer
+from scheduler import expiry_scheduler
+from active_polls import ActivePoll, active_polls
+from live_results import PollTally, format_results, live_results
+from quiz import MAX_QUIZ_FILE_SIZE, QUIZ_FILE_TYPES, CreatedPoll, parse_quiz, plan_schedule, quiz_scheduler
+from inline_keyboards import admin_menu, user_menu, go_to_menu_keyboard, go_to_menu_button, poll_options_keyboard
+from broadcast import BroadcastResult, broadcaster
+from sync import worker_sync
+from metrics import HandlerNameMiddleware, MetricsMiddleware, MetricsReporter, MetricsServer, count_error, metrics
+from profiler import format_slow_queries, slow_queries
+from throttling import ThrottlingMiddleware
+from fsm_storage import FSM_CACHE_SIZE, CoalescingStorage, FlushStorageMiddleware, RedisCoalescingStorage, SQLiteStorage
 from states import UserCreation, PollCreation, GroupCreation
-from utils import get_admin_user_statistics, get_user_statistics, calculate_attention_score
+from utils import get_admin_user_statistics, get_groups_page, get_user_statistics
 from dotenv import load_dotenv
 
 
@@ -23,36 +52,113 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
 
-dp = Dispatcher()
-
-conn = create_connection()
-cursor = conn.cursor()
+# polling - один процесс получает обновления через getUpdates,
+# webhook - Telegram присылает обновления на встроенный HTTP-сервер
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес сервера; без него webhook у Telegram не регистрируется
+# (удобно для локальной проверки отправкой сохранённых обновлений)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '1'))
+MULTIPROCESS = BOT_MODE == 'webhook' and WEBHOOK_WORKERS > 1
+
+# Хранилище состояний диалогов: sqlite (по умолчанию), redis или memory
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_REDIS_URL = os.getenv('FSM_REDIS_URL', 'redis://localhost:6379/0')
+
+# Порт /metrics в формате Prometheus, 0 - не запускать. Процессы webhook
+# слушают порты METRICS_PORT, METRICS_PORT + 1, ... по номеру процесса
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Интервал печати сводки метрик в секундах, 0 - не печатать
+METRICS_LOG_INTERVAL = float(os.getenv('METRICS_LOG_INTERVAL', '300'))
+
+# Журнал медленных запросов: порог в миллисекундах, 0 - выключен
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '0'))
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', '50'))
+# Нажатий кнопок в секунду на пользователя и допустимая серия нажатий подряд
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '2'))
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', '5'))
+
+# Закрытые опросы старше стольких дней переносятся в архив, 0 - только командой /archive
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '180'))
+
+MAX_MESSAGE_LENGTH = 4096  # ограничение Bot API на длину сообщения
+
+# Номер процесса webhook, задаётся в run_webhook_worker
+worker_index = 0
+
+
+def create_fsm_storage() -> BaseStorage:
+    # Обновления одного пользователя могут попасть в разные процессы,
+    # поэтому общий для процесса кэш состояний в этом случае отключается
+    cache_size = 0 if MULTIPROCESS else FSM_CACHE_SIZE
+    if FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    if FSM_STORAGE == 'redis':
+        return RedisCoalescingStorage.from_url(FSM_REDIS_URL, cache_size=cache_size)
+    return SQLiteStorage(db, cache_size=cache_size)
+
+
+async def is_admin(telegram_id: int) -> bool:
+    user = await get_user(telegram_id)
+    return user is not None and user.role == Roles.admin
+
+
+storage = create_fsm_storage()
+# Запись состояний откладывается до конца обработки, поэтому обновления
+# одного пользователя обрабатываются по очереди, см. fsm_storage.py
+dp = Dispatcher(
+    storage=storage,
+    events_isolation=storage.events_isolation() if isinstance(storage, CoalescingStorage) else None
+)
+# FSM middleware aiogram регистрируется в конструкторе и держит блокировку
+# пользователя всю обработку. Повторное нажатие должно отбрасываться до неё,
+# иначе оно дождётся первого и выполнится целиком, поэтому FSM middleware
+# переносится после метрик и ограничения нажатий. Замер включает запись
+# состояний: метрики регистрируются раньше FlushStorageMiddleware
+dp.update.outer_middleware.unregister(dp.fsm)
+dp.update.outer_middleware(MetricsMiddleware())
+# Администраторы листают статистику и создают опросы быстрее студентов
+dp.update.outer_middleware(ThrottlingMiddleware(THROTTLE_RATE, THROTTLE_BURST, exempt=is_admin))
+dp.update.outer_middleware(dp.fsm)
+dp.message.middleware(HandlerNameMiddleware())
+dp.callback_query.middleware(HandlerNameMiddleware())
+if isinstance(dp.storage, CoalescingStorage):
+    dp.update.outer_middleware(FlushStorageMiddleware(dp.storage))
+callbacks = CallbackRouter()
+metrics_server = MetricsServer()
+metrics_reporter = MetricsReporter(metrics, METRICS_LOG_INTERVAL)
+archiver = Archiver(db, ARCHIVE_AFTER_DAYS)
+if SLOW_QUERY_MS > 0:
+    slow_queries.enable(SLOW_QUERY_MS / 1000, SLOW_QUERY_LOG_SIZE)
 
 def check_is_admin(func: Callable[[Message | CallbackQuery, FSMContext | None], Any]) -> Callable[[Message | CallbackQuery], Any]:
+    @functools.wraps(func)
     async def wrapper(message_or_callback: Message | CallbackQuery, *args, **kwards):
         user_telegram_id = message_or_callback.from_user.id
-        self_conn = create_connection()
-        self_cursor = self_conn.cursor()
         try:
-            role = self_cursor.execute("SELECT role FROM users WHERE telegram_id = ?", (user_telegram_id,)).fetchone()
-            if role is None or role[0] != 'admin':
+            user = await get_user(user_telegram_id)
+            if user is None or user.role != Roles.admin:
                 print("Недостаточно прав для выполнения этой функции.")
                 return None 
         except Exception as e:
             print(f"Ошибка при проверке прав: {e}")
+            count_error()
             return None
-        finally:
-            self_cursor.close()
         
         return await func(message_or_callback, *args, **kwards)
     return wrapper
 
 
 @dp.message(Command("start"))
-@dp.callback_query(lambda c: c.data == 'start')
+@callbacks.action("start")
 async def start(message_or_callback: Message | CallbackQuery):
     telegram_id = message_or_callback.from_user.id
-    user = cursor.execute("SELECT role FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+    user = await get_user(telegram_id)
 
     if not user:
         if isinstance(message_or_callback, CallbackQuery):
@@ -61,7 +167,7 @@ async def start(message_or_callback: Message | CallbackQuery):
             await message_or_callback.answer("Вы не зарегистрированы. Попросите преподавателя добавить вас в систему.")
         return
     
-    user_role = user[0]
+    user_role = user.role
     markup = user_menu
     message_text = "Выберите опцию из меню!"
     
@@ -69,26 +175,29 @@ async def start(message_or_callback: Message | CallbackQuery):
         markup = admin_menu
     
     if isinstance(message_or_callback, CallbackQuery):
-        await message_or_callback.message.edit_text(message_text, reply_markup=markup)
+        await edit_text(message_or_callback.message, message_text, reply_markup=markup)
     else:
         await message_or_callback.answer(message_text, reply_markup=markup)
 
 
-@dp.callback_query(lambda c: c.data == "groups")
+@callbacks.action("groups")
 @check_is_admin
 async def get_groups(callback: CallbackQuery, *args, **kwards):
-    groups = cursor.execute('SELECT name FROM groups').fetchall()
+    async def build():
+        groups = await db.fetchall('SELECT name FROM groups')
+
+        formatted_groups = ""
+        for i, group in enumerate(groups, start=1):
+            formatted_groups += f'{i}. {group[0]}\n'
 
-    formatted_groups = ""
-    for i, group in enumerate(groups, start=1):
-        formatted_groups += f'{1}. {group}'
+        return f"Список групп:\n{formatted_groups}" if formatted_groups else "Групп нет", InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Создать группу", callback_data='create_group')],
+            [go_to_menu_button]
+        ])
 
-    await callback.message.edit_text(f"Список групп:\n{formatted_groups}" if formatted_groups else "Групп нет", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Создать группу", callback_data='create_group')],
-        [go_to_menu_button]
-    ]))
+    await edit_text(callback.message, *await render('groups', None, (Data.groups,), build))
 
-@dp.callback_query(lambda c: c.data == "create_group")
+@callbacks.action("create_group")
 @check_is_admin
 async def create_group(callback: CallbackQuery, state: FSMContext, *args, **kwards):
     await callback.message.edit_text("Введите название группы. Пример: \"43-ИС\"")
@@ -100,7 +209,7 @@ async def process_group_name(message: Message, state: FSMContext):
     group_name = message.text.strip()
     group_name_regexp = r"[0-9]{2,3}-[А-я]{2,3}"
 
-    existing_group = cursor.execute('select id from groups where name = ?', (group_name, )).fetchone()
+    existing_group = await db.fetchone('select id from groups where name = ?', (group_name, ))
     if existing_group:
         await message.answer(f"Группа с названием {group_name} уже добавлена", reply_markup=go_to_menu_keyboard)
         return
@@ -108,63 +217,124 @@ async def process_group_name(message: Message, state: FSMContext):
         await message.answer("Название группы не соответствует требованиям. Пример: \"43-ИС\"")
         return
 
-    teacher_id = cursor.execute("SELECT id FROM users WHERE telegram_id = ?", (user_telegram_id,)).fetchone()[0]
-    cursor.execute(
+    teacher_id = (await get_user(user_telegram_id)).id
+    await db.execute(
         "INSERT INTO groups (name, teacher_id) VALUES (?, ?)",
         (group_name, teacher_id)
     )
-    conn.commit()
+    bump(Data.groups)
     await message.answer(f"Группа '{group_name}' успешно создана.", reply_markup=admin_menu)
-    state.clear()
+    await state.clear()
 
 
-@dp.callback_query(lambda c: c.data == "users")
+@callbacks.action("users")
 @check_is_admin
 async def get_users(callback: CallbackQuery, *args, **kwards):
-    groups = cursor.execute('SELECT id, name from groups').fetchall()
+    async def build():
+        groups = await db.fetchall('SELECT id, name from groups')
 
-    if not groups:
-        await callback.answer("Группы не найдены.")
-        return
+        if not groups:
+            return "Группы не найдены.", go_to_menu_keyboard
 
-    keyboard = [
-            [InlineKeyboardButton(text=group[1], callback_data=f"view_users_list_{group[0]} {group[1]}")]
-            for group in groups
-        ]
-    
-    keyboard.append([go_to_menu_button])
+        keyboard = [
+                [InlineKeyboardButton(text=group[1], callback_data=GroupUsers(group_id=group[0]).pack())]
+                for group in groups
+            ]
+        
+        keyboard.append([go_to_menu_button])
+
+        return "Выберите группу для просмотра списка пользователей:", InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-    await callback.message.edit_text("Выберите группу для просмотра списка пользователей:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    await edit_text(callback.message, *await render('users', None, (Data.groups,), build))
 
 
-@dp.callback_query(lambda c: c.data.startswith('view_users_list_'))
+@callbacks.payload(GroupUsers)
 @check_is_admin
-async def view_users_list_by_group_name(callback: CallbackQuery, *args, **kwards):
-    group_id, group_name = callback.data.split('_')[-1].split(' ')
-    users = cursor.execute('SELECT full_name FROM users where group_id = ?', (group_id)).fetchall()
+async def view_users_list_by_group_name(callback: CallbackQuery, callback_data: GroupUsers, *args, **kwards):
+    group_id = callback_data.group_id
 
-    formatted_users = ""
-    for i, user in enumerate(users, start=1):
-        formatted_users += f'{i}. {user[0]}\n'
+    async def build():
+        group = await db.fetchone('SELECT name FROM groups WHERE id = ?', (group_id,))
+        if not group:
+            return "Группа не найдена.", go_to_menu_keyboard
+        group_name = group[0]
+        users = await db.fetchall('SELECT full_name FROM users where group_id = ?', (group_id,))
+
+        formatted_users = ""
+        for i, user in enumerate(users, start=1):
+            formatted_users += f'{i}. {user[0]}\n'
 
-    await callback.message.edit_text(f"Список пользователей группы <b>{group_name}</b>:\n{formatted_users}" if formatted_users else "Пользователей нет", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Добавить нового пользователя", callback_data=f'set_user_group_{group_id} {group_name}')],
-        [go_to_menu_button]
-    ]))
+        return f"Список пользователей группы <b>{group_name}</b>:\n{formatted_users}" if formatted_users else "Пользователей нет", InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Добавить нового пользователя", callback_data=AddUser(group_id=group_id).pack())],
+            [go_to_menu_button]
+        ])
 
-@dp.callback_query(lambda c: c.data.startswith("set_user_group_"))
+    await edit_text(callback.message, *await render('group_users', group_id, (Data.groups, Data.users), build))
+
+@callbacks.payload(AddUser)
 @check_is_admin
-async def set_user_group(callback: CallbackQuery, state: FSMContext, *args, **kwards):
-    group_id, group_name = callback.data.split("_")[-1].split(' ')
+async def set_user_group(callback: CallbackQuery, state: FSMContext, callback_data: AddUser, *args, **kwards):
+    group = await db.fetchone('SELECT id, name FROM groups WHERE id = ?', (callback_data.group_id,))
+    if not group:
+        await callback.message.edit_text("Группа не найдена.", reply_markup=go_to_menu_keyboard)
+        return
+    group_id, group_name = group
     await state.update_data(group_id=group_id, group_name=group_name)
 
     await callback.message.edit_text(
-        f"Введите данные студента в формате:\nФИО Telegram_ID",
+        f"Введите данные студента в формате:\nФИО Telegram_ID\n\n"
+        f"Или отправьте файл CSV/XLSX со списком группы: ФИО и Telegram_ID в каждой строке",
         reply_markup=go_to_menu_keyboard
     )
 
     await state.set_state(UserCreation.waiting_for_user_data)
 
+@dp.message(UserCreation.waiting_for_user_data, F.document)
+@check_is_admin
+async def import_group_roster(message: Message, state: FSMContext, *args, **kwards):
+    data = await state.get_data()
+    group_id = data["group_id"]
+    group_name = data["group_name"]
+
+    document = message.document
+    file_name = document.file_name or ""
+    if not file_name.lower().endswith((".csv", ".xlsx")):
+        await message.answer("Поддерживаются только файлы CSV и XLSX.")
+        return
+    if document.file_size and document.file_size > MAX_ROSTER_FILE_SIZE:
+        await message.answer("Файл слишком большой: Telegram позволяет боту скачивать файлы до 20 МБ.")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "roster")
+        try:
+            await message.bot.download(document, destination=path)
+            students, summary = await asyncio.to_thread(parse_roster, path, file_name)
+        except Exception as e:
+            print(f"Ошибка при чтении списка группы: {e}")
+            count_error()
+            await message.answer("Не удалось прочитать файл. Проверьте формат и попробуйте еще раз.")
+            return
+
+    if students:
+        await db.transaction(import_students, group_id, students, summary)
+        await leaderboard.load(db)
+    for telegram_id in summary.inserted:
+        users_cache.invalidate(telegram_id)
+    if summary.inserted:
+        bump(Data.users)
+
+    text = f"""Импорт в группу '{group_name}' завершён.
+✅ Добавлено: {len(summary.inserted)}
+♻️ Уже зарегистрированы: {len(summary.duplicates)}
+❌ Ошибки: {len(summary.invalid)}"""
+    for line, reason in summary.invalid[:10]:
+        text += f"\nСтрока {line}: {reason}"
+    if len(summary.invalid) > 10:
+        text += f"\n... и ещё {len(summary.invalid) - 10}"
+    await message.answer(text, reply_markup=admin_menu)
+
+
 @dp.message(UserCreation.waiting_for_user_data)
 @check_is_admin
 async def set_user_data(message: Message, state: FSMContext, *args, **kwards):
@@ -173,53 +343,180 @@ async def set_user_data(message: Message, state: FSMContext, *args, **kwards):
     group_name = data["group_name"]
 
     args = message.text.split(" ")
-    if len(args) != 3:
+    if len(args) != 3 or not args[2].isdigit():
         await message.answer("Формат данных некорректный. Пример: Иван Иванов 123456789")
         return
 
     first_name, last_name, telegram_id = args
     full_name = f'{first_name} {last_name}'
     try:
-        cursor.execute(
-            "INSERT INTO users (telegram_id, full_name, role, group_id) VALUES (?, ?, 'user', ?)",
-            (telegram_id, full_name, group_id)
-        )
-        conn.commit()
+        def create_user(conn: sqlite3.Connection):
+            user_id = conn.execute(
+                "INSERT INTO users (telegram_id, full_name, role, group_id) VALUES (?, ?, 'user', ?)",
+                (telegram_id, full_name, group_id)
+            ).lastrowid
+            add_user_stats(conn, user_id, group_id)
+
+        await db.transaction(create_user)
+        await leaderboard.load(db)
+        users_cache.invalidate(int(telegram_id))
+        bump(Data.users)
         await message.answer(f"Студент '{full_name}' успешно добавлен в группу '{group_name}'.", reply_markup=admin_menu)
     except sqlite3.IntegrityError as e:
         print(e);
         await message.answer(f"Студент с Telegram ID {telegram_id} уже существует.")
 
 
-@dp.callback_query(lambda c: c.data == "create_poll")
+@callbacks.action("create_poll")
 @check_is_admin
 async def select_group_for_poll(callback: CallbackQuery, *args, **kwards):
-    cursor.execute(
-        "SELECT id, name FROM groups WHERE teacher_id = (SELECT id FROM users WHERE telegram_id = ?)",
-        (callback.from_user.id,)
+    teacher = await get_user(callback.from_user.id)
+
+    async def build():
+        groups = await db.fetchall("SELECT id, name FROM groups WHERE teacher_id = ?", (teacher.id,))
+
+        if not groups:
+            return "У вас пока нет групп. Сначала создайте группу.", None
+
+        return "Выберите группу для опроса:", InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text=group[1], callback_data=PollGroup(group_id=group[0]).pack())]
+                for group in groups
+            ]
+        )
+
+    await edit_text(callback.message, *await render('create_poll', teacher.id, (Data.groups,), build))
+
+@callbacks.payload(PollGroup)
+@check_is_admin
+async def start_poll_creation(callback: CallbackQuery, state: FSMContext, callback_data: PollGroup, *args, **kwards):
+    await state.update_data(group_id=callback_data.group_id)
+
+    await state.set_state(PollCreation.waiting_for_question)
+    await callback.message.edit_text(
+        "Введите текст вопроса для опроса:\n\n"
+        "Или отправьте файл теста JSON/JSONL/CSV со многими вопросами. "
+        "С подписью «по очереди» вопросы начнутся друг за другом."
     )
-    groups = cursor.fetchall()
 
-    if not groups:
-        await callback.message.edit_text("У вас пока нет групп. Сначала создайте группу.")
+
+@dp.message(PollCreation.waiting_for_question, F.document)
+@check_is_admin
+async def import_quiz_file(message: Message, state: FSMContext, *args, **kwards):
+    group_id = int((await state.get_data())["group_id"])
+
+    document = message.document
+    file_name = document.file_name or ""
+    if not file_name.lower().endswith(QUIZ_FILE_TYPES):
+        await message.answer("Поддерживаются только файлы JSON, JSONL и CSV.")
+        return
+    if document.file_size and document.file_size > MAX_QUIZ_FILE_SIZE:
+        await message.answer("Файл слишком большой: Telegram позволяет боту скачивать файлы до 20 МБ.")
         return
 
-    group_markup = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=group[1], callback_data=f"select_group_for_poll_creation_{group[0]}")]
-            for group in groups
-        ]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "quiz")
+        try:
+            await message.bot.download(document, destination=path)
+            questions, summary = await asyncio.to_thread(parse_quiz, path, file_name)
+        except Exception as e:
+            print(f"Ошибка при чтении теста: {e}")
+            count_error()
+            await message.answer("Не удалось прочитать файл. Проверьте формат и попробуйте еще раз.")
+            return
+
+    created, scheduled = [], 0
+    if questions:
+        plan_schedule(questions, datetime.now(), "по очереди" in (message.caption or "").lower())
+        created, scheduled = await quiz_scheduler.import_quiz(group_id, message.chat.id, questions)
+        for poll in created:
+            register_poll(poll)
+        bump(Data.polls)
+        await state.clear()
+
+    text = f"""Импорт теста завершён.
+✅ Опросов создано: {len(created)}
+🕒 Запланировано: {scheduled}
+❌ Ошибки: {len(summary.invalid)}"""
+    for line, reason in summary.invalid[:10]:
+        text += f"\nВопрос {line}: {reason}"
+    if len(summary.invalid) > 10:
+        text += f"\n... и ещё {len(summary.invalid) - 10}"
+    await message.answer(text, reply_markup=admin_menu if questions else None)
+
+    if created:
+        students = await db.fetchall(
+            "SELECT telegram_id FROM users WHERE group_id = ? AND role = ?",
+            (group_id, Roles.user)
+        )
+        for poll in created:
+            await send_poll_results_panel(message.bot, poll, len(students))
+        # Один анонс вместо сообщения на каждый вопрос, вопросы открываются по кнопке по очереди
+        broadcaster.start(
+            message.bot,
+            [student[0] for student in students],
+            f"Доступен новый тест: вопросов {len(created)}.",
+            reply_markup=user_menu,
+        )
+
+
+def register_poll(poll: CreatedPoll):
+    active_polls.add(ActivePoll(
+        id=poll.id,
+        group_id=poll.group_id,
+        question=poll.question,
+        expires_at=poll.expires_at,
+        options=poll.options,
+        keyboard=poll_options_keyboard(poll.options),
+    ))
+    expiry_scheduler.schedule(poll.id, poll.expires_at)
+
+
+async def send_results_panel(bot: Bot, chat_id: int, tally: PollTally):
+    """
+    Сообщение с результатами опроса, обновляемое по мере ответов
+    """
+    results_message = await bot.send_message(chat_id, format_results(tally))
+    tally.chat_id, tally.message_id = chat_id, results_message.message_id
+    await db.execute(
+        "UPDATE polls SET results_chat_id = ?, results_message_id = ?, results_worker = ? WHERE id = ?",
+        (tally.chat_id, tally.message_id, worker_index, tally.poll_id)
     )
-    await callback.message.edit_text("Выберите группу для опроса:", reply_markup=group_markup)
+    live_results.add(tally)
 
-@dp.callback_query(lambda c: c.data.startswith("select_group_for_poll_creation_"))
-@check_is_admin
-async def start_poll_creation(callback: CallbackQuery, state: FSMContext, *args, **kwards):
-    group_id = callback.data.split("_")[-1]
-    await state.update_data(group_id=group_id)
 
-    await state.set_state(PollCreation.waiting_for_question)
-    await callback.message.edit_text("Введите текст вопроса для опроса:")
+async def send_poll_results_panel(bot: Bot, poll: CreatedPoll, students: int):
+    """
+    Сообщение с результатами опроса теста в чат преподавателя, который его импортировал
+    """
+    if poll.chat_id is None:
+        return
+    await send_results_panel(bot, poll.chat_id, PollTally(
+        poll.id, poll.question, poll.expires_at,
+        [(option_id, value, index == poll.answer_index) for index, (option_id, value) in enumerate(poll.options)],
+        students, poll.chat_id, 0
+    ))
+
+
+async def publish_started_polls(bot: Bot, polls: list[CreatedPoll]):
+    """
+    Рассылка запланированных вопросов теста в момент их начала
+    """
+    for poll in polls:
+        register_poll(poll)
+    bump(Data.polls)
+    for poll in polls:
+        students = await db.fetchall(
+            "SELECT telegram_id FROM users WHERE group_id = ? AND role = ?",
+            (poll.group_id, Roles.user)
+        )
+        await send_poll_results_panel(bot, poll, len(students))
+        broadcaster.start(
+            bot,
+            [student[0] for student in students],
+            poll.question,
+            reply_markup=poll_options_keyboard(poll.options),
+        )
 
 
 @dp.message(PollCreation.waiting_for_question)
@@ -242,7 +539,7 @@ async def add_poll_option(message: Message, state: FSMContext, *args, **kwards):
             return
         await state.set_state(PollCreation.waiting_for_correct_option)
         options_markup = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=option, callback_data=f"set_correct_answer_{i}")]
+            [InlineKeyboardButton(text=option, callback_data=CorrectOption(index=i).pack())]
             for i, option in enumerate(options)
         ])
         await message.reply("Варианты записаны", reply_markup=ReplyKeyboardRemove())
@@ -253,17 +550,16 @@ async def add_poll_option(message: Message, state: FSMContext, *args, **kwards):
     if text in data["options"]:
         await message.answer("Данный вариант ответа уже добавлен.")
         return
-    data["options"].append(text)
+    await state.update_data(options=data["options"] + [text])
     await message.answer(f"Вариант ответа добавлен: {text}", reply_markup=ReplyKeyboardMarkup(keyboard=[
         [KeyboardButton(text="Готово")]
     ], resize_keyboard=True))
 
 
-@dp.callback_query(lambda c: c.data.startswith("set_correct_answer"))
+@callbacks.payload(CorrectOption)
 @check_is_admin
-async def set_correct_option(callback: CallbackQuery, state: FSMContext, *args, **kwards):
-    correct_index = int(callback.data.split("_")[-1])
-    await state.update_data(answer_index=correct_index)
+async def set_correct_option(callback: CallbackQuery, state: FSMContext, callback_data: CorrectOption, *args, **kwards):
+    await state.update_data(answer_index=callback_data.index)
 
     await state.set_state(PollCreation.waiting_for_duration)
     await callback.message.edit_text("Введите длительность опроса в минутах:")
@@ -286,81 +582,104 @@ async def set_poll_duration(message: Message, state: FSMContext, *args, **kwards
     answer = options[answer_index]
 
     expires_at = datetime.now() + timedelta(minutes=duration)
-    poll = cursor.execute("""
-      INSERT INTO polls (question, group_id, expires_at) VALUES (?, ?, ?) RETURNING id
-    """, (question, group_id, expires_at)).fetchone()
-    
-    poll_id = poll[0]
-    for option in options:
-        if option == answer:
-            cursor.execute("""
-            INSERT INTO options (poll_id, value, is_answer) VALUES (?, ?, ?)
-            """, (poll_id, answer, 1))
-        else:
-            cursor.execute("""
-                INSERT INTO options (poll_id, value) VALUES (?, ?)
-            """, (poll_id, option))
 
-    conn.commit()
+    def create_poll(conn: sqlite3.Connection):
+        poll = conn.execute("""
+          INSERT INTO polls (question, group_id, expires_at) VALUES (?, ?, ?) RETURNING id
+        """, (question, group_id, expires_at)).fetchone()
+
+        poll_id = poll[0]
+        option_rows = []
+        for option in options:
+            if option == answer:
+                option_id = conn.execute("""
+                INSERT INTO options (poll_id, value, is_answer) VALUES (?, ?, ?)
+                """, (poll_id, answer, 1)).lastrowid
+            else:
+                option_id = conn.execute("""
+                    INSERT INTO options (poll_id, value) VALUES (?, ?)
+                """, (poll_id, option)).lastrowid
+            option_rows.append((option_id, option))
+        on_poll_created(conn, group_id)
+        return poll_id, option_rows
+
+    poll_id, option_rows = await db.transaction(create_poll)
+    poll_keyboard = poll_options_keyboard(option_rows)
+    active_polls.add(ActivePoll(
+        id=poll_id,
+        group_id=int(group_id),
+        question=question,
+        expires_at=expires_at,
+        options=option_rows,
+        keyboard=poll_keyboard,
+    ))
+    expiry_scheduler.schedule(poll_id, expires_at)
+    bump(Data.polls)
     await state.clear()
     await message.answer(f"Опрос создан!\nВопрос: {question}\nДлительность: {duration} минут.", reply_markup=admin_menu)
 
+    students = await db.fetchall(
+        "SELECT telegram_id FROM users WHERE group_id = ? AND role = ?",
+        (group_id, Roles.user)
+    )
+    await send_results_panel(message.bot, message.chat.id, PollTally(
+        poll_id, question, expires_at,
+        [(option_id, option, option == answer) for option_id, option in option_rows],
+        len(students), message.chat.id, 0
+    ))
+
+    if not students:
+        return
+
+    progress_message = await message.answer(f"Рассылка опроса: 0 из {len(students)}")
+
+    async def report_progress(result: BroadcastResult):
+        status = "завершена" if result.done == result.total else "идёт"
+        await progress_message.edit_text(
+            f"Рассылка опроса {status}: доставлено {result.sent} из {result.total}"
+            + (f", ошибок: {result.failed}" if result.failed else "")
+        )
 
-@dp.callback_query(lambda c: c.data == "start_poll_compliting")
+    broadcaster.start(
+        message.bot,
+        [student[0] for student in students],
+        question,
+        reply_markup=poll_keyboard,
+        on_progress=report_progress,
+    )
+
+
+@callbacks.action("start_poll_compliting")
 async def start_poll_compliting(callback: CallbackQuery):
     user_telegram_id = callback.from_user.id
     try:
-        user = cursor.execute('select users.id from users where telegram_id = ?', (user_telegram_id,)).fetchone()
+        user = await get_user(user_telegram_id)
         if not user:
             await callback.message.edit_text("Не удалось получить ваши данные", reply_markup=go_to_menu_keyboard)
             return
         
-        group = cursor.execute("SELECT group_id FROM users WHERE telegram_id = ?", (user_telegram_id,)).fetchone()
-        if not group:
+        if user.group_id is None:
             await callback.message.edit_text("Не удалось получить вашу группу.", reply_markup=go_to_menu_keyboard)
             return
-        user_group_id = group[0]  
-        active_poll = cursor.execute(
-            "select polls.id, polls.question from polls where polls.group_id = ? and polls.expires_at > ? and is_active",
-            (user_group_id, datetime.now())
-        ).fetchone()
 
+        active_poll = active_polls.poll_for_user(user.group_id, user.id)
         if not active_poll:
             await callback.message.edit_text("Активных опросов нет.", reply_markup=go_to_menu_keyboard)
             return
 
-        poll_id, question = active_poll
-
-        count = cursor.execute("""
-            SELECT COUNT(*) FROM user_options 
-            WHERE user_id = ? AND option_id IN (
-                SELECT id FROM options WHERE poll_id = ?
-            )
-        """, (user[0], poll_id)).fetchone()
-
-        if count[0] > 0:
-            await callback.message.edit_text("Активных опросов нет.", reply_markup=go_to_menu_keyboard)
-            return
-
-        options = cursor.execute("SELECT id, value FROM options WHERE poll_id = ?", (poll_id,)).fetchall()
-        options_markup = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=str(row[1]), callback_data=f'select_poll_option_{row[0]}')] for row in options
-        ])
-        await callback.message.edit_text(question, reply_markup=options_markup)
+        await callback.message.edit_text(active_poll.question, reply_markup=active_poll.keyboard)
     except Exception as e:
         print(e)
+        count_error()
 
 
-@dp.callback_query(lambda c: c.data.startswith("select_poll_option_"))
-async def handle_select_poll_option(callback: CallbackQuery):
+@callbacks.payload(PollOption)
+async def handle_select_poll_option(callback: CallbackQuery, callback_data: PollOption):
     user_telegram_id = callback.from_user.id
-    option_id = callback.data.split("_")[-1]
+    option_id = callback_data.option_id
 
     try:
-        student = cursor.execute(
-            "SELECT id, attention_score FROM users WHERE telegram_id = ?", 
-            (user_telegram_id,)
-        ).fetchone()
+        student = await get_user(user_telegram_id)
         
         if not student:
             await callback.message.edit_text(
@@ -369,40 +688,35 @@ async def handle_select_poll_option(callback: CallbackQuery):
             )
             return
 
-        user_id, current_attention_score = student
-
-        # Проверяем, является ли ответ правильным
-        is_correct_answer = cursor.execute(
-            "SELECT is_answer FROM options WHERE id = ?", 
-            (option_id,)
-        ).fetchone()[0]
-
-        total_polls_stats = cursor.execute("""
-            SELECT 
-                COUNT(DISTINCT p.id) as total_polls,
-                COUNT(DISTINCT CASE WHEN o.is_answer = 1 THEN p.id END) as correct_polls
-            FROM polls p
-            JOIN groups g ON p.group_id = (SELECT group_id FROM users WHERE id = ?)
-            JOIN options o ON o.poll_id = p.id
-            LEFT JOIN user_options uo ON uo.option_id = o.id AND uo.user_id = ?
-        """, (user_id, user_id)).fetchone()
-
-        new_attention_score = calculate_attention_score(
-            current_attention_score, 
-            is_correct_answer, 
-            total_polls_stats[0], 
-            total_polls_stats[1]
-        )
-
-        cursor.execute(
-            "INSERT INTO user_options (user_id, option_id) VALUES (?, ?)",
-            (user_id, option_id)
-        )
-        cursor.execute(
-            "UPDATE users SET attention_score = ? WHERE id = ?",
-            (new_attention_score, user_id)
-        )
-        conn.commit()
+        try:
+            # Индекс только отсекает заведомо лишние ответы. Опрос, созданный
+            # в другом процессе, появляется в нём лишь при синхронизации,
+            # поэтому вариант не из индекса проверяет по БД save_answer
+            active_poll = active_polls.poll_by_option(option_id)
+            if active_poll is not None and active_poll.is_expired:
+                raise PollClosed()
+            if active_poll is not None and student.id in active_poll.answered:
+                raise AlreadyAnswered()
+            new_attention_score = await answer_writer.submit(student.id, option_id)
+            if active_poll is not None:
+                active_poll.answered.add(student.id)
+                live_results.vote(active_poll.id, option_id)
+        except AlreadyAnswered:
+            await callback.message.edit_text(
+                "Вы уже ответили на этот опрос.", 
+                reply_markup=go_to_menu_keyboard
+            )
+            return
+        except PollClosed:
+            await callback.message.edit_text(
+                "Опрос уже завершён.", 
+                reply_markup=go_to_menu_keyboard
+            )
+            return
+        update_cached_score(user_telegram_id, new_attention_score)
+        if student.role == Roles.user:
+            leaderboard.update(student.id, student.group_id, student.full_name, new_attention_score)
+        bump(Data.answers)
 
         await callback.message.edit_text(
             f"Ваш ответ учтен! Спасибо.\n", 
@@ -411,32 +725,64 @@ async def handle_select_poll_option(callback: CallbackQuery):
 
     except Exception as e:
         print(e)
+        count_error()
         await callback.message.edit_text(
             "Произошла ошибка. Пожалуйста, попробуйте еще раз.", 
             reply_markup=go_to_menu_keyboard
         )
 
 
-@dp.callback_query(lambda c: c.data.startswith("my_statistic"))
+@callbacks.action("my_statistic")
 async def user_stats_handler(callback: CallbackQuery):
-    user_stats = await get_user_statistics(callback.from_user.id, cursor)
+    user_stats = await get_user_statistics(callback.from_user.id, db)
     if user_stats:
+        user = await get_user(callback.from_user.id)
+        rank = leaderboard.rank(user.id)
+        rank_line = f"🥇 Место в группе: {rank[0]} из {rank[1]}\n" if rank else ""
+        keyboard = [[go_to_menu_button]]
+        if rank:
+            keyboard.insert(0, [InlineKeyboardButton(text="Рейтинг группы", callback_data=Ranking(group_id=user.group_id).pack())])
         await callback.message.edit_text(f"""
 Статистика пользователя:
 👤 Имя: {user_stats['full_name']}
 📊 Группа: {user_stats['group_name']}
 🏆 Коэфф. внимательности: {user_stats['attention_score']}
-✅ Пройдено опросов: {user_stats['completed_polls']}
+{rank_line}✅ Пройдено опросов: {user_stats['completed_polls']}
 📈 Процент участия: {user_stats['completion_rate']}%
 🎯 Процент правильных ответов: {user_stats['correct_answers_rate']}%
-""", reply_markup=go_to_menu_keyboard)
+""", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+
+
+@callbacks.payload(Ranking)
+async def ranking_handler(callback: CallbackQuery, callback_data: Ranking):
+    user = await get_user(callback.from_user.id)
+    if user is None:
+        return
+    # Студент видит только рейтинг своей группы
+    group_id = callback_data.group_id if user.role == Roles.admin else user.group_id
+    group = await db.fetchone("SELECT name FROM groups WHERE id = ?", (group_id,))
+    top = leaderboard.top(group_id)
+    if group is None or not top:
+        await callback.answer("В группе нет студентов.")
+        return
+
+    text = f"🏅 Рейтинг группы '{html.escape(group[0])}' по внимательности:\n"
+    for place, entry in top:
+        marker = " ← вы" if entry.user_id == user.id else ""
+        text += f"\n{place}. {html.escape(entry.full_name)} - {entry.score:.2f}{marker}"
+    own = leaderboard.get(user.id)
+    if own and own.group_id == group_id and all(entry.user_id != user.id for _, entry in top):
+        text += f"\n...\n{leaderboard.rank(user.id)[0]}. {html.escape(own.full_name)} - {own.score:.2f} ← вы"
+    await edit_text(callback.message, text, go_to_menu_keyboard)
+    await callback.answer()
+
+async def build_stats_page(group_id: int | None, direction: str, cursor: int | None) -> tuple[str, InlineKeyboardMarkup]:
+    if direction == 'prev':
+        users_stats, has_prev, has_next = await get_admin_user_statistics(db, group_id, before_id=cursor)
+    else:
+        users_stats, has_prev, has_next = await get_admin_user_statistics(db, group_id, after_id=cursor)
 
-@dp.callback_query(lambda c: c.data.startswith("statistic"))
-@check_is_admin
-async def admin_stats_handler(callback: CallbackQuery, *args, **kwards):
-    users_stats = await get_admin_user_statistics(cursor)
     stats_text = ""
-    
     for user in users_stats:
         stats_text += f"""
 👤 {user['full_name']}
@@ -448,14 +794,386 @@ async def admin_stats_handler(callback: CallbackQuery, *args, **kwards):
 🎯 Процент правильных ответов: {user['correct_answers_rate']}%
 ---
 """
-    await callback.message.edit_text(stats_text if stats_text else "Пользователей нет", reply_markup=go_to_menu_keyboard)
-    await callback.message.answer()
 
+    group_key = group_id or 0
+    navigation = []
+    if users_stats and has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=StatsPage(group_id=group_key, direction='prev', cursor=users_stats[0]['id']).pack()))
+    if users_stats and has_next:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data=StatsPage(group_id=group_key, direction='next', cursor=users_stats[-1]['id']).pack()))
+
+    # Группы выбираются на отдельных страницах, чтобы клавиатура не росла с их числом
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton(text="📂 Выбрать группу", callback_data=StatsGroups().pack())])
+    keyboard.append(export_buttons('group', group_key))
+    if group_id is not None:
+        keyboard.append([InlineKeyboardButton(text="🏅 Рейтинг группы", callback_data=Ranking(group_id=group_id).pack())])
+        keyboard.append([InlineKeyboardButton(text="Все группы", callback_data="statistic")])
+    keyboard.append([go_to_menu_button])
+
+    return stats_text if stats_text else "Пользователей нет", InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+async def render_stats_page(group_id: int | None, direction: str, cursor: int | None) -> tuple[str, InlineKeyboardMarkup]:
+    return await render(
+        'statistic',
+        (group_id, direction, cursor),
+        (Data.groups, Data.users, Data.polls, Data.answers),
+        lambda: build_stats_page(group_id, direction, cursor)
+    )
+
+
+async def build_stats_groups_page(direction: str, cursor: int | None) -> tuple[str, InlineKeyboardMarkup]:
+    if direction == 'prev':
+        groups, has_prev, has_next = await get_groups_page(db, before_id=cursor)
+    else:
+        groups, has_prev, has_next = await get_groups_page(db, after_id=cursor)
+
+    group_buttons = [
+        InlineKeyboardButton(text=name, callback_data=StatsPage(group_id=id).pack())
+        for id, name in groups
+    ]
+    keyboard = [group_buttons[i:i + 3] for i in range(0, len(group_buttons), 3)]
+    navigation = []
+    if groups and has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=StatsGroups(direction='prev', cursor=groups[0][0]).pack()))
+    if groups and has_next:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data=StatsGroups(direction='next', cursor=groups[-1][0]).pack()))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton(text="Все группы", callback_data="statistic")])
+    keyboard.append([go_to_menu_button])
+
+    return "Выберите группу:" if groups else "Групп нет", InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+@callbacks.payload(StatsGroups)
+@check_is_admin
+async def admin_stats_groups_handler(callback: CallbackQuery, callback_data: StatsGroups, *args, **kwards):
+    await edit_text(callback.message, *await render(
+        'stats_groups',
+        (callback_data.direction, callback_data.cursor),
+        (Data.groups,),
+        lambda: build_stats_groups_page(callback_data.direction, callback_data.cursor or None)
+    ))
+    await callback.answer()
+
+
+@callbacks.action("statistic")
+@check_is_admin
+async def admin_stats_handler(callback: CallbackQuery, *args, **kwards):
+    await edit_text(callback.message, *await render_stats_page(None, 'next', None))
+    await callback.answer()
+
+
+@callbacks.payload(StatsPage)
+@check_is_admin
+async def admin_stats_page_handler(callback: CallbackQuery, callback_data: StatsPage, *args, **kwards):
+    await edit_text(callback.message, *await render_stats_page(
+        callback_data.group_id or None,
+        callback_data.direction,
+        callback_data.cursor or None
+    ))
+    await callback.answer()
+
+
+def export_buttons(target: str, target_id: int) -> list[InlineKeyboardButton]:
+    return [
+        InlineKeyboardButton(text=f"📥 {file_format.upper()}", callback_data=Export(target=target, id=target_id, format=file_format).pack())
+        for file_format in EXPORT_FORMATS
+    ]
+
+
+async def send_export(message: Message, target: str, target_id: int | None, file_format: str):
+    if target == 'poll':
+        if await db.fetchone(
+            "SELECT 1 FROM polls WHERE id = ? UNION ALL SELECT 1 FROM archive.polls WHERE id = ?", (target_id, target_id)
+        ) is None:
+            await message.answer("Опрос не найден.")
+            return
+        name, tables = f"Опрос_{target_id}", poll_tables(target_id)
+    elif target_id is not None:
+        group = await db.fetchone("SELECT name FROM groups WHERE id = ?", (target_id,))
+        if group is None:
+            await message.answer("Группа не найдена.")
+            return
+        name, tables = f"Группа_{group[0]}", group_tables(target_id)
+    else:
+        name, tables = "Все_группы", group_tables(None)
+    name = re.sub(r"[^\w-]+", "_", name)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            paths, rows = await export(db, tmp, name, tables, file_format)
+        except Exception as e:
+            print(f"Ошибка при выгрузке статистики: {e}")
+            count_error()
+            await message.answer("Не удалось подготовить файл выгрузки.")
+            return
+
+        if any(os.path.getsize(path) > MAX_EXPORT_FILE_SIZE for path in paths):
+            await message.answer("Файл больше 50 МБ, Telegram не позволит его отправить. Выгрузите статистику по группам.")
+            return
+        for path in paths:
+            await message.answer_document(FSInputFile(path), caption=f"Строк: {rows}" if path == paths[-1] else None)
+
+
+@callbacks.payload(Export)
+@check_is_admin
+async def export_handler(callback: CallbackQuery, callback_data: Export, *args, **kwards):
+    await callback.answer("Готовлю файл...")
+    await send_export(
+        callback.message,
+        callback_data.target,
+        callback_data.id or None,
+        callback_data.format if callback_data.format in EXPORT_FORMATS else 'csv'
+    )
+
+
+@dp.message(Command("export"))
+@check_is_admin
+async def export_command_handler(message: Message, *args, **kwards):
+    # /export [group <id> | poll <id>] [csv|xlsx]
+    args = message.text.split()[1:]
+    file_format = args.pop() if args and args[-1] in EXPORT_FORMATS else 'csv'
+    if not args:
+        await send_export(message, 'group', None, file_format)
+    elif len(args) == 2 and args[0] in ('group', 'poll') and args[1].isdigit():
+        await send_export(message, args[0], int(args[1]), file_format)
+    else:
+        await message.answer("Использование: /export [group <id> | poll <id>] [csv|xlsx]")
+
+
+@dp.message(Command("rebuild_stats"))
+@check_is_admin
+async def rebuild_stats_handler(message: Message, *args, **kwards):
+    await db.transaction(rebuild_user_stats)
+    bump(Data.answers)
+    await message.answer("Статистика пересчитана.", reply_markup=admin_menu)
+
+
+@dp.message(Command("rescore"))
+@check_is_admin
+async def rescore_handler(message: Message, *args, **kwards):
+    # /rescore - все студенты, /rescore <id группы> - одна группа
+    args = message.text.split()
+    if len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        await message.answer("Использование: /rescore [id группы]")
+        return
+
+    updated = await db.transaction(rescore, int(args[1]) if len(args) == 2 else None)
+    await leaderboard.load(db)
+    users_cache.clear()
+    bump(Data.users)
+    await message.answer(f"Коэффициенты внимательности пересчитаны: {updated} студентов.", reply_markup=admin_menu)
+
+
+@dp.message(Command("archive"))
+@check_is_admin
+async def archive_handler(message: Message, *args, **kwards):
+    # /archive - опросы старше ARCHIVE_AFTER_DAYS дней, /archive <дней> - старше указанного срока
+    args = message.text.split()
+    if len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        await message.answer("Использование: /archive [дней]")
+        return
+    after_days = int(args[1]) if len(args) == 2 else ARCHIVE_AFTER_DAYS
+    if after_days <= 0:
+        await message.answer("Укажите срок: /archive <дней>")
+        return
+
+    result = await archiver.run(after_days)
+    await message.answer(
+        f"В архив перенесено опросов: {result.polls}, ответов: {result.answers}.\n"
+        f"Освобождено страниц БД: {result.freed_pages}.",
+        reply_markup=admin_menu
+    )
+
+
+@dp.message(Command("slow_queries"))
+@check_is_admin
+async def slow_queries_handler(message: Message, *args, **kwards):
+    # /slow_queries - показать журнал медленных запросов, /slow_queries clear - очистить
+    if not slow_queries.enabled:
+        await message.answer("Журнал медленных запросов выключен (SLOW_QUERY_MS).", reply_markup=admin_menu)
+        return
+    if message.text.split()[1:] == ["clear"]:
+        slow_queries.clear()
+        await message.answer("Журнал медленных запросов очищен.", reply_markup=admin_menu)
+        return
+
+    entries = slow_queries.entries()
+    if not entries:
+        await message.answer(f"Запросов дольше {SLOW_QUERY_MS:g} мс не было.", reply_markup=admin_menu)
+        return
+
+    text = format_slow_queries(entries)
+    pre = f"<pre>{html.escape(text)}</pre>"
+    if len(pre) <= MAX_MESSAGE_LENGTH:
+        await message.answer(pre, reply_markup=admin_menu)
+    else:
+        document = BufferedInputFile(text.encode(), filename="slow_queries.txt")
+        await message.answer_document(document, caption=f"Медленных запросов: {len(entries)}", reply_markup=admin_menu)
+
+
+async def send_poll_results(bot: Bot, poll_ids: list[int]):
+    for poll_id in poll_ids:
+        poll = await db.fetchone("""
+            SELECT p.question, u.telegram_id,
+                (SELECT COUNT(*) FROM users WHERE group_id = p.group_id AND role = ?)
+            FROM polls p
+            JOIN groups g ON g.id = p.group_id
+            JOIN users u ON u.id = g.teacher_id
+            WHERE p.id = ?
+        """, (Roles.user, poll_id))
+        if not poll:
+            continue
+        question, teacher_telegram_id, students_count = poll
+
+        options = await db.fetchall("""
+            SELECT o.value, o.is_answer, COUNT(uo.id)
+            FROM options o
+            LEFT JOIN user_options uo ON uo.option_id = o.id
+            WHERE o.poll_id = ?
+            GROUP BY o.id
+            ORDER BY o.id
+        """, (poll_id,))
+        answered = sum(option[2] for option in options)
+
+        results = "\n".join(
+            f"{'✅' if is_answer else '▫️'} {value}: {count}"
+            for value, is_answer, count in options
+        )
+        await bot.send_message(
+            teacher_telegram_id,
+            f"Опрос завершён: {question}\n{results}\n\nОтветили: {answered} из {students_count}",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[export_buttons('poll', poll_id)])
+        )
+
+
+callbacks.setup(dp)
+
+
+@dp.startup()
+async def on_startup(bot: Bot):
+    await db.transaction(setup_database)
+
+    async def notify_teachers(poll_ids: list[int]):
+        await send_poll_results(bot, poll_ids)
+
+    async def publish_polls(polls: list[CreatedPoll]):
+        await publish_started_polls(bot, polls)
+
+    async def evict_closed_polls(poll_ids: list[int]):
+        for poll_id in poll_ids:
+            active_polls.remove(poll_id)
+
+    await active_polls.load(db)
+    await leaderboard.load(db)
+    expiry_scheduler.on_close(evict_closed_polls)
+    expiry_scheduler.on_close(live_results.freeze)
+    expiry_scheduler.on_close(notify_teachers)
+    # Сообщения результатов правит только процесс, который их отправил
+    await live_results.start(bot, worker_index, WEBHOOK_WORKERS if MULTIPROCESS else 1)
+    await expiry_scheduler.start()
+    # Запускается во всех процессах: вопрос запускает тот, кто первым удалит его из scheduled_polls
+    quiz_scheduler.on_start(publish_polls)
+    await quiz_scheduler.start()
+
+    if MULTIPROCESS:
+        async def refresh_worker_caches(kinds: list[str]):
+            if Data.users in kinds:
+                users_cache.clear()
+            # Ответы других процессов догружаются без перечитывания всех активных опросов
+            if Data.polls in kinds:
+                await active_polls.load(db)
+                await live_results.load()
+            elif Data.answers in kinds:
+                await active_polls.refresh(db)
+                await live_results.refresh()
+            if Data.users in kinds:
+                await leaderboard.load(db)
+            elif Data.answers in kinds:
+                await leaderboard.refresh(db)
+
+        worker_sync.on_change(refresh_worker_caches)
+        await worker_sync.start()
+
+    # Процессы webhook работают с одной БД, архивирует только первый
+    if ARCHIVE_AFTER_DAYS > 0 and worker_index == 0:
+        await archiver.start()
+
+    if METRICS_PORT:
+        await metrics_server.start(METRICS_HOST, METRICS_PORT + worker_index)
+    if METRICS_LOG_INTERVAL > 0:
+        await metrics_reporter.start()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    await archiver.stop()
+    await metrics_reporter.stop()
+    await metrics_server.stop()
+    await quiz_scheduler.stop()
+    await expiry_scheduler.stop()
+    await live_results.stop()
+    await answer_writer.close()
+    if MULTIPROCESS:
+        await worker_sync.stop()
+    await db.close()
 
 
 async def main():
-    setup_database(conn=conn)
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
+
+def run_webhook_worker(index: int = 0):
+    global worker_index
+    worker_index = index
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    # Несколько процессов слушают один порт, соединения между ними распределяет ядро
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, reuse_port=WEBHOOK_WORKERS > 1, print=None)
+
+
+async def set_webhook():
+    async with bot.session:
+        await bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+
+
+def run_webhook():
+    # Схема обновляется до запуска процессов, чтобы они не выполняли миграции одновременно
+    with closing(connect()) as conn:
+        setup_database(conn)
+    if WEBHOOK_URL:
+        asyncio.run(set_webhook())
+
+    if WEBHOOK_WORKERS <= 1:
+        run_webhook_worker()
+        return
+
+    if isinstance(dp.storage, MemoryStorage):
+        print("Внимание: состояния диалогов хранятся в памяти процесса и не видны другим процессам")
+
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_webhook_worker, args=(index,)) for index in range(WEBHOOK_WORKERS)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,407 @@
+"""
+Метрики обработки обновлений и запросов к SQLite.
+
+MetricsMiddleware замеряет обработку каждого обновления и считает обновления
+и ошибки по типу обновления и обработчику, HandlerNameMiddleware сообщает
+ей, какой обработчик выбран. Соединение TimedConnection замеряет каждый
+SQL-запрос вместе с чтением результата и относит его к обработчику
+текущего обновления, запросы вне обновлений относятся к "background".
+
+Метрики отдаются в текстовом формате Prometheus (MetricsServer) и
+периодически печатаются сводкой (MetricsReporter).
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+import asyncio
+import functools
+import itertools
+import sqlite3
+import threading
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from profiler import slow_queries
+
+HANDLER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+METRICS_LOG_INTERVAL = 300.0  # секунд
+SUMMARY_TOP_QUERIES = 5
+QUERY_LABEL_LENGTH = 160
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+UNHANDLED = "unhandled"
+BACKGROUND = "background"
+
+
+class Histogram():
+    """
+    Гистограмма с фиксированными границами, как histogram в Prometheus
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # Последний счётчик - значения больше всех границ (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+@dataclass
+class UpdateInfo:
+    type: str
+    handler: str = UNHANDLED
+    failed: bool = False
+
+
+_current_update: ContextVar[UpdateInfo | None] = ContextVar("metrics_update", default=None)
+
+
+def current_handler() -> str:
+    update = _current_update.get()
+    return update.handler if update is not None else BACKGROUND
+
+
+@functools.lru_cache(maxsize=1024)
+def query_label(sql: str) -> str:
+    return " ".join(sql.split())[:QUERY_LABEL_LENGTH]
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Metrics():
+    """
+    Счётчики и гистограммы процесса.
+
+    Запросы к SQLite замеряются в потоке БД, обновления - в цикле событий,
+    поэтому изменения и чтение идут под блокировкой.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.updates: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.errors: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.handler_seconds: dict[str, Histogram] = {}
+        self.sql_seconds: dict[tuple[str, str], Histogram] = {}
+
+    def observe_update(self, update: UpdateInfo, seconds: float):
+        with self._lock:
+            self.updates[update.type, update.handler] += 1
+            if update.failed:
+                self.errors[update.type, update.handler] += 1
+            histogram = self.handler_seconds.get(update.handler)
+            if histogram is None:
+                histogram = self.handler_seconds[update.handler] = Histogram(HANDLER_BUCKETS)
+            histogram.observe(seconds)
+
+    def observe_query(self, sql: str, seconds: float):
+        key = (current_handler(), query_label(sql))
+        with self._lock:
+            histogram = self.sql_seconds.get(key)
+            if histogram is None:
+                histogram = self.sql_seconds[key] = Histogram(SQL_BUCKETS)
+            histogram.observe(seconds)
+
+    def totals(self) -> dict[str, Any]:
+        """
+        Накопленные количества и суммарное время для сводки
+        """
+        with self._lock:
+            return {
+                "updates": sum(self.updates.values()),
+                "errors": sum(self.errors.values()),
+                "handlers": {name: (h.count, h.sum) for name, h in self.handler_seconds.items()},
+                "sql": {key: (h.count, h.sum) for key, h in self.sql_seconds.items()},
+            }
+
+    def render(self) -> str:
+        """
+        Метрики в текстовом формате Prometheus
+        """
+        lines = []
+        with self._lock:
+            for name, help_text, values in (
+                ("bot_updates_total", "Обработанные обновления", self.updates),
+                ("bot_update_errors_total", "Обновления, обработка которых завершилась ошибкой", self.errors),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for (update_type, handler), value in sorted(values.items()):
+                    lines.append(f'{name}{{type="{update_type}",handler="{escape_label(handler)}"}} {value}')
+
+            for name, help_text, histograms in (
+                ("bot_handler_duration_seconds", "Время обработки обновления",
+                 {(("handler", handler),): h for handler, h in self.handler_seconds.items()}),
+                ("bot_sql_duration_seconds", "Время SQL-запроса вместе с чтением результата",
+                 {(("handler", handler), ("query", query)): h for (handler, query), h in self.sql_seconds.items()}),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for labels, histogram in sorted(histograms.items()):
+                    lines += self._render_histogram(name, labels, histogram)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(name: str, labels: tuple[tuple[str, str], ...], histogram: Histogram) -> list[str]:
+        label_text = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels)
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{label_text}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+        return lines
+
+
+def format_summary(current: dict[str, Any], previous: dict[str, Any], seconds: float) -> str:
+    """
+    Сводка по изменениям между двумя результатами Metrics.totals()
+    """
+    def delta(key: str) -> list[tuple[Any, int, float]]:
+        rows = []
+        for name, (count, total) in current[key].items():
+            previous_count, previous_total = previous.get(key, {}).get(name, (0, 0.0))
+            if count > previous_count:
+                rows.append((name, count - previous_count, total - previous_total))
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    updates = current["updates"] - previous.get("updates", 0)
+    errors = current["errors"] - previous.get("errors", 0)
+    lines = [f"Метрики за {seconds:.0f} с: обновлений {updates}, ошибок {errors}"]
+    for handler, count, total in delta("handlers"):
+        lines.append(f"  {handler}: {count} шт., среднее {total / count * 1000:.1f} мс, всего {total:.2f} с")
+
+    queries = delta("sql")[:SUMMARY_TOP_QUERIES]
+    if queries:
+        lines.append("  Самые долгие запросы:")
+    for (handler, query), count, total in queries:
+        lines.append(f"  {total * 1000:.1f} мс, {count} шт., {handler}: {query}")
+    return "\n".join(lines)
+
+
+metrics = Metrics()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Курсор, замеряющий каждый запрос.
+
+    Результат SELECT вычисляется по мере чтения, поэтому замер запроса,
+    вернувшего строки, завершается после первого fetchone/fetchmany/fetchall
+    (или при следующем запросе, закрытии курсора). Запросы дольше порога
+    журнала медленных запросов передаются в profiler.slow_queries.
+    """
+
+    _query: str | None = None
+    _parameters: Any = ()
+    _elapsed = 0.0
+
+    def _finish(self):
+        if self._query is not None:
+            query, self._query = self._query, None
+            metrics.observe_query(query, self._elapsed)
+            if slow_queries.enabled and self._elapsed >= slow_queries.threshold:
+                slow_queries.record(self.connection, query, self._parameters, self._elapsed, current_handler())
+
+    def _timed(self, method: Callable, *args) -> Any:
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def execute(self, sql: str, parameters: Any = ()) -> "TimedCursor":
+        self._finish()
+        self._query, self._parameters, self._elapsed = sql, parameters, 0.0
+        try:
+            self._timed(super().execute, sql, parameters)
+        finally:
+            if self.description is None:
+                self._finish()
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> "TimedCursor":
+        self._finish()
+        self._query, self._parameters, self._elapsed = sql, (), 0.0
+        if slow_queries.enabled:
+            # Для плана нужен первый набор параметров, остальные передаются как есть
+            rest = iter(seq_of_parameters)
+            first = next(rest, None)
+            if first is not None:
+                self._parameters = first
+                seq_of_parameters = itertools.chain((first,), rest)
+        try:
+            self._timed(super().executemany, sql, seq_of_parameters)
+        finally:
+            self._finish()
+        return self
+
+    def fetchone(self) -> Any:
+        try:
+            return self._timed(super().fetchone)
+        finally:
+            self._finish()
+
+    def fetchmany(self, size: int | None = None) -> list[Any]:
+        try:
+            return self._timed(super().fetchmany, self.arraysize if size is None else size)
+        finally:
+            self._finish()
+
+    def fetchall(self) -> list[Any]:
+        try:
+            return self._timed(super().fetchall)
+        finally:
+            self._finish()
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Соединение, все запросы которого идут через TimedCursor:
+    sqlite3.connect(path, factory=TimedConnection)
+    """
+
+    def cursor(self, factory: type[sqlite3.Cursor] = TimedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Время обработки, количество обновлений и ошибок.
+
+    Регистрируется как внешний middleware обновлений, чтобы в замер входила
+    и запись состояний диалогов в FlushStorageMiddleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        update = UpdateInfo(event.event_type if isinstance(event, Update) else type(event).__name__)
+        token = _current_update.set(update)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            update.failed = True
+            raise
+        finally:
+            metrics.observe_update(update, time.perf_counter() - started)
+            _current_update.reset(token)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """
+    Имя выбранного обработчика для MetricsMiddleware.
+
+    Регистрируется на наблюдателях событий (dp.message, dp.callback_query),
+    где фильтры уже выбрали обработчик. Для callback-запросов обработчик
+    выбирает CallbackRouter, он передаётся в callback_route.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        update = _current_update.get()
+        if update is not None:
+            route = data.get("callback_route") or data.get("handler")
+            if route is not None:
+                update.handler = route.callback.__name__
+        return await handler(event, data)
+
+
+def count_error():
+    """
+    Отметка ошибки, которую обработчик перехватил сам
+    """
+    update = _current_update.get()
+    if update is not None:
+        update.failed = True
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+
+
+class MetricsServer():
+    """
+    Отдельный HTTP-сервер с адресом /metrics
+    """
+
+    def __init__(self):
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get("/metrics", metrics_handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class MetricsReporter():
+    """
+    Периодическая печать сводки метрик за прошедший интервал
+    """
+
+    def __init__(self, metrics: Metrics, interval: float = METRICS_LOG_INTERVAL):
+        self.metrics = metrics
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        previous = self.metrics.totals()
+        started = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            current = self.metrics.totals()
+            now = time.monotonic()
+            if current["updates"] != previous["updates"]:
+                print(format_summary(current, previous, now - started))
+            previous, started = current, now
@@ -0,0 +1,300 @@
+from datetime import datetime
+import sqlite3
+from typing import Callable
+
+
+def initial_schema(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER UNIQUE NOT NULL,
+        full_name TEXT NOT NULL,
+        attention_score REAL DEFAULT 1.0,
+        group_id INTEGER,
+        role TEXT CHECK(role IN ('admin', 'user')) NOT NULL
+        )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS groups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        teacher_id INTEGER NOT NULL,
+        FOREIGN KEY (teacher_id) REFERENCES users(id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS polls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        question TEXT NOT NULL,
+        group_id INTEGER NOT NULL,
+        expires_at DATETIME NOT NULL,
+        is_active BOOLEAN DEFAULT TRUE,
+        FOREIGN KEY (group_id) REFERENCES groups(id)
+    )
+    """)
+    # Таблица ответов студентов
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS options (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        poll_id INTEGER NOT NULL,
+        value TEXT NOT NULL,
+        is_answer BOOLEAN DEFAULT 0,
+        FOREIGN KEY (poll_id) REFERENCES polls(id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_options (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        option_id INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (option_id) REFERENCES options(id)
+        UNIQUE (user_id, option_id)
+    )
+    """)
+
+
+def hot_path_indexes(conn: sqlite3.Connection):
+    # Поиск активного опроса группы и статистика по опросам группы
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_polls_group_expires ON polls (group_id, expires_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_options_poll ON options (poll_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_group ON users (group_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_options_option ON user_options (option_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_teacher ON groups (teacher_id)")
+
+
+def user_stats_table(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        total_polls INTEGER NOT NULL DEFAULT 0,
+        completed_polls INTEGER NOT NULL DEFAULT 0,
+        correct_polls INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+    # Запрос пересчёта на момент миграции: stats.rebuild_user_stats с тех пор
+    # изменился, а результат выпущенной миграции от него зависеть не должен
+    conn.execute("""
+    INSERT INTO user_stats (user_id, total_polls, completed_polls, correct_polls)
+    SELECT
+        u.id,
+        (
+            SELECT COUNT(*) FROM polls p
+            WHERE p.group_id = u.group_id
+              AND EXISTS (SELECT 1 FROM options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+        ),
+        (
+            SELECT COUNT(DISTINCT o.poll_id) FROM user_options uo
+            JOIN options o ON o.id = uo.option_id
+            JOIN polls p ON p.id = o.poll_id
+            WHERE uo.user_id = u.id AND p.group_id = u.group_id
+        ),
+        (
+            SELECT COUNT(DISTINCT o.poll_id) FROM user_options uo
+            JOIN options o ON o.id = uo.option_id
+            JOIN polls p ON p.id = o.poll_id
+            WHERE uo.user_id = u.id AND p.group_id = u.group_id AND o.is_answer = 1
+        )
+    FROM users u
+    """)
+
+
+def active_polls_index(conn: sqlite3.Connection):
+    # Опросы закрываются планировщиком, поэтому активных всегда немного
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_polls_active ON polls (group_id) WHERE is_active")
+
+
+def data_versions_table(conn: sqlite3.Connection):
+    # Общие для всех процессов бота версии данных, см. sync.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS data_versions (
+        kind TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+
+def fsm_states_table(conn: sqlite3.Connection):
+    # Состояния диалогов, см. fsm_storage.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}'
+    )
+    """)
+
+
+def poll_results_message(conn: sqlite3.Connection):
+    # Сообщение с результатами опроса у преподавателя, см. live_results.py
+    conn.execute("ALTER TABLE polls ADD COLUMN results_chat_id INTEGER")
+    conn.execute("ALTER TABLE polls ADD COLUMN results_message_id INTEGER")
+
+
+def poll_results_worker(conn: sqlite3.Connection):
+    # Процесс webhook, который правит сообщение с результатами, см. live_results.py
+    conn.execute("ALTER TABLE polls ADD COLUMN results_worker INTEGER NOT NULL DEFAULT 0")
+
+
+def scheduled_polls_table(conn: sqlite3.Connection):
+    # Вопросы импортированного теста, которые ещё не начались, см. quiz.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS scheduled_polls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        chat_id INTEGER,
+        question TEXT NOT NULL,
+        options TEXT NOT NULL,
+        answer_index INTEGER NOT NULL,
+        duration INTEGER NOT NULL,
+        starts_at DATETIME NOT NULL,
+        FOREIGN KEY (group_id) REFERENCES groups(id)
+    )
+    """)
+
+
+def close_expired_polls(conn: sqlite3.Connection):
+    # До планировщика (scheduler.py) опросы не закрывались, и все старые
+    # остались активными. Закрываются здесь, чтобы при первом запуске
+    # планировщик не рассылал преподавателям итоги каждого из них
+    conn.execute("UPDATE polls SET is_active = 0 WHERE is_active AND expires_at <= ?", (datetime.now(),))
+
+
+def archive_schema(conn: sqlite3.Connection):
+    """
+    Таблицы архива (см. archive.py) в подключённой БД archive.
+
+    Создаются при подключении архива, а не миграцией: файл архива
+    отдельный и может появиться позже основной БД. Столбцы архивных
+    polls, options и user_options совпадают с основными таблицами.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive.polls (
+        id INTEGER PRIMARY KEY,
+        question TEXT NOT NULL,
+        group_id INTEGER NOT NULL,
+        expires_at DATETIME NOT NULL,
+        is_active BOOLEAN DEFAULT TRUE
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive.options (
+        id INTEGER PRIMARY KEY,
+        poll_id INTEGER NOT NULL,
+        value TEXT NOT NULL,
+        is_answer BOOLEAN DEFAULT 0
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive.user_options (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        option_id INTEGER NOT NULL
+    )
+    """)
+    # Архивные опросы группы с правильным вариантом, для total_polls и коэффициента внимательности
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive.group_polls (
+        group_id INTEGER PRIMARY KEY,
+        polls INTEGER NOT NULL
+    )
+    """)
+    # Ответы студента на архивные опросы группы, для пересчёта user_stats
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive.user_summary (
+        user_id INTEGER NOT NULL,
+        group_id INTEGER NOT NULL,
+        completed_polls INTEGER NOT NULL,
+        correct_polls INTEGER NOT NULL,
+        PRIMARY KEY (user_id, group_id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_polls_group ON polls (group_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_options_poll ON options (poll_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_user_options_user ON user_options (user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_user_options_option ON user_options (option_id)")
+
+
+# Миграции применяются строго по возрастанию версии.
+# Уже выпущенные миграции не изменяются, новые добавляются в конец списка.
+MIGRATIONS: list[tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "initial schema", initial_schema),
+    (2, "hot path indexes", hot_path_indexes),
+    (3, "user_stats table", user_stats_table),
+    (4, "active polls index", active_polls_index),
+    (5, "data versions table", data_versions_table),
+    (6, "fsm states table", fsm_states_table),
+    (7, "poll results message", poll_results_message),
+    (8, "scheduled polls table", scheduled_polls_table),
+    (9, "close expired polls", close_expired_polls),
+    (10, "poll results worker", poll_results_worker),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at DATETIME NOT NULL
+    )
+    """)
+    version = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    return version or 0
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Применение недостающих миграций
+
+    Каждая миграция выполняется в отдельной транзакции вместе с записью
+    о её версии, поэтому прерванный запуск можно просто повторить.
+
+    Returns:
+        int: Версия схемы после применения миграций
+    """
+    if conn.in_transaction:
+        conn.commit()
+
+    current_version = get_schema_version(conn)
+    for version, name, step in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.now())
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        current_version = version
+
+    return current_version
+
+
+def verify_schema(conn: sqlite3.Connection):
+    """
+    Проверка того, что схема БД соответствует версии кода
+    """
+    version = get_schema_version(conn)
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f"Версия схемы БД ({version}) новее, чем поддерживает бот ({LATEST_VERSION})"
+        )
+    if version < LATEST_VERSION:
+        raise RuntimeError(
+            f"Схема БД не обновлена: версия {version}, требуется {LATEST_VERSION}"
+        )
+
+    applied = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    expected = [version for version, _, _ in MIGRATIONS]
+    if applied != expected:
+        raise RuntimeError(f"Пропущены миграции: {sorted(set(expected) - set(applied))}")
@@ -0,0 +1,112 @@
+"""
+Журнал медленных запросов.
+
+Включается через slow_queries.enable(порог). Каждый запрос дольше порога
+попадает в кольцевой буфер вместе с обработчиком, типами параметров,
+временем и планом EXPLAIN QUERY PLAN, полученным на том же соединении.
+Значения параметров не сохраняются. Буфер у каждого процесса свой.
+"""
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+import sqlite3
+import threading
+
+SLOW_QUERY_LOG_SIZE = 50
+
+
+@dataclass
+class SlowQuery:
+    at: datetime
+    handler: str
+    sql: str
+    parameters: str
+    seconds: float
+    plan: list[str]
+
+
+def parameters_shape(parameters: Any) -> str:
+    """
+    Типы параметров без значений, у строк - длина: (int, str[24])
+    """
+    def shape(value: Any) -> str:
+        if isinstance(value, (str, bytes)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {shape(value)}" for key, value in parameters.items()) + "}"
+    return "(" + ", ".join(shape(value) for value in parameters) + ")"
+
+
+def explain(conn: sqlite3.Connection, sql: str, parameters: Any) -> list[str]:
+    """
+    План запроса деревом, как в sqlite3 .eqp
+    """
+    # Обычный курсор, чтобы сам EXPLAIN не замерялся
+    rows = conn.cursor(sqlite3.Cursor).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    depth = {0: 0}
+    plan = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, 0) + 1
+        plan.append("  " * (depth[node_id] - 1) + detail)
+    return plan
+
+
+class SlowQueryLog():
+    """
+    Кольцевой буфер медленных запросов.
+
+    record вызывается из TimedCursor в потоке БД, entries - из цикла событий.
+    """
+
+    def __init__(self, size: int = SLOW_QUERY_LOG_SIZE):
+        self.threshold: float | None = None
+        self._entries: deque[SlowQuery] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None
+
+    def enable(self, threshold: float, size: int = SLOW_QUERY_LOG_SIZE):
+        with self._lock:
+            self.threshold = threshold
+            self._entries = deque(self._entries, maxlen=size)
+
+    def record(self, conn: sqlite3.Connection, sql: str, parameters: Any, seconds: float, handler: str):
+        try:
+            plan = explain(conn, sql, parameters)
+        except sqlite3.Error as e:
+            plan = [f"EXPLAIN не выполнен: {e}"]
+        entry = SlowQuery(datetime.now(), handler, sql, parameters_shape(parameters), seconds, plan)
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> list[SlowQuery]:
+        """
+        Записи от новых к старым
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def format_slow_queries(entries: list[SlowQuery]) -> str:
+    blocks = []
+    for entry in entries:
+        sql = "\n".join(line.strip() for line in entry.sql.strip().splitlines() if line.strip())
+        blocks.append("\n".join([
+            f"{entry.at:%d.%m %H:%M:%S} {entry.seconds * 1000:.1f} мс, {entry.handler}, параметры {entry.parameters}",
+            sql,
+            "План:" if entry.plan else "План: нет",
+            *entry.plan,
+        ]))
+    return "\n\n".join(blocks)
+
+
+slow_queries = SlowQueryLog()
@@ -0,0 +1,332 @@
+"""
+Импорт теста - многих опросов группы из одного файла.
+
+Форматы:
+    JSON  - массив объектов, JSONL - по объекту в строке:
+            {"question": "...", "options": ["...", "..."], "answer": 2,
+             "duration": 10, "starts_at": "2026-10-20 10:00"}
+            answer - номер правильного варианта с единицы или его текст,
+            duration - минуты (по умолчанию QUIZ_DEFAULT_DURATION),
+            starts_at - необязательное время начала.
+    CSV   - строка на вопрос: Вопрос; Правильный; Длительность; Начало; Вариант 1; Вариант 2; ...
+            Первая строка пропускается, если это заголовок: первый столбец
+            "Вопрос" или "Question".
+
+Вопросы проверяются по мере чтения файла. Вопросы без времени начала
+становятся опросами сразу, все вместе: polls и options вставляются через
+executemany в одной транзакции. Вопросы со временем начала, а при
+последовательном импорте и остальные (каждый начинается, когда закончится
+предыдущий), сохраняются в scheduled_polls и превращаются в опросы
+планировщиком QuizScheduler в момент начала.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Iterable, Iterator
+import asyncio
+import heapq
+import json
+import sqlite3
+
+from db import Database, db
+from roster import read_csv
+from scheduler import SCHEDULER_RETRY_DELAY, HeapScheduler
+from stats import on_poll_created
+
+MAX_QUIZ_FILE_SIZE = 20 * 1024 * 1024  # ограничение Bot API на скачивание файлов
+MAX_QUIZ_QUESTIONS = 500
+MAX_QUIZ_OPTIONS = 10
+MAX_QUESTION_LENGTH = 1000
+MAX_OPTION_LENGTH = 100
+QUIZ_DEFAULT_DURATION = 10  # минут
+QUIZ_FILE_TYPES = (".json", ".jsonl", ".csv")
+# Первый столбец заголовка CSV. Правильный ответ может быть текстом,
+# поэтому заголовок определяется по названию столбца, а не по ответу
+QUIZ_CSV_HEADERS = ("вопрос", "question")
+
+
+@dataclass
+class QuizQuestion:
+    question: str
+    options: list[str]
+    answer_index: int
+    duration: int  # минут
+    starts_at: datetime | None = None
+
+
+@dataclass
+class QuizSummary:
+    questions: int = 0
+    # (номер вопроса или строки, причина)
+    invalid: list[tuple[int, str]] = field(default_factory=list)
+
+
+@dataclass
+class CreatedPoll:
+    id: int
+    group_id: int
+    question: str
+    expires_at: datetime
+    # (id варианта, текст) в порядке файла
+    options: list[tuple[int, str]]
+    answer_index: int
+    # Чат, в который отправляются результаты; None - без сообщения результатов
+    chat_id: int | None = None
+
+
+def read_json(path: str) -> Iterator[tuple[int, Any]]:
+    with open(path, encoding="utf-8-sig") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("questions")
+    if not isinstance(data, list):
+        raise ValueError("JSON должен содержать массив вопросов")
+    yield from enumerate(data, start=1)
+
+
+def read_jsonl(path: str) -> Iterator[tuple[int, Any]]:
+    with open(path, encoding="utf-8-sig") as f:
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except json.JSONDecodeError:
+                yield line, None
+
+
+def read_quiz_csv(path: str) -> Iterator[tuple[int, Any]]:
+    for line, row in enumerate(read_csv(path), start=1):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        question, answer, duration, starts_at, *options = cells + [""] * (4 - len(cells))
+        if line == 1 and question.lower() in QUIZ_CSV_HEADERS:
+            continue  # заголовок
+        yield line, {
+            "question": question,
+            "answer": int(answer) if answer.isdigit() else answer,
+            "duration": duration or None,
+            "starts_at": starts_at or None,
+            "options": [option for option in options if option],
+        }
+
+
+def read_quiz(path: str, file_name: str) -> Iterator[tuple[int, Any]]:
+    name = file_name.lower()
+    if name.endswith(".jsonl"):
+        return read_jsonl(path)
+    if name.endswith(".json"):
+        return read_json(path)
+    return read_quiz_csv(path)
+
+
+def parse_question(record: Any) -> QuizQuestion | str:
+    """
+    Проверка одного вопроса
+
+    Returns:
+        QuizQuestion | str: Вопрос или причина, по которой он не принят
+    """
+    if not isinstance(record, dict):
+        return "ожидается объект с полями question, options, answer"
+
+    question = record.get("question")
+    if not isinstance(question, str) or not question.strip():
+        return "не указан текст вопроса"
+    if len(question) > MAX_QUESTION_LENGTH:
+        return "слишком длинный вопрос"
+
+    options = record.get("options")
+    if not isinstance(options, list) or not all(isinstance(option, (str, int, float)) for option in options):
+        return "варианты ответа должны быть списком строк"
+    options = [str(option).strip() for option in options]
+    if len(options) < 2 or len(options) > MAX_QUIZ_OPTIONS:
+        return f"нужно от 2 до {MAX_QUIZ_OPTIONS} вариантов ответа"
+    if any(not option or len(option) > MAX_OPTION_LENGTH for option in options):
+        return f"варианты ответа должны быть непустыми и не длиннее {MAX_OPTION_LENGTH} символов"
+    if len(set(options)) != len(options):
+        return "варианты ответа повторяются"
+
+    answer = record.get("answer")
+    if isinstance(answer, int) and not isinstance(answer, bool) and 1 <= answer <= len(options):
+        answer_index = answer - 1
+    elif isinstance(answer, str) and answer.strip() in options:
+        answer_index = options.index(answer.strip())
+    else:
+        return "правильный ответ - номер варианта или его текст"
+
+    duration = record.get("duration") or QUIZ_DEFAULT_DURATION
+    if isinstance(duration, str) and duration.isdigit():
+        duration = int(duration)
+    if not isinstance(duration, int) or isinstance(duration, bool) or duration <= 0:
+        return "длительность - целое число минут"
+
+    starts_at = record.get("starts_at")
+    if starts_at is not None:
+        try:
+            starts_at = datetime.fromisoformat(str(starts_at))
+        except ValueError:
+            return "время начала в формате ГГГГ-ММ-ДД ЧЧ:ММ"
+
+    return QuizQuestion(question.strip(), options, answer_index, duration, starts_at)
+
+
+def validate_questions(records: Iterable[tuple[int, Any]], summary: QuizSummary) -> list[QuizQuestion]:
+    questions = []
+    for line, record in records:
+        question = parse_question(record)
+        if isinstance(question, str):
+            summary.invalid.append((line, question))
+        elif len(questions) >= MAX_QUIZ_QUESTIONS:
+            summary.invalid.append((line, f"в тесте больше {MAX_QUIZ_QUESTIONS} вопросов"))
+            break
+        else:
+            questions.append(question)
+    summary.questions = len(questions)
+    return questions
+
+
+def parse_quiz(path: str, file_name: str) -> tuple[list[QuizQuestion], QuizSummary]:
+    """
+    Разбор файла без обращений к БД, чтобы не занимать поток БД
+    """
+    summary = QuizSummary()
+    return validate_questions(read_quiz(path, file_name), summary), summary
+
+
+def plan_schedule(questions: list[QuizQuestion], now: datetime, sequential: bool):
+    """
+    Время начала вопросов без него при последовательном импорте:
+    каждый начинается после окончания предыдущего, первый - сейчас
+    """
+    if not sequential:
+        return
+    next_start = now
+    for question in questions:
+        if question.starts_at is None:
+            question.starts_at = next_start
+        next_start = max(next_start, question.starts_at + timedelta(minutes=question.duration))
+
+
+def insert_polls(conn: sqlite3.Connection, group_id: int, questions: list[QuizQuestion], now: datetime, chat_id: int | None = None) -> list[CreatedPoll]:
+    """
+    Создание опросов, начинающихся в момент now. Опросы и варианты
+    вставляются двумя executemany, id берутся подряд от last_insert_rowid:
+    вставки одной транзакции идут без чужих записей между ними.
+
+    chat_id - чат преподавателя, куда отправляются результаты опросов.
+    """
+    if not questions:
+        return []
+    expires = [now + timedelta(minutes=question.duration) for question in questions]
+    conn.executemany(
+        "INSERT INTO polls (question, group_id, expires_at) VALUES (?, ?, ?)",
+        [(question.question, group_id, expires_at) for question, expires_at in zip(questions, expires)]
+    )
+    last_poll_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    poll_ids = range(last_poll_id - len(questions) + 1, last_poll_id + 1)
+
+    conn.executemany(
+        "INSERT INTO options (poll_id, value, is_answer) VALUES (?, ?, ?)",
+        [
+            (poll_id, option, 1 if index == question.answer_index else 0)
+            for poll_id, question in zip(poll_ids, questions)
+            for index, option in enumerate(question.options)
+        ]
+    )
+    option_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - sum(len(question.options) for question in questions)
+
+    polls = []
+    for poll_id, question, expires_at in zip(poll_ids, questions, expires):
+        options = []
+        for option in question.options:
+            option_id += 1
+            options.append((option_id, option))
+        polls.append(CreatedPoll(poll_id, group_id, question.question, expires_at, options, question.answer_index, chat_id))
+    on_poll_created(conn, group_id, len(polls))
+    return polls
+
+
+def import_quiz(conn: sqlite3.Connection, group_id: int, chat_id: int, questions: list[QuizQuestion], now: datetime) -> tuple[list[CreatedPoll], int]:
+    """
+    Импорт теста одной транзакцией
+
+    Returns:
+        tuple: Созданные сразу опросы и количество запланированных вопросов
+    """
+    # Наступившее время начала тоже обрабатывает планировщик: он сразу разошлёт вопрос
+    scheduled = [question for question in questions if question.starts_at is not None]
+    immediate = [question for question in questions if question.starts_at is None]
+    conn.executemany("""
+        INSERT INTO scheduled_polls (group_id, chat_id, question, options, answer_index, duration, starts_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (group_id, chat_id, question.question, json.dumps(question.options, ensure_ascii=False),
+         question.answer_index, question.duration, question.starts_at)
+        for question in scheduled
+    ])
+    return insert_polls(conn, group_id, immediate, now, chat_id), len(scheduled)
+
+
+def start_scheduled_polls(conn: sqlite3.Connection, scheduled_ids: list[int], now: datetime) -> list[CreatedPoll]:
+    """
+    Превращение запланированных вопросов в опросы. Строка удаляется в той же
+    транзакции, поэтому вопрос запускает только один процесс.
+    """
+    rows = conn.execute("""
+        DELETE FROM scheduled_polls WHERE id IN (SELECT value FROM json_each(?))
+        RETURNING id, group_id, chat_id, question, options, answer_index, duration
+    """, (json.dumps(scheduled_ids),)).fetchall()
+
+    polls = []
+    for _, group_id, chat_id, question, options, answer_index, duration in sorted(rows):
+        polls.extend(insert_polls(conn, group_id, [QuizQuestion(question, json.loads(options), answer_index, duration)], now, chat_id))
+    return polls
+
+
+class QuizScheduler(HeapScheduler):
+    """
+    Запуск запланированных вопросов теста.
+
+    Сроки начала в min-куче HeapScheduler, созданные опросы передаются
+    обработчикам on_start.
+    """
+
+    failure_message = "Ошибка при запуске запланированных опросов"
+
+    def __init__(self, db: Database, retry_delay: float = SCHEDULER_RETRY_DELAY):
+        super().__init__(db, retry_delay)
+        self._callbacks: list[Callable[[list[CreatedPoll]], Awaitable[None]]] = []
+
+    def on_start(self, callback: Callable[[list[CreatedPoll]], Awaitable[None]]):
+        self._callbacks.append(callback)
+
+    async def import_quiz(self, group_id: int, chat_id: int, questions: list[QuizQuestion]) -> tuple[list[CreatedPoll], int]:
+        now = datetime.now()
+        created, scheduled = await self.db.transaction(import_quiz, group_id, chat_id, questions, now)
+        if scheduled:
+            await self.reload()
+        return created, scheduled
+
+    async def reload(self):
+        rows = await self.db.fetchall("SELECT starts_at, id FROM scheduled_polls")
+        self._heap = [(datetime.fromisoformat(starts_at), scheduled_id) for starts_at, scheduled_id in rows]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    async def start(self):
+        await self.reload()
+        self._task = asyncio.create_task(self._run())
+
+    async def _fire(self, scheduled_ids: list[int], now: datetime):
+        polls = await self.db.transaction(start_scheduled_polls, scheduled_ids, now)
+        if not polls:
+            return
+        for callback in self._callbacks:
+            try:
+                await callback(polls)
+            except Exception as e:
+                print(f"Ошибка в обработчике запуска опросов: {e}")
+
+
+quiz_scheduler = QuizScheduler(db)
@@ -0,0 +1,82 @@
+from collections import defaultdict
+from typing import Awaitable, Callable, Hashable
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from cache import TTLCache
+
+RENDER_CACHE_SIZE = 512
+RENDER_CACHE_TTL = 600  # секунд
+
+
+class Data():
+    groups = 'groups'
+    users = 'users'
+    polls = 'polls'
+    answers = 'answers'
+
+
+_versions: defaultdict[str, int] = defaultdict(int)
+
+render_cache = TTLCache(maxsize=RENDER_CACHE_SIZE, ttl=RENDER_CACHE_TTL)
+
+Rendered = tuple[str, InlineKeyboardMarkup | None]
+
+
+def bump(*kinds: str):
+    """
+    Отметка изменения данных: все представления, зависящие от них, будут построены заново
+    """
+    for kind in kinds:
+        _versions[kind] += 1
+
+
+def versions() -> dict[str, int]:
+    """
+    Текущие версии данных этого процесса
+    """
+    return dict(_versions)
+
+
+async def render(view: str, params: Hashable, depends_on: tuple[str, ...], build: Callable[[], Awaitable[Rendered]]) -> Rendered:
+    """
+    Готовые текст и клавиатура представления.
+
+    Ключ кэша включает версии данных из depends_on, поэтому после bump
+    старые записи просто перестают находиться и вытесняются по LRU.
+    """
+    key = (view, params, tuple(_versions[kind] for kind in depends_on))
+    rendered = render_cache.get(key)
+    if rendered is None:
+        rendered = await build()
+        render_cache.set(key, rendered)
+    return rendered
+
+
+def is_same_content(message: Message, text: str, reply_markup: InlineKeyboardMarkup | None) -> bool:
+    # Telegram обрезает пробельные символы по краям текста сообщения
+    if (message.html_text or "").strip() != text.strip():
+        return False
+    if message.reply_markup is None or reply_markup is None:
+        return message.reply_markup is reply_markup
+    # Сравниваем по значениям полей: у объектов из апдейта есть служебная привязка к боту
+    return message.reply_markup.model_dump() == reply_markup.model_dump()
+
+
+async def edit_text(message: Message, text: str, reply_markup: InlineKeyboardMarkup | None = None) -> bool:
+    """
+    Изменение сообщения без запроса к Telegram, если содержимое не изменилось
+
+    Returns:
+        bool: Было ли сообщение изменено
+    """
+    if is_same_content(message, text, reply_markup):
+        return False
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in e.message:
+            raise
+        return False
+    return True
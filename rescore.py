@@ -0,0 +1,150 @@
+"""
+Пересчёт коэффициентов внимательности по истории ответов.
+
+Ответы каждого студента воспроизводятся в порядке записи с текущими
+параметрами из utils.py, так же как при ответе (см. writer.save_answer).
+Вычисления идут по всем студентам сразу: шаг k обновляет k-й ответ
+каждого студента, у которого он есть. Ответы на опросы из архива
+(archive.py) входят в историю наравне с текущими.
+
+Запуск: python rescore.py [group_id]
+"""
+import sqlite3
+import sys
+
+import numpy as np
+
+from archive import HISTORY_SCHEMAS
+from db import Roles
+from utils import BASE_SCORE, CORRECT_ANSWER_BONUS, INCORRECT_ANSWER_PENALTY, MAX_SCORE, MIN_SCORE
+
+HISTORY_DTYPE = np.dtype([("user_id", np.int64), ("group_id", np.int64), ("poll_id", np.int64), ("is_correct", np.bool_)])
+
+
+def load_history(conn: sqlite3.Connection, group_id: int | None = None) -> np.ndarray:
+    """
+    Ответы студентов на опросы своей группы, по студентам и в порядке записи
+    """
+    condition = "AND u.group_id = ?" if group_id is not None else ""
+    answers = " UNION ALL ".join(f"""
+        SELECT uo.id, uo.user_id, u.group_id, o.poll_id, o.is_answer = 1 AS is_correct
+        FROM {schema}.user_options uo
+        JOIN users u ON u.id = uo.user_id
+        JOIN {schema}.options o ON o.id = uo.option_id
+        JOIN {schema}.polls p ON p.id = o.poll_id
+        WHERE p.group_id = u.group_id {condition}
+    """ for schema in HISTORY_SCHEMAS)
+    cursor = conn.execute(f"""
+        SELECT user_id, group_id, poll_id, is_correct FROM ({answers})
+        ORDER BY user_id, id
+    """, (group_id,) * 2 if group_id is not None else ())
+    return np.fromiter(cursor, dtype=HISTORY_DTYPE)
+
+
+def count_polls_before(conn: sqlite3.Connection, history: np.ndarray) -> np.ndarray:
+    """
+    Для каждого ответа - число опросов группы с правильным ответом по этот опрос включительно
+    """
+    polls = np.array(conn.execute(" UNION ALL ".join(f"""
+        SELECT p.group_id, p.id FROM {schema}.polls p
+        WHERE EXISTS (SELECT 1 FROM {schema}.options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+    """ for schema in HISTORY_SCHEMAS) + " ORDER BY 1, 2").fetchall(), dtype=np.int64).reshape(-1, 2)
+
+    # Пара (группа, опрос) сводится к одному числу с тем же порядком сортировки
+    base = max(int(polls[:, 1].max(initial=0)), int(history["poll_id"].max(initial=0))) + 1
+    keys = polls[:, 0] * base + polls[:, 1]
+    group_start = np.searchsorted(keys, history["group_id"] * base, side="left")
+    return np.searchsorted(keys, history["group_id"] * base + history["poll_id"], side="right") - group_start
+
+
+def round_scores(scores: np.ndarray) -> np.ndarray:
+    """
+    Округление до сотых с тем же результатом, что round(score, 2).
+
+    np.round умножает на 100 перед округлением и на значениях вроде 0.775
+    может округлить в другую сторону, такие значения округляются через round.
+    """
+    rounded = np.round(scores, 2)
+    scaled = scores * 100
+    near_half = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in near_half:
+        rounded[i] = round(float(scores[i]), 2)
+    return rounded
+
+
+def replay_scores(history: np.ndarray, total_polls: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns:
+        tuple: id студентов и их коэффициенты внимательности после всех ответов
+    """
+    if len(history) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    user_ids, starts, lengths = np.unique(history["user_id"], return_index=True, return_counts=True)
+    is_correct = history["is_correct"]
+
+    # Правильные ответы студента до текущего
+    correct_total = np.cumsum(is_correct)
+    correct_before = correct_total - is_correct - np.repeat(correct_total[starts] - is_correct[starts], lengths)
+
+    correct_percentage = np.divide(
+        correct_before * 100, total_polls,
+        out=np.zeros(len(history)), where=total_polls > 0
+    )
+    bonus = CORRECT_ANSWER_BONUS * (1 + correct_percentage / 100)
+    penalty = INCORRECT_ANSWER_PENALTY * (1 + (100 - correct_percentage) / 100)
+
+    scores = np.full(len(user_ids), BASE_SCORE)
+    # Студенты по убыванию числа ответов: на шаге k участвуют первые active из них
+    order = np.argsort(-lengths, kind="stable")
+    sorted_starts = starts[order]
+    sorted_lengths = lengths[order]
+    for k in range(int(sorted_lengths[0])):
+        active = np.searchsorted(-sorted_lengths, -k, side="left")
+        users = order[:active]
+        answers = sorted_starts[:active] + k
+
+        current = scores[users]
+        scores[users] = round_scores(np.where(
+            is_correct[answers],
+            np.minimum(current + bonus[answers], MAX_SCORE),
+            np.maximum(current - penalty[answers], MIN_SCORE)
+        ))
+    return user_ids, scores
+
+
+def rescore(conn: sqlite3.Connection, group_id: int | None = None) -> int:
+    """
+    Пересчёт коэффициентов студентов группы или всех студентов
+
+    Returns:
+        int: Количество обновлённых студентов
+    """
+    history = load_history(conn, group_id)
+    user_ids, scores = replay_scores(history, count_polls_before(conn, history))
+
+    condition = "AND group_id = ?" if group_id is not None else ""
+    params = (Roles.user, group_id) if group_id is not None else (Roles.user,)
+    students = [row[0] for row in conn.execute(f"SELECT id FROM users WHERE role = ? {condition}", params)]
+
+    new_scores = dict.fromkeys(students, BASE_SCORE)
+    new_scores.update(zip(user_ids.tolist(), scores.tolist()))
+    conn.executemany(
+        "UPDATE users SET attention_score = ? WHERE id = ?",
+        [(score, user_id) for user_id, score in new_scores.items()]
+    )
+    return len(new_scores)
+
+
+if __name__ == "__main__":
+    from db import connect
+
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and not sys.argv[1].isdigit()):
+        print("Использование: python rescore.py [group_id]")
+        sys.exit(1)
+
+    conn = connect()
+    with conn:
+        updated = rescore(conn, int(sys.argv[1]) if len(sys.argv) == 2 else None)
+    print(f"Коэффициенты внимательности пересчитаны: {updated} студентов")
+    conn.close()
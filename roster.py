@@ -0,0 +1,151 @@
+"""
+Импорт списка студентов группы из CSV или XLSX.
+
+Каждая строка файла - один студент: "Имя Фамилия; telegram_id" или
+"Имя; Фамилия; telegram_id". Первая строка пропускается, если это заголовок.
+Файл читается построчно, все студенты добавляются одной транзакцией.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator
+import codecs
+import csv
+import json
+import sqlite3
+
+from openpyxl import load_workbook
+
+from db import Roles
+from stats import add_group_stats
+
+MAX_ROSTER_FILE_SIZE = 20 * 1024 * 1024  # ограничение Bot API на скачивание файлов
+MAX_FULL_NAME_LENGTH = 100
+CSV_SAMPLE_SIZE = 64 * 1024
+CSV_DELIMITERS = (",", ";", "\t")
+
+
+@dataclass
+class RosterSummary:
+    inserted: list[int] = field(default_factory=list)
+    # telegram_id, которые уже есть в БД или повторяются в файле
+    duplicates: list[int] = field(default_factory=list)
+    # (номер строки, причина)
+    invalid: list[tuple[int, str]] = field(default_factory=list)
+
+
+def detect_encoding(sample: bytes) -> str:
+    try:
+        # final=False: выборка может обрываться посреди многобайтового символа
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        # Excel с русской локалью сохраняет CSV в cp1251
+        return "cp1251"
+
+
+def detect_delimiter(sample: str) -> str:
+    # csv.Sniffer не справляется со строками с разным числом столбцов,
+    # поэтому разделитель выбирается по первой строке
+    first_line = sample.lstrip().split("\n", 1)[0]
+    return max(CSV_DELIMITERS, key=first_line.count)
+
+
+def read_csv(path: str) -> Iterator[list[Any]]:
+    with open(path, "rb") as f:
+        sample = f.read(CSV_SAMPLE_SIZE)
+    encoding = detect_encoding(sample)
+    delimiter = detect_delimiter(sample.decode(encoding, errors="ignore"))
+
+    with open(path, newline="", encoding=encoding) as f:
+        yield from csv.reader(f, delimiter=delimiter)
+
+
+def read_xlsx(path: str) -> Iterator[tuple[Any, ...]]:
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_roster(path: str, file_name: str) -> Iterator[Iterable[Any]]:
+    if file_name.lower().endswith(".xlsx"):
+        return read_xlsx(path)
+    return read_csv(path)
+
+
+def parse_telegram_id(value: Any) -> int | None:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, int) and 0 < value < 2 ** 63:
+        return value
+    return None
+
+
+def validate_rows(rows: Iterable[Iterable[Any]], summary: RosterSummary) -> list[tuple[int, str]]:
+    """
+    Проверка строк файла
+
+    Returns:
+        list[tuple[int, str]]: (telegram_id, ФИО) корректных студентов без повторов
+    """
+    students: dict[int, str] = {}
+    for line, row in enumerate(rows, start=1):
+        cells = [cell.strip() if isinstance(cell, str) else cell for cell in row]
+        cells = [cell for cell in cells if cell is not None and cell != ""]
+        if not cells:
+            continue
+
+        *name_parts, telegram_id = cells
+        telegram_id = parse_telegram_id(telegram_id)
+        if telegram_id is None:
+            if line == 1:
+                continue  # заголовок
+            summary.invalid.append((line, "Telegram ID должен быть числом"))
+            continue
+
+        full_name = " ".join(str(part) for part in name_parts)
+        if not full_name:
+            summary.invalid.append((line, "не указано ФИО"))
+        elif len(full_name) > MAX_FULL_NAME_LENGTH:
+            summary.invalid.append((line, "слишком длинное ФИО"))
+        elif telegram_id in students:
+            summary.duplicates.append(telegram_id)
+        else:
+            students[telegram_id] = full_name
+    return list(students.items())
+
+
+def import_students(conn: sqlite3.Connection, group_id: int, students: list[tuple[int, str]], summary: RosterSummary):
+    """
+    Добавление студентов в группу. Уже зарегистрированные telegram_id пропускаются.
+    """
+    existing = {
+        row[0] for row in conn.execute(
+            "SELECT telegram_id FROM users WHERE telegram_id IN (SELECT value FROM json_each(?))",
+            (json.dumps([telegram_id for telegram_id, _ in students]),)
+        )
+    }
+    new_students = [(telegram_id, full_name) for telegram_id, full_name in students if telegram_id not in existing]
+
+    conn.executemany(
+        "INSERT INTO users (telegram_id, full_name, role, group_id) VALUES (?, ?, ?, ?)",
+        [(telegram_id, full_name, Roles.user, group_id) for telegram_id, full_name in new_students]
+    )
+    add_group_stats(conn, group_id)
+
+    summary.duplicates.extend(telegram_id for telegram_id, _ in students if telegram_id in existing)
+    summary.inserted.extend(telegram_id for telegram_id, _ in new_students)
+
+
+def parse_roster(path: str, file_name: str) -> tuple[list[tuple[int, str]], RosterSummary]:
+    """
+    Разбор файла без обращений к БД, чтобы не занимать поток БД
+
+    Returns:
+        tuple: Корректные студенты и сводка с ошибками разбора
+    """
+    summary = RosterSummary()
+    students = validate_rows(read_roster(path, file_name), summary)
+    return students, summary
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+import asyncio
+import heapq
+import sqlite3
+
+from db import Database, db
+
+SCHEDULER_RETRY_DELAY = 5.0  # секунд до повтора, если обработка наступивших сроков не удалась
+
+
+def close_polls(conn: sqlite3.Connection, poll_ids: list[int]) -> list[int]:
+    """
+    Закрытие опросов одним запросом
+
+    Returns:
+        list[int]: Опросы, которые были закрыты именно этим вызовом
+    """
+    placeholders = ", ".join("?" * len(poll_ids))
+    rows = conn.execute(
+        f"UPDATE polls SET is_active = 0 WHERE id IN ({placeholders}) AND is_active RETURNING id",
+        poll_ids
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+class HeapScheduler():
+    """
+    Действия по срокам.
+
+    Сроки хранятся в min-куче, задача спит до ближайшего из них. Все id,
+    срок которых наступил, передаются в _fire одним списком. Если _fire
+    завершился ошибкой, id возвращаются в кучу и повторяются через retry_delay.
+    """
+
+    failure_message = "Ошибка планировщика"
+
+    def __init__(self, db: Database, retry_delay: float = SCHEDULER_RETRY_DELAY):
+        self.db = db
+        self.retry_delay = retry_delay
+        self._heap: list[tuple[datetime, int]] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def push(self, due_at: datetime, item_id: int):
+        heapq.heappush(self._heap, (due_at, item_id))
+        self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _fire(self, item_ids: list[int], now: datetime):
+        raise NotImplementedError
+
+    async def _run(self):
+        while True:
+            now = datetime.now()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+
+            if due:
+                try:
+                    await self._fire(due, now)
+                except Exception as e:
+                    print(f"{self.failure_message} {due}: {e}")
+                    retry_at = now + timedelta(seconds=self.retry_delay)
+                    for item_id in due:
+                        heapq.heappush(self._heap, (retry_at, item_id))
+                continue
+
+            timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class ExpiryScheduler(HeapScheduler):
+    """
+    Закрытие опросов по истечении срока.
+
+    Все опросы, срок которых наступил, закрываются одним UPDATE, после чего
+    вызываются обработчики, зарегистрированные через on_close.
+    """
+
+    failure_message = "Ошибка при закрытии опросов"
+
+    def __init__(self, db: Database, retry_delay: float = SCHEDULER_RETRY_DELAY):
+        super().__init__(db, retry_delay)
+        self._callbacks: list[Callable[[list[int]], Awaitable[None]]] = []
+
+    def on_close(self, callback: Callable[[list[int]], Awaitable[None]]):
+        self._callbacks.append(callback)
+
+    def schedule(self, poll_id: int, expires_at: datetime):
+        self.push(expires_at, poll_id)
+
+    async def start(self):
+        rows = await self.db.fetchall("SELECT id, expires_at FROM polls WHERE is_active")
+        for poll_id, expires_at in rows:
+            heapq.heappush(self._heap, (datetime.fromisoformat(expires_at), poll_id))
+        self._task = asyncio.create_task(self._run())
+
+    async def _fire(self, poll_ids: list[int], now: datetime):
+        closed = await self.db.transaction(close_polls, poll_ids)
+        if not closed:
+            return
+        for callback in self._callbacks:
+            try:
+                await callback(closed)
+            except Exception as e:
+                print(f"Ошибка в обработчике закрытия опросов: {e}")
+
+
+expiry_scheduler = ExpiryScheduler(db)
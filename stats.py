@@ -0,0 +1,104 @@
+"""
+Поддержка таблицы user_stats - накопленной статистики по пользователям.
+
+Счётчики обновляются в тех же транзакциях, что и изменения исходных данных:
+опрос учитывается в total_polls всех студентов группы в момент создания,
+ответ - в completed_polls/correct_polls в момент записи. Опросы, перенесённые
+в архив (archive.py), учитываются через archive.group_polls и archive.user_summary.
+
+Пересчёт с нуля: python stats.py rebuild
+"""
+import sqlite3
+import sys
+
+
+def add_user_stats(conn: sqlite3.Connection, user_id: int, group_id: int | None):
+    """
+    Создание строки статистики для нового пользователя группы
+    """
+    conn.execute("""
+        INSERT OR IGNORE INTO user_stats (user_id, total_polls)
+        SELECT ?, COUNT(*) + COALESCE((SELECT polls FROM archive.group_polls WHERE group_id = ?), 0)
+        FROM polls p
+        WHERE p.group_id = ?
+          AND EXISTS (SELECT 1 FROM options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+    """, (user_id, group_id, group_id))
+
+
+def add_group_stats(conn: sqlite3.Connection, group_id: int):
+    """
+    Создание строк статистики для всех пользователей группы, у которых их ещё нет
+    """
+    conn.execute("""
+        INSERT OR IGNORE INTO user_stats (user_id, total_polls)
+        SELECT u.id, (
+            SELECT COUNT(*)
+            FROM polls p
+            WHERE p.group_id = ?
+              AND EXISTS (SELECT 1 FROM options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+        ) + COALESCE((SELECT polls FROM archive.group_polls WHERE group_id = ?), 0)
+        FROM users u
+        WHERE u.group_id = ?
+    """, (group_id, group_id, group_id))
+
+
+def on_poll_created(conn: sqlite3.Connection, group_id: int, count: int = 1):
+    conn.execute("""
+        UPDATE user_stats SET total_polls = total_polls + ?
+        WHERE user_id IN (SELECT id FROM users WHERE group_id = ?)
+    """, (count, group_id))
+
+
+def on_answer(conn: sqlite3.Connection, user_id: int, is_correct_answer: bool):
+    conn.execute("""
+        UPDATE user_stats
+        SET completed_polls = completed_polls + 1,
+            correct_polls = correct_polls + ?
+        WHERE user_id = ?
+    """, (1 if is_correct_answer else 0, user_id))
+
+
+def rebuild_user_stats(conn: sqlite3.Connection):
+    """
+    Полный пересчёт user_stats по исходным таблицам и сводкам архива
+    """
+    conn.execute("DELETE FROM user_stats")
+    conn.execute("""
+        INSERT INTO user_stats (user_id, total_polls, completed_polls, correct_polls)
+        SELECT
+            u.id,
+            (
+                SELECT COUNT(*) FROM polls p
+                WHERE p.group_id = u.group_id
+                  AND EXISTS (SELECT 1 FROM options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+            ) + COALESCE(ag.polls, 0),
+            (
+                SELECT COUNT(DISTINCT o.poll_id) FROM user_options uo
+                JOIN options o ON o.id = uo.option_id
+                JOIN polls p ON p.id = o.poll_id
+                WHERE uo.user_id = u.id AND p.group_id = u.group_id
+            ) + COALESCE(au.completed_polls, 0),
+            (
+                SELECT COUNT(DISTINCT o.poll_id) FROM user_options uo
+                JOIN options o ON o.id = uo.option_id
+                JOIN polls p ON p.id = o.poll_id
+                WHERE uo.user_id = u.id AND p.group_id = u.group_id AND o.is_answer = 1
+            ) + COALESCE(au.correct_polls, 0)
+        FROM users u
+        LEFT JOIN archive.group_polls ag ON ag.group_id = u.group_id
+        LEFT JOIN archive.user_summary au ON au.user_id = u.id AND au.group_id = u.group_id
+    """)
+
+
+if __name__ == "__main__":
+    from db import connect
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("Использование: python stats.py rebuild")
+        sys.exit(1)
+
+    conn = connect()
+    with conn:
+        rebuild_user_stats(conn)
+    print(f"user_stats пересчитана: {conn.execute('SELECT COUNT(*) FROM user_stats').fetchone()[0]} строк")
+    conn.close()
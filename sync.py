@@ -0,0 +1,95 @@
+from typing import Awaitable, Callable
+import asyncio
+import sqlite3
+
+from db import Database, db
+from rendering import bump, versions
+
+SYNC_INTERVAL = 1.0  # секунд
+
+
+def exchange_versions(conn: sqlite3.Connection, pushed: dict[str, int]) -> dict[str, int]:
+    """
+    Публикация локальных изменений и чтение общих версий данных
+    """
+    conn.executemany("""
+        INSERT INTO data_versions (kind, version) VALUES (?, ?)
+        ON CONFLICT (kind) DO UPDATE SET version = version + excluded.version
+    """, pushed.items())
+    return dict(conn.execute("SELECT kind, version FROM data_versions").fetchall())
+
+
+class WorkerSync():
+    """
+    Согласование кэшей между процессами бота.
+
+    Каждый процесс держит свои кэши и индекс активных опросов. Раз в
+    SYNC_INTERVAL секунд процесс добавляет свои bump в таблицу data_versions
+    и узнаёт, какие данные изменили другие процессы: для них вызывается bump
+    и обработчики, зарегистрированные через on_change.
+    """
+
+    def __init__(self, db: Database, interval: float = SYNC_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self._local: dict[str, int] = {}
+        self._shared: dict[str, int] = {}
+        self._task: asyncio.Task | None = None
+        self._callbacks: list[Callable[[list[str]], Awaitable[None]]] = []
+
+    def on_change(self, callback: Callable[[list[str]], Awaitable[None]]):
+        self._callbacks.append(callback)
+
+    async def start(self):
+        self._local = versions()
+        self._shared = await self.db.transaction(exchange_versions, {})
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Изменения последнего интервала тоже должны дойти до остальных процессов
+        await self.sync(notify=False)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Ошибка при синхронизации процессов: {e}")
+
+    async def sync(self, notify: bool = True):
+        local = versions()
+        pushed = {
+            kind: version - self._local.get(kind, 0)
+            for kind, version in local.items()
+            if version != self._local.get(kind, 0)
+        }
+        shared = await self.db.transaction(exchange_versions, pushed)
+
+        changed = [
+            kind for kind, version in shared.items()
+            if version - self._shared.get(kind, 0) > pushed.get(kind, 0)
+        ]
+        self._shared = shared
+        self._local = local
+        if not changed or not notify:
+            return
+
+        bump(*changed)
+        for kind in changed:
+            self._local[kind] = self._local.get(kind, 0) + 1
+        for callback in self._callbacks:
+            try:
+                await callback(changed)
+            except Exception as e:
+                print(f"Ошибка в обработчике синхронизации: {e}")
+
+
+worker_sync = WorkerSync(db)
@@ -0,0 +1,14 @@
+"""
+Настройки бота читаются при импорте модулей, поэтому задаются до сбора тестов
+"""
+import os
+import tempfile
+
+ADMIN_TELEGRAM_ID = 1
+
+os.environ.update({
+    "DB_NAME": os.path.join(tempfile.mkdtemp(prefix="bot-tests-"), "bot.db"),
+    "TG_BOT_TOKEN": "42:TEST",
+    "ADMIN_ID": str(ADMIN_TELEGRAM_ID),
+    "BOT_MODE": "polling",
+})
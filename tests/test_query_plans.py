@@ -0,0 +1,195 @@
+"""
+Запросы, которые выполняются на каждый опрос, ответ и просмотр статистики,
+должны искать строки по индексу, а не читать таблицы целиком.
+"""
+import sqlite3
+
+import pytest
+
+from db import Roles, connect
+from migrations import migrate
+from profiler import explain
+
+HOT_PATH_QUERIES = {
+    "пользователь по telegram_id": (
+        """
+        SELECT id, telegram_id, full_name, role, group_id, attention_score
+        FROM users
+        WHERE telegram_id = ?
+        """,
+        (1,)
+    ),
+    "группы преподавателя": ("SELECT id, name FROM groups WHERE teacher_id = ?", (1,)),
+    "студенты группы": ("SELECT telegram_id FROM users WHERE group_id = ? AND role = ?", (1, Roles.user)),
+    "состав группы": ("SELECT full_name FROM users where group_id = ?", (1,)),
+    "опрос варианта ответа": (
+        """
+        SELECT p.id, p.is_active, p.expires_at, o.is_answer FROM options o
+        JOIN polls p ON p.id = o.poll_id
+        WHERE o.id = ?
+        """,
+        (1,)
+    ),
+    "повторный ответ": (
+        """
+        SELECT 1 FROM user_options uo
+        JOIN options o ON o.id = uo.option_id
+        WHERE uo.user_id = ? AND o.poll_id = ?
+        """,
+        (1, 1)
+    ),
+    "коэффициент внимательности": (
+        """
+        SELECT u.attention_score, COALESCE(s.correct_polls, 0), (
+            SELECT COUNT(*) FROM polls p
+            WHERE p.group_id = u.group_id AND p.id <= ?
+              AND EXISTS (SELECT 1 FROM options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+        ) + COALESCE(ag.polls, 0)
+        FROM users u
+        LEFT JOIN user_stats s ON s.user_id = u.id
+        LEFT JOIN archive.group_polls ag ON ag.group_id = u.group_id
+        WHERE u.id = ?
+        """,
+        (1, 1)
+    ),
+    "статистика пользователя": (
+        """
+        SELECT
+            s.total_polls,
+            s.completed_polls,
+            ROUND(s.completed_polls * 100.0 / s.total_polls, 2) as completion_rate,
+            ROUND(s.correct_polls * 100.0 / s.total_polls, 2) as correct_answers_rate,
+            g.name
+        FROM user_stats s
+        LEFT JOIN groups g ON g.id = ?
+        WHERE s.user_id = ?
+        """,
+        (1, 1)
+    ),
+    "новый опрос в статистике группы": (
+        """
+        UPDATE user_stats SET total_polls = total_polls + ?
+        WHERE user_id IN (SELECT id FROM users WHERE group_id = ?)
+        """,
+        (1, 1)
+    ),
+    "статистика нового студента": (
+        """
+        SELECT ?, COUNT(*) + COALESCE((SELECT polls FROM archive.group_polls WHERE group_id = ?), 0)
+        FROM polls p
+        WHERE p.group_id = ?
+          AND EXISTS (SELECT 1 FROM options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+        """,
+        (1, 1, 1)
+    ),
+    "преподаватель закрытого опроса": (
+        """
+        SELECT p.question, u.telegram_id,
+            (SELECT COUNT(*) FROM users WHERE group_id = p.group_id AND role = ?)
+        FROM polls p
+        JOIN groups g ON g.id = p.group_id
+        JOIN users u ON u.id = g.teacher_id
+        WHERE p.id = ?
+        """,
+        (Roles.user, 1)
+    ),
+    "итоги опроса": (
+        """
+        SELECT o.value, o.is_answer, COUNT(uo.id)
+        FROM options o
+        LEFT JOIN user_options uo ON uo.option_id = o.id
+        WHERE o.poll_id = ?
+        GROUP BY o.id
+        ORDER BY o.id
+        """,
+        (1,)
+    ),
+    "активные опросы": (
+        """
+        SELECT id, group_id, question, expires_at FROM polls INDEXED BY idx_polls_active
+        WHERE is_active
+        ORDER BY id
+        """,
+        ()
+    ),
+    "варианты активных опросов": (
+        """
+        SELECT p.id, o.id, o.value FROM polls p
+        CROSS JOIN options o ON o.poll_id = p.id
+        WHERE p.is_active
+        ORDER BY o.id
+        """,
+        ()
+    ),
+    "ответы на активные опросы": (
+        """
+        SELECT p.id, uo.user_id FROM polls p
+        CROSS JOIN options o ON o.poll_id = p.id
+        CROSS JOIN user_options uo ON uo.option_id = o.id
+        WHERE p.is_active
+        """,
+        ()
+    ),
+    "ответы других процессов": (
+        "SELECT option_id, user_id FROM user_options WHERE id > ? AND id <= ?",
+        (1, 2)
+    ),
+    "первая страница статистики": (
+        """
+        SELECT u.id, u.telegram_id, u.full_name, u.attention_score, u.role, g.name as group_name,
+            s.total_polls, s.completed_polls
+        FROM users u
+        JOIN user_stats s ON s.user_id = u.id
+        LEFT JOIN groups g ON u.group_id = g.id
+        WHERE s.total_polls > 0 AND u.role != ?
+        ORDER BY u.id ASC
+        LIMIT ?
+        """,
+        (Roles.admin, 11)
+    ),
+    "следующая страница статистики": (
+        """
+        SELECT u.id, u.telegram_id, u.full_name, u.attention_score, u.role, g.name as group_name,
+            s.total_polls, s.completed_polls
+        FROM users u
+        JOIN user_stats s ON s.user_id = u.id
+        LEFT JOIN groups g ON u.group_id = g.id
+        WHERE s.total_polls > 0 AND u.role != ? AND u.id > ?
+        ORDER BY u.id ASC
+        LIMIT ?
+        """,
+        (Roles.admin, 10, 11)
+    ),
+    "страница групп": ("SELECT id, name FROM groups WHERE id > ? ORDER BY id ASC LIMIT ?", (12, 13)),
+}
+
+# Полные просмотры, стоимость которых не растёт с размером таблицы
+ALLOWED_SCANS = {
+    # Пользователи читаются в порядке первичного ключа, и просмотр
+    # останавливается после LIMIT строк: пропускаются только администраторы
+    # и студенты без опросов
+    "первая страница статистики": {"SCAN u"},
+}
+# Частичный индекс содержит только активные опросы, а не всю историю
+PARTIAL_INDEXES = ("idx_polls_active",)
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory) -> sqlite3.Connection:
+    conn = connect(str(tmp_path_factory.mktemp("plans") / "bot.db"))
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("name", HOT_PATH_QUERIES)
+def test_hot_path_query_uses_index(conn: sqlite3.Connection, name: str):
+    sql, parameters = HOT_PATH_QUERIES[name]
+    plan = explain(conn, sql, parameters)
+    scans = [
+        line.strip() for line in plan
+        if line.strip().startswith("SCAN ")
+        and line.strip() not in ALLOWED_SCANS.get(name, ())
+        and not any(f"INDEX {index}" in line for index in PARTIAL_INDEXES)
+    ]
+    assert not scans, f"{name}: полный просмотр таблицы\n" + "\n".join(plan)
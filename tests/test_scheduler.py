@@ -0,0 +1,45 @@
+"""
+Сроки, обработка которых завершилась ошибкой, не теряются: планировщик
+повторяет их через retry_delay.
+"""
+from datetime import datetime
+import asyncio
+
+from scheduler import ExpiryScheduler
+
+
+class FlakyDatabase():
+    """
+    Первая транзакция завершается ошибкой, следующие закрывают переданные опросы
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def fetchall(self, query: str, params=()) -> list[tuple]:
+        return []
+
+    async def transaction(self, func, poll_ids: list[int]) -> list[int]:
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("database is locked")
+        return poll_ids
+
+
+def test_failed_close_is_retried():
+    async def run() -> list[int]:
+        scheduler = ExpiryScheduler(FlakyDatabase(), retry_delay=0.05)
+        closed = asyncio.get_running_loop().create_future()
+
+        async def on_close(poll_ids: list[int]):
+            closed.set_result(poll_ids)
+
+        scheduler.on_close(on_close)
+        await scheduler.start()
+        scheduler.schedule(1, datetime.now())
+        try:
+            return await asyncio.wait_for(closed, 2)
+        finally:
+            await scheduler.stop()
+
+    assert asyncio.run(run()) == [1]
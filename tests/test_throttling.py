@@ -0,0 +1,80 @@
+"""
+Повторное нажатие кнопки, пока первое обрабатывается, отбрасывается до
+блокировки пользователя и до обработчика: студент получает подсказку
+"Уже обрабатывается...", а ответ записывается один раз.
+"""
+from datetime import datetime, timedelta
+import asyncio
+import itertools
+
+from aiogram import Bot
+from aiogram.methods import AnswerCallbackQuery, EditMessageText
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from benchmarks.fake_session import FakeTelegramSession
+from callbacks import PollOption
+from roster import RosterSummary, import_students
+from tests.conftest import ADMIN_TELEGRAM_ID
+
+STUDENT_TELEGRAM_ID = 1000
+
+ids = itertools.count(1)
+
+
+def tap(telegram_id: int, data: str) -> Update:
+    return Update(update_id=next(ids), callback_query=CallbackQuery(
+        id=str(next(ids)),
+        from_user=User(id=telegram_id, is_bot=False, first_name="Студент"),
+        chat_instance="test",
+        data=data,
+        message=Message(
+            message_id=next(ids),
+            date=datetime.now(),
+            chat=Chat(id=telegram_id, type="private"),
+            text="...",
+        ),
+    ))
+
+
+def seed(conn) -> int:
+    admin_id = conn.execute("SELECT id FROM users WHERE telegram_id = ?", (ADMIN_TELEGRAM_ID,)).fetchone()[0]
+    group_id = conn.execute("INSERT INTO groups (name, teacher_id) VALUES (?, ?)", ("Группа", admin_id)).lastrowid
+    import_students(conn, group_id, [(STUDENT_TELEGRAM_ID, "Студент")], RosterSummary())
+    poll_id = conn.execute(
+        "INSERT INTO polls (question, group_id, expires_at) VALUES (?, ?, ?)",
+        ("Вопрос", group_id, datetime.now() + timedelta(minutes=5))
+    ).lastrowid
+    return conn.execute(
+        "INSERT INTO options (poll_id, value, is_answer) VALUES (?, ?, 1)", (poll_id, "Ответ")
+    ).lastrowid
+
+
+def test_double_tap_is_dropped_before_handler():
+    import main as bot_main
+
+    bot = Bot("42:TEST", session=FakeTelegramSession(latency=0.05))
+
+    async def run() -> int:
+        await bot_main.dp.emit_startup(bot=bot)
+        try:
+            option_id = await bot_main.db.transaction(seed)
+            await bot_main.active_polls.load(bot_main.db)
+            data = PollOption(option_id=option_id).pack()
+            await asyncio.gather(
+                bot_main.dp.feed_update(bot, tap(STUDENT_TELEGRAM_ID, data)),
+                bot_main.dp.feed_update(bot, tap(STUDENT_TELEGRAM_ID, data)),
+            )
+            return await bot_main.db.fetchone(
+                "SELECT COUNT(*) FROM user_options WHERE option_id = ?", (option_id,)
+            )
+        finally:
+            await bot_main.dp.emit_shutdown(bot=bot)
+
+    answers, = asyncio.run(run())
+
+    methods = [method for _, method in bot.session.calls]
+    toasts = [method.text for method in methods if isinstance(method, AnswerCallbackQuery)]
+    edits = [method.text for method in methods if isinstance(method, EditMessageText)]
+    assert toasts == ["Уже обрабатывается..."]
+    assert edits == ["Ваш ответ учтен! Спасибо.\n"]
+    assert answers == 1
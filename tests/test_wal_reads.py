@@ -0,0 +1,56 @@
+"""
+Чтение статистики не должно задерживать запись ответов: прогоны
+benchmarks/wal_reads.py с одним соединением и с пулом чтения в WAL.
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from benchmarks.wal_reads import STATS_QUERY, copy_database, percentile, prepare, run
+from db import connect
+
+STUDENTS = 2000
+POLLS = 300
+READERS = 4
+
+
+@pytest.fixture(scope="module")
+def template(tmp_path_factory) -> tuple[str, dict[int, int]]:
+    return prepare(str(tmp_path_factory.mktemp("wal")), STUDENTS, POLLS)
+
+
+def stats_read_time(path: str) -> float:
+    """
+    Время одного чтения сводки без конкуренции
+    """
+    conn = connect(path)
+    try:
+        conn.execute(STATS_QUERY).fetchall()
+        started = time.perf_counter()
+        conn.execute(STATS_QUERY).fetchall()
+        return time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+def commit_p95(template: tuple[str, dict[int, int]], readers: int) -> float:
+    path, options = template
+    run_path = os.path.join(os.path.dirname(path), f"run_{readers}.db")
+    copy_database(path, run_path)
+    latencies, reads = asyncio.run(run(run_path, readers, READERS, options))
+    assert reads > 0
+    return percentile(latencies, 95)
+
+
+def test_stats_reads_do_not_delay_answer_commits(template):
+    read_time = stats_read_time(template[0])
+    single = commit_p95(template, readers=0)
+    pooled = commit_p95(template, readers=READERS)
+
+    # С одним соединением запись ждёт чтения, стоящие перед ней в очереди
+    assert single >= read_time
+    # С пулом запись не ждёт чтения целиком и в разы быстрее
+    assert pooled < read_time, f"p95 записи {pooled * 1000:.1f} мс, чтение сводки {read_time * 1000:.1f} мс"
+    assert pooled * 4 < single, f"p95 записи: пул {pooled * 1000:.1f} мс, одно соединение {single * 1000:.1f} мс"
@@ -0,0 +1,76 @@
+"""
+Ограничение частоты нажатий на кнопки.
+
+Повторное нажатие той же кнопки, пока первое ещё обрабатывается,
+отбрасывается сразу. Остальные нажатия ограничиваются ведром токенов
+на пользователя: до THROTTLE_BURST нажатий подряд, дальше THROTTLE_RATE
+в секунду, на пользователей, для которых exempt возвращает True (например,
+администраторов), ограничение не действует. Отброшенные нажатия получают
+короткое уведомление и не доходят до обработчиков и БД. Состояние
+хранится в памяти процесса.
+"""
+from typing import Any, Awaitable, Callable
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from cache import TTLCache
+
+THROTTLE_RATE = 2.0  # нажатий в секунду
+THROTTLE_BURST = 5
+THROTTLE_CACHE_SIZE = 4096
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Регистрируется как внешний middleware обновлений перед FSM middleware
+    aiogram, чтобы отбрасывать нажатия до блокировки пользователя
+    (events_isolation) и до выбора обработчика.
+    """
+
+    def __init__(
+        self,
+        rate: float = THROTTLE_RATE,
+        burst: int = THROTTLE_BURST,
+        exempt: Callable[[int], Awaitable[bool]] | None = None
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.exempt = exempt
+        # Через burst / rate секунд ведро полное, и запись можно забыть
+        self._buckets = TTLCache(maxsize=THROTTLE_CACHE_SIZE, ttl=burst / rate)
+        self._in_flight: set[tuple[int, str | None]] = set()
+
+    def _take_token(self, user_id: int) -> bool:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= 1
+        self._buckets.set(user_id, (tokens - 1 if allowed else tokens, now))
+        return allowed
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        callback = event.callback_query if isinstance(event, Update) else None
+        if callback is None:
+            return await handler(event, data)
+
+        key = (callback.from_user.id, callback.data)
+        if key in self._in_flight:
+            await callback.answer("Уже обрабатывается...")
+            return None
+        # exempt проверяется только при пустом ведре, обычные нажатия его не вызывают
+        if not self._take_token(callback.from_user.id) and not (self.exempt and await self.exempt(callback.from_user.id)):
+            await callback.answer("Слишком часто, подождите немного.")
+            return None
+
+        self._in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(key)
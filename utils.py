@@ -1,4 +1,18 @@
-from db import Roles
+from db import Database, Roles
+from cache import get_user
+
+STATS_PAGE_SIZE = 10
+GROUPS_PAGE_SIZE = 12
+
+# Параметры коэффициента внимательности. После их изменения накопленные
+# коэффициенты пересчитываются по истории ответов: python rescore.py
+BASE_SCORE = 1.0  # Начальный коэффициент
+MAX_SCORE = 1.0   # Максимальный коэффициент
+MIN_SCORE = 0.5   # Минимальный коэффициент
+
+# Коэффициенты влияния
+CORRECT_ANSWER_BONUS = 0.1  # Бонус за правильный ответ
+INCORRECT_ANSWER_PENALTY = 0.05  # Штраф за неправильный ответ
 
 def calculate_attention_score(current_score, is_correct_answer, total_polls, correct_answers):
     """
@@ -7,21 +21,12 @@ def calculate_attention_score(current_score, is_correct_answer, total_polls, cor
     Args:
         current_score (float): Текущий коэффициент внимательности
         is_correct_answer (bool): Правильность текущего ответа
-        total_polls (int): Общее количество опросов
-        correct_answers (int): Количество правильных ответов
+        total_polls (int): Количество опросов группы с правильным ответом, включая текущий
+        correct_answers (int): Количество правильных ответов до текущего
     
     Returns:
         float: Новый коэффициент внимательности
     """
-    # Базовые параметры настройки
-    BASE_SCORE = 1.0  # Начальный коэффициент
-    MAX_SCORE = 1.0   # Максимальный коэффициент
-    MIN_SCORE = 0.5   # Минимальный коэффициент
-    
-    # Коэффициенты влияния
-    CORRECT_ANSWER_BONUS = 0.1  # Бонус за правильный ответ
-    INCORRECT_ANSWER_PENALTY = 0.05  # Штраф за неправильный ответ
-    
     # Расчет процента правильных ответов
     correct_percentage = (correct_answers / total_polls) * 100 if total_polls > 0 else 0
     
@@ -41,114 +46,141 @@ def calculate_attention_score(current_score, is_correct_answer, total_polls, cor
     
     return round(new_score, 2)
 
-async def get_user_statistics(user_id, cursor):
+async def get_user_statistics(user_id, db: Database):
     """
     Получение подробной статистики для пользователя
     """
-    cursor.execute("""
-        SELECT id, telegram_id, full_name, attention_score, group_id, role 
-        FROM users 
-        WHERE telegram_id = ?
-    """, (user_id,))
-    user_info = cursor.fetchone()
+    user_info = await get_user(user_id)
     
     if not user_info:
         return None
     
-    cursor.execute("""
-        WITH user_poll_stats AS (
-            SELECT 
-                p.id AS poll_id,
-                p.question,
-                MAX(CASE WHEN o.is_answer = 1 THEN 1 ELSE 0 END) AS correct_option_exists,
-                MAX(CASE WHEN uo.option_id IS NOT NULL THEN 1 ELSE 0 END) AS user_answered,
-                MAX(CASE WHEN uo.option_id IS NOT NULL AND o.is_answer = 1 THEN 1 ELSE 0 END) AS user_correct_answer
-            FROM polls p
-            JOIN groups g ON p.group_id = g.id
-            JOIN options o ON o.poll_id = p.id
-            LEFT JOIN user_options uo ON uo.option_id = o.id AND uo.user_id = ?
-            WHERE g.id = ?
-            GROUP BY p.id
-        )
+    poll_stats = await db.fetchone("""
         SELECT 
-            COUNT(*) as total_polls,
-            COUNT(CASE WHEN user_answered = 1 THEN 1 END) as completed_polls,
-            ROUND(COUNT(CASE WHEN user_answered = 1 THEN 1 END) * 100.0 / COUNT(*), 2) as completion_rate,
-            ROUND(COUNT(CASE WHEN user_correct_answer = 1 THEN 1 END) * 100.0 / COUNT(CASE WHEN correct_option_exists = 1 THEN 1 END), 2) as correct_answers_rate
-        FROM user_poll_stats
-        WHERE correct_option_exists = 1
-    """, (user_info[0], user_info[4]))
-    poll_stats = cursor.fetchone()
-    
-    cursor.execute("""
-        SELECT name FROM groups WHERE id = ?
-    """, (user_info[4],))
-    group_info = cursor.fetchone()
+            s.total_polls,
+            s.completed_polls,
+            ROUND(s.completed_polls * 100.0 / s.total_polls, 2) as completion_rate,
+            ROUND(s.correct_polls * 100.0 / s.total_polls, 2) as correct_answers_rate,
+            g.name
+        FROM user_stats s
+        LEFT JOIN groups g ON g.id = ?
+        WHERE s.user_id = ?
+    """, (user_info.group_id, user_info.id))
+    poll_stats = poll_stats or (0, 0, None, None, None)
     
     return {
-        "user_id": user_info[1],
-        "full_name": user_info[2],
-        "attention_score": user_info[3],
-        "role": user_info[5],
-        "group_name": group_info[0] if group_info else None,
+        "user_id": user_info.telegram_id,
+        "full_name": user_info.full_name,
+        "attention_score": user_info.attention_score,
+        "role": user_info.role,
+        "group_name": poll_stats[4],
         "total_polls": poll_stats[0],
         "completed_polls": poll_stats[1],
         "completion_rate": poll_stats[2],
         "correct_answers_rate": poll_stats[3]
     }
 
-async def get_admin_user_statistics(cursor):
+async def get_admin_user_statistics(db: Database, group_id: int | None = None, after_id: int | None = None, before_id: int | None = None, limit: int = STATS_PAGE_SIZE):
     """
-    Получение полной статистики пользователей для администратора
+    Получение страницы статистики пользователей для администратора
+
+    Страницы выбираются по ключу users.id, поэтому стоимость запроса не зависит
+    от номера страницы.
+
+    Args:
+        group_id (int | None): Фильтр по группе
+        after_id (int | None): Следующая страница - пользователи с id больше указанного
+        before_id (int | None): Предыдущая страница - пользователи с id меньше указанного
+        limit (int): Размер страницы
+
+    Returns:
+        tuple[list[dict], bool, bool]: Строки страницы, есть ли предыдущая и следующая страницы
     """
-    cursor.execute("""
-        WITH user_poll_stats AS (
-            SELECT 
-                u.id AS user_id,
-                u.telegram_id,
-                u.full_name,
-                u.attention_score,
-                u.role,
-                g.name as group_name,
-                p.id AS poll_id,
-                MAX(CASE WHEN o.is_answer = 1 THEN 1 ELSE 0 END) AS correct_option_exists,
-                MAX(CASE WHEN uo.option_id IS NOT NULL THEN 1 ELSE 0 END) AS user_answered,
-                MAX(CASE WHEN uo.option_id IS NOT NULL AND o.is_answer = 1 THEN 1 ELSE 0 END) AS user_correct_answer
-            FROM users u
-            LEFT JOIN groups g ON u.group_id = g.id
-            LEFT JOIN polls p ON p.group_id = g.id
-            LEFT JOIN options o ON o.poll_id = p.id
-            LEFT JOIN user_options uo ON uo.option_id = o.id AND uo.user_id = u.id
-            GROUP BY u.id, p.id
-        )
+    conditions = ["s.total_polls > 0", "u.role != ?"]
+    params: list = [Roles.admin]
+    if group_id is not None:
+        conditions.append("u.group_id = ?")
+        params.append(group_id)
+
+    backwards = before_id is not None
+    if backwards:
+        conditions.append("u.id < ?")
+        params.append(before_id)
+    elif after_id is not None:
+        conditions.append("u.id > ?")
+        params.append(after_id)
+    params.append(limit + 1)
+
+    users_stats = await db.fetchall(f"""
         SELECT 
-            telegram_id,
-            full_name,
-            attention_score,
-            role,
-            group_name,
-            COUNT(DISTINCT poll_id) as total_polls,
-            COUNT(DISTINCT CASE WHEN user_answered = 1 THEN poll_id END) as completed_polls,
-            ROUND(COUNT(DISTINCT CASE WHEN user_answered = 1 THEN poll_id END) * 100.0 / COUNT(DISTINCT poll_id), 2) as completion_rate,
-            ROUND(COUNT(DISTINCT CASE WHEN user_correct_answer = 1 THEN poll_id END) * 100.0 / COUNT(DISTINCT CASE WHEN correct_option_exists = 1 THEN poll_id END), 2) as correct_answers_rate
-        FROM user_poll_stats
-        WHERE correct_option_exists = 1 AND role != ?
-        GROUP BY telegram_id
-        ORDER BY role, correct_answers_rate DESC
-    """, (Roles.admin, ))
-    
-    users_stats = cursor.fetchall()
+            u.id,
+            u.telegram_id,
+            u.full_name,
+            u.attention_score,
+            u.role,
+            g.name as group_name,
+            s.total_polls,
+            s.completed_polls,
+            ROUND(s.completed_polls * 100.0 / s.total_polls, 2) as completion_rate,
+            ROUND(s.correct_polls * 100.0 / s.total_polls, 2) as correct_answers_rate
+        FROM users u
+        JOIN user_stats s ON s.user_id = u.id
+        LEFT JOIN groups g ON u.group_id = g.id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY u.id {"DESC" if backwards else "ASC"}
+        LIMIT ?
+    """, params)
+
+    has_more = len(users_stats) > limit
+    users_stats = users_stats[:limit]
+    if backwards:
+        users_stats.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after_id is not None, has_more
     
     return [
         {
-            "user_id": user[0],
-            "full_name": user[1],
-            "attention_score": user[2],
-            "role": user[3],
-            "group_name": user[4],
-            "total_polls": user[5],
-            "completed_polls": user[6],
-            "completion_rate": user[7],
-            "correct_answers_rate": user[8]
+            "id": user[0],
+            "user_id": user[1],
+            "full_name": user[2],
+            "attention_score": user[3],
+            "role": user[4],
+            "group_name": user[5],
+            "total_polls": user[6],
+            "completed_polls": user[7],
+            "completion_rate": user[8],
+            "correct_answers_rate": user[9]
         } for user in users_stats
-    ]
\ No newline at end of file
+    ], has_prev, has_next
+
+
+async def get_groups_page(db: Database, after_id: int | None = None, before_id: int | None = None, limit: int = GROUPS_PAGE_SIZE):
+    """
+    Получение страницы списка групп, по ключу groups.id, как в get_admin_user_statistics
+
+    Returns:
+        tuple[list[tuple], bool, bool]: (id, name) групп страницы, есть ли предыдущая и следующая страницы
+    """
+    backwards = before_id is not None
+    if backwards:
+        condition, params = "WHERE id < ?", [before_id]
+    elif after_id is not None:
+        condition, params = "WHERE id > ?", [after_id]
+    else:
+        condition, params = "", []
+    params.append(limit + 1)
+
+    groups = await db.fetchall(f"""
+        SELECT id, name FROM groups
+        {condition}
+        ORDER BY id {"DESC" if backwards else "ASC"}
+        LIMIT ?
+    """, params)
+
+    has_more = len(groups) > limit
+    groups = groups[:limit]
+    if backwards:
+        groups.reverse()
+        return groups, has_more, True
+    return groups, after_id is not None, has_more
@@ -0,0 +1,182 @@
+from datetime import datetime
+import asyncio
+import sqlite3
+
+from db import Database, db
+from stats import on_answer
+from utils import calculate_attention_score
+
+ANSWER_BATCH_SIZE = 100
+ANSWER_BATCH_DELAY = 0.02  # секунд
+
+
+class AlreadyAnswered(Exception):
+    pass
+
+
+class PollClosed(Exception):
+    pass
+
+
+def save_answer(conn: sqlite3.Connection, user_id: int, option_id: int) -> float:
+    """
+    Запись ответа студента и пересчёт его коэффициента внимательности
+
+    Returns:
+        float: Новый коэффициент внимательности
+    """
+    poll = conn.execute("""
+        SELECT p.id, p.is_active, p.expires_at, o.is_answer FROM options o
+        JOIN polls p ON p.id = o.poll_id
+        WHERE o.id = ?
+    """, (option_id,)).fetchone()
+    if not poll or not poll[1] or datetime.fromisoformat(poll[2]) <= datetime.now():
+        raise PollClosed()
+    poll_id, _, _, is_correct_answer = poll
+
+    already_answered = conn.execute("""
+        SELECT 1 FROM user_options uo
+        JOIN options o ON o.id = uo.option_id
+        WHERE uo.user_id = ? AND o.poll_id = ?
+    """, (user_id, poll_id)).fetchone()
+    if already_answered:
+        raise AlreadyAnswered()
+
+    # Опросы группы считаются по текущий включительно, чтобы пересчёт
+    # по истории ответов (rescore.py) давал тот же результат. Архивные
+    # опросы все старше активных, поэтому учитываются целиком
+    current_attention_score, correct_answers, total_polls = conn.execute("""
+        SELECT u.attention_score, COALESCE(s.correct_polls, 0), (
+            SELECT COUNT(*) FROM polls p
+            WHERE p.group_id = u.group_id AND p.id <= ?
+              AND EXISTS (SELECT 1 FROM options o WHERE o.poll_id = p.id AND o.is_answer = 1)
+        ) + COALESCE(ag.polls, 0)
+        FROM users u
+        LEFT JOIN user_stats s ON s.user_id = u.id
+        LEFT JOIN archive.group_polls ag ON ag.group_id = u.group_id
+        WHERE u.id = ?
+    """, (poll_id, user_id)).fetchone()
+
+    new_attention_score = calculate_attention_score(
+        current_attention_score,
+        is_correct_answer,
+        total_polls,
+        correct_answers
+    )
+
+    conn.execute(
+        "INSERT INTO user_options (user_id, option_id) VALUES (?, ?)",
+        (user_id, option_id)
+    )
+    conn.execute(
+        "UPDATE users SET attention_score = ? WHERE id = ?",
+        (new_attention_score, user_id)
+    )
+    on_answer(conn, user_id, is_correct_answer)
+    return new_attention_score
+
+
+def save_answers_batch(conn: sqlite3.Connection, answers: list[tuple[int, int]]) -> list[float | Exception]:
+    """
+    Запись пачки ответов в одной транзакции.
+
+    Каждый ответ выполняется внутри своей точки сохранения: ошибка одного
+    ответа (повтор, нарушение UNIQUE) откатывает только его.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+    results = []
+    for user_id, option_id in answers:
+        conn.execute("SAVEPOINT answer")
+        try:
+            results.append(save_answer(conn, user_id, option_id))
+        except (AlreadyAnswered, PollClosed, sqlite3.IntegrityError) as e:
+            conn.execute("ROLLBACK TO answer")
+            results.append(e)
+        conn.execute("RELEASE answer")
+    return results
+
+
+class AnswerWriter():
+    """
+    Групповая запись ответов.
+
+    Ответы копятся в очереди и записываются одной транзакцией, когда набралось
+    ANSWER_BATCH_SIZE ответов или прошло ANSWER_BATCH_DELAY секунд с первого
+    ответа в очереди. submit завершается только после фиксации транзакции.
+    """
+
+    def __init__(self, db: Database, batch_size: int = ANSWER_BATCH_SIZE, batch_delay: float = ANSWER_BATCH_DELAY):
+        self.db = db
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._pending: list[tuple[int, int, asyncio.Future]] = []
+        self._timer: asyncio.Task | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def submit(self, user_id: int, option_id: int) -> float:
+        """
+        Returns:
+            float: Новый коэффициент внимательности
+
+        Raises:
+            AlreadyAnswered: Пользователь уже ответил на этот опрос
+            PollClosed: Опрос завершён или не существует
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((user_id, option_id, future))
+
+        if len(self._pending) >= self.batch_size:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_delay)
+        self._timer = None
+        self._start_flush()
+
+    def _start_flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[int, int, asyncio.Future]]):
+        try:
+            results = await self.db.transaction(
+                save_answers_batch,
+                [(user_id, option_id) for user_id, option_id, _ in batch]
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+answer_writer = AnswerWriter(db)